@@ -0,0 +1,157 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from metrics import register_collector
+
+# -----------------------
+# CONFIGURATION CACHE DES RÉPONSES
+# -----------------------
+
+# Chemin du cache persistant (vide pour le désactiver)
+ANSWER_CACHE_PATH = os.environ.get("RAG_ANSWER_CACHE", os.path.join("data", "answer_cache.sqlite"))
+# Similarité cosinus minimale entre deux questions pour réutiliser une réponse
+ANSWER_CACHE_THRESHOLD = float(os.environ.get("RAG_ANSWER_CACHE_THRESHOLD", 0.95))
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("RAG_ANSWER_CACHE_MAX_ENTRIES", 5000))
+# Durée de vie en secondes (0 = sans expiration)
+ANSWER_CACHE_TTL = float(os.environ.get("RAG_ANSWER_CACHE_TTL", 7 * 24 * 3600))
+
+def context_key(context_chunks_with_metadata, settings_signature, history=()):
+    """Clé du contexte : chunks récupérés (identifiant + contenu), réglages du modèle/prompt et
+    messages d'historique envoyés avec la question (une relance dépend des échanges précédents)"""
+    parts = sorted(
+        f"{chunk.get('chunk_id')}:{chunk.get('chunk_hash') or hashlib.sha256(chunk['text'].encode()).hexdigest()[:16]}"
+        for chunk in context_chunks_with_metadata
+    )
+    history_hash = hashlib.sha256(
+        json.dumps([[msg["type"], msg["text"]] for msg in history], ensure_ascii=False).encode()
+    ).hexdigest()
+    return hashlib.sha256("|".join([settings_signature, history_hash] + parts).encode()).hexdigest()
+
+class SemanticAnswerCache:
+    """Cache persistant (SQLite) des réponses du LLM, interrogé par similarité de question
+
+    Une réponse n'est réutilisée que pour exactement le même ensemble de chunks et les mêmes
+    réglages (clé de contexte), et pour une question assez proche (cosinus >= seuil), ce qui
+    couvre aussi les reformulations.
+    """
+    def __init__(self, path, threshold=ANSWER_CACHE_THRESHOLD,
+                 max_entries=ANSWER_CACHE_MAX_ENTRIES, ttl=ANSWER_CACHE_TTL):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS answers (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                context_key TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                question TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                file_hashes TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answers_context ON answers (context_key)")
+        self._conn.commit()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def lookup(self, key, question_embedding):
+        """Retourne la réponse en cache la plus proche, ou None"""
+        query = self._normalize(question_embedding)
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, embedding, answer, created_at FROM answers WHERE context_key = ?", (key,)
+            ).fetchall()
+            best_id, best_answer, best_score = None, None, self.threshold
+            for row_id, blob, answer, created_at in rows:
+                if self.ttl and now - created_at > self.ttl:
+                    continue
+                score = float(np.dot(query, np.frombuffer(blob, dtype=np.float32)))
+                if score >= best_score:
+                    best_id, best_answer, best_score = row_id, answer, score
+
+            if best_id is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE answers SET last_used = ? WHERE id = ?", (now, best_id))
+            self._conn.commit()
+            self.hits += 1
+            return best_answer
+
+    def store(self, key, question_embedding, question, answer, file_hashes):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO answers (context_key, embedding, question, answer, file_hashes, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, self._normalize(question_embedding).tobytes(), question, answer,
+                 json.dumps(sorted(set(file_hashes))), now, now)
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now):
+        if self.ttl:
+            self._conn.execute("DELETE FROM answers WHERE created_at < ?", (now - self.ttl,))
+        # Éviction LRU au-delà de la taille maximale
+        self._conn.execute(
+            "DELETE FROM answers WHERE id IN (SELECT id FROM answers ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+
+    def invalidate_documents(self, file_hashes):
+        """Supprime les réponses construites à partir des documents donnés"""
+        file_hashes = set(file_hashes)
+        with self._lock:
+            rows = self._conn.execute("SELECT id, file_hashes FROM answers").fetchall()
+            stale = [(row_id,) for row_id, hashes in rows if file_hashes & set(json.loads(hashes))]
+            self._conn.executemany("DELETE FROM answers WHERE id = ?", stale)
+            self._conn.commit()
+        return len(stale)
+
+    def stats(self):
+        total = self.hits + self.misses
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        return {'size': size, 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0}
+
+_answer_cache = None
+_answer_cache_lock = threading.Lock()
+
+def get_answer_cache():
+    """Cache de réponses partagé par le processus (None si désactivé)"""
+    global _answer_cache
+    if not ANSWER_CACHE_PATH:
+        return None
+    with _answer_cache_lock:
+        if _answer_cache is None:
+            _answer_cache = SemanticAnswerCache(ANSWER_CACHE_PATH)
+    return _answer_cache
+
+def _answer_cache_metrics():
+    if _answer_cache is None:
+        return []
+    stats = _answer_cache.stats()
+    return [(f"rag_answer_cache_{field}", {}, stats[field]) for field in ("size", "hits", "misses", "hit_rate")]
+
+register_collector(_answer_cache_metrics)
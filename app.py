@@ -1,11 +1,18 @@
 import streamlit as st
 from datetime import datetime
 import os
+import time
 
 # Import des modules séparés
-from mistral_client import call_mistral_api, smart_text_analysis_with_mistral
-from rag_system import FAISSIndex, process_multiple_files
-from utils import extract_text, split_text
+from mistral_client import (MAX_CONTEXT_CHUNKS, format_citation, smart_text_analysis_stream,
+                            smart_text_analysis_with_mistral)
+from rag_system import MAX_FILES, get_shared_index, load_persisted_index, process_multiple_files
+from embeddings import models_ready, start_background_warmup
+from metrics import METRICS_ENABLED, METRICS_PORT, registry, serve_metrics, trace
+from query_cache import query_cache_stats
+from answer_cache import get_answer_cache
+from reranker import RERANK_ENABLED, warmup_reranker
+from retrieval_client import SERVICE_URL, RemoteIndex
 
 # Configuration pour le déploiement
 if not os.path.exists('uploads'):
@@ -13,6 +20,21 @@ if not os.path.exists('uploads'):
 if not os.path.exists('data'):
     os.makedirs('data', exist_ok=True)
 
+# Affichage des réponses au fil de l'eau (flux SSE de Mistral)
+STREAM_ANSWERS = os.environ.get("RAG_STREAM_ANSWERS", "1") == "1"
+# Fichiers détaillés un par un dans la vue d'import
+SHOWN_FILES = 20
+
+# Préchargement du modèle d'embeddings partagé (une seule fois par processus), en arrière-plan
+# pour que l'interface s'affiche immédiatement ; inutile quand la recherche est déléguée au
+# service (RAG_SERVICE_URL)
+if not SERVICE_URL and os.environ.get("RAG_EMBEDDING_WARMUP", "1") == "1":
+    start_background_warmup(*([warmup_reranker] if RERANK_ENABLED else []))
+
+# Export Prometheus du processus Streamlit (GET :RAG_METRICS_PORT/metrics)
+if METRICS_ENABLED and METRICS_PORT:
+    serve_metrics(METRICS_PORT)
+
 # Configuration du style CSS
 st.markdown("""
 <style>
@@ -31,6 +53,13 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+def format_timings(timings):
+    """Résumé des latences par étape, ex. 'recherche 12 ms · rerank 340 ms · LLM 2.1 s'"""
+    parts = []
+    for stage, seconds in timings.items():
+        parts.append(f"{stage} {seconds * 1000:.0f} ms" if seconds < 1 else f"{stage} {seconds:.1f} s")
+    return " · ".join(parts)
+
 # Initialisation de l'état de session
 def initialize_session_state():
     if "active_view" not in st.session_state:
@@ -44,12 +73,20 @@ Je suis votre expert IA pour analyser et comprendre vos documents avec les techn
 
 
 Je fournirai des réponses intelligentes basées sur la recherche vectorielle avancée.
-        """}
+        """, "grounded": False}
     ]
     if "uploaded_files" not in st.session_state:
         st.session_state.uploaded_files = []
-    if "text_index" not in st.session_state:
-        st.session_state.text_index = None
+    if SERVICE_URL:
+        if "text_index" not in st.session_state:
+            # Client léger : index, modèles et ingestion vivent dans retrieval_service.py
+            st.session_state.text_index = RemoteIndex()
+    else:
+        # Index sauvegardé dans data/ (lecture différée), vérifié à chaque exécution : une session
+        # ouverte avant la première sauvegarde voit les documents ajoutés depuis une autre session
+        persisted = load_persisted_index()
+        if persisted is not None or st.session_state.get("text_index") is None:
+            st.session_state.text_index = persisted
     if "document_chunks" not in st.session_state:
         st.session_state.document_chunks = []
     if "document_texts" not in st.session_state:
@@ -90,7 +127,8 @@ def render_sidebar():
 
         if st.button("🔄 Nouvelle Conversation", use_container_width=True):
             st.session_state.messages = [
-                {"type": "answer", "text": "🔄 Nouvelle conversation démarrée. Posez vos questions sur les documents !"}
+                {"type": "answer", "text": "🔄 Nouvelle conversation démarrée. Posez vos questions sur les documents !",
+                 "grounded": False}
             ]
             st.session_state.show_help = False
             st.session_state.show_history = False
@@ -115,6 +153,9 @@ def render_sidebar():
             - Support multi-documents
             """)
 
+        if not models_ready():
+            st.caption("⏳ Chargement des modèles en arrière-plan...")
+
         # Affichage des documents chargés
         if st.session_state.text_index and st.session_state.text_index.ntotal > 0:
             st.markdown("---")
@@ -129,6 +170,23 @@ def render_sidebar():
                 for doc_name, chunk_count in doc_stats.items():
                     st.markdown(f"• `{doc_name}`  \n  ({chunk_count} embeddings)")
 
+                results_stats = query_cache_stats()['results']
+                lookups = results_stats['hits'] + results_stats['misses']
+                st.caption(f"⚡ Cache de recherche : {results_stats['hit_rate']:.0%} de succès ({results_stats['hits']}/{lookups})")
+
+                document_hashes = st.session_state.text_index.get_document_hashes()
+                for file_hash, doc_name in document_hashes.items():
+                    if st.button(f"🗑️ Retirer {doc_name}", key=f"remove_{file_hash}", use_container_width=True):
+                        st.session_state.text_index.remove_document(file_hash)
+                        st.session_state.text_index.save()
+                        answer_cache = get_answer_cache()
+                        if answer_cache is not None:
+                            answer_cache.invalidate_documents([file_hash])
+                        st.session_state.document_texts.pop(file_hash, None)
+                        st.rerun()
+
+        render_diagnostics()
+
         # Historique des conversations
         if st.session_state.show_history:
             st.markdown("---")
@@ -150,20 +208,47 @@ def render_sidebar():
             else:
                 st.info("Aucune conversation en cours.")
 
+def render_diagnostics():
+    """Panneau de diagnostic (RAG_METRICS=1) : latences par étape, compteurs et caches"""
+    if not METRICS_ENABLED:
+        return
+    st.markdown("---")
+    with st.expander("🩺 Diagnostics"):
+        stages = registry.stage_stats()
+        if stages:
+            st.markdown("**Latences par étape (processus)**")
+            st.dataframe(
+                [{"étape": stage, "appels": stats['count'], "moyenne (ms)": round(stats['mean_ms'], 1),
+                  "p95 (ms)": round(stats['p95_ms'], 1)} for stage, stats in stages.items()],
+                hide_index=True, use_container_width=True
+            )
+        counters = registry.counters()
+        if counters:
+            st.markdown("**Compteurs**")
+            st.code("\n".join(f"{name} {value:g}" for name, value in counters.items()), language=None)
+        gauges = {name: value for name, value in registry.gauges().items() if "hit_rate" in name}
+        if gauges:
+            st.markdown("**Taux de succès des caches**")
+            for name, value in gauges.items():
+                st.caption(f"{name} : {value:.0%}")
+        if SERVICE_URL:
+            st.caption(f"Recherche et ingestion : voir {SERVICE_URL}/metrics")
+
 def render_upload_view():
     """Affiche la vue d'upload des documents"""
     st.header("📄 Importation de Documents")
     
     uploaded_files = st.file_uploader(
-        "Choisissez jusqu'à 5 documents PDF ou DOCX",
+        f"Choisissez jusqu'à {MAX_FILES} documents PDF ou DOCX",
         type=["pdf", "docx"],
         accept_multiple_files=True,
-        help="Formats supportés : PDF, DOCX - Maximum 5 fichiers"
+        help=f"Formats supportés : PDF, DOCX - Maximum {MAX_FILES} fichiers"
     )
     
     if uploaded_files:
         st.markdown("### 📁 Fichiers Sélectionnés")
-        for i, file in enumerate(uploaded_files, 1):
+        # Au-delà d'une vingtaine de fichiers, la liste détaillée est résumée
+        for i, file in enumerate(uploaded_files[:SHOWN_FILES], 1):
             st.markdown(f"""
             <div style='background: #f8f9fa; padding: 1rem; border-radius: 8px; margin: 0.5rem 0;'>
                 <strong>{i}. {file.name}</strong>
@@ -172,19 +257,32 @@ def render_upload_view():
                 </div>
             </div>
             """, unsafe_allow_html=True)
+        if len(uploaded_files) > SHOWN_FILES:
+            total_size = sum(file.size for file in uploaded_files)
+            st.caption(f"… et {len(uploaded_files) - SHOWN_FILES} autres fichiers "
+                       f"({len(uploaded_files)} au total, {total_size // 1024 ** 2} Mo)")
         
         if st.button("🚀 Indexer avec FAISS et LangChain", type="primary", use_container_width=True):
-            if len(uploaded_files) > 5:
-                st.error("❌ Maximum 5 fichiers autorisés")
+            if len(uploaded_files) > MAX_FILES:
+                st.error(f"❌ Maximum {MAX_FILES} fichiers autorisés")
             else:
+                # Ajout incrémental : seuls les nouveaux fichiers sont vectorisés, dans l'index
+                # sauvegardé (ou partagé) plutôt qu'un index propre à la session
+                if st.session_state.text_index is None:
+                    st.session_state.text_index = get_shared_index()
+
                 with st.spinner("🔍 Création de l'index FAISS avec LangChain..."):
-                    all_chunks, processed_files = process_multiple_files(uploaded_files, st.session_state.document_texts)
+                    chunk_count, processed_files = process_multiple_files(
+                        uploaded_files,
+                        st.session_state.document_texts,
+                        index=st.session_state.text_index
+                    )
                     
-                    if not all_chunks:
+                    if not processed_files:
                         st.error("❌ Aucun document valide n'a pu être analysé.")
                     else:
-                        st.session_state.text_index = FAISSIndex()
-                        st.session_state.text_index.add(all_chunks)
+                        if chunk_count:
+                            st.session_state.text_index.save()
                         
                         st.success(f"✅ **{len(processed_files)} document(s) indexé(s) avec FAISS !**")
                         
@@ -192,7 +290,7 @@ def render_upload_view():
                         with col1:
                             st.metric("📚 Documents", len(processed_files))
                         with col2:
-                            st.metric("🔢 Segments", len(all_chunks))
+                            st.metric("🔢 Segments", chunk_count)
                         with col3:
                             st.metric("🔍 Technologie", "FAISS")
                         
@@ -232,6 +330,10 @@ def render_chat_view():
                     st.write(msg["text"])
                     if "time" in msg:
                         st.caption(f"🕒 {msg['time']}")
+                    if msg.get("timings"):
+                        st.caption(f"⏱️ {format_timings(msg['timings'])}")
+                    if msg.get("trace"):
+                        st.caption(f"🔬 {format_timings(msg['trace'])}")
 
     if prompt := st.chat_input("Posez votre question sur les documents..."):
         current_time = datetime.now().strftime("%H:%M")
@@ -244,29 +346,58 @@ def render_chat_view():
                 st.write(prompt)
                 st.caption(f"🕒 {current_time}")
         
-        with st.spinner("🔍 Recherche vectorielle FAISS en cours..."):
-            scores, indices, context_chunks_with_metadata = st.session_state.text_index.search(prompt, k=8)
+        # Détail par étape (embedding, FAISS, BM25, prompt, LLM) quand les métriques sont actives
+        with trace() as stages:
+            with st.spinner("🔍 Recherche vectorielle FAISS en cours..."):
+                # Les échanges précédents enrichissent la recherche des questions de relance
+                context_chunks_with_metadata, question_embedding, timings = st.session_state.text_index.retrieve(
+                    prompt, max_chunks=MAX_CONTEXT_CHUNKS, history=st.session_state.messages[:-1]
+                )
             
-            if context_chunks_with_metadata:
-                sources = list(set(chunk['source'] for chunk in context_chunks_with_metadata))
-                if len(sources) > 0:
-                    st.info(f"📖 **Sources trouvées par FAISS :** {', '.join(sources[:3])}" + ("..." if len(sources) > 3 else ""))
+                if context_chunks_with_metadata:
+                    # Références construites depuis les métadonnées (fichier et pages)
+                    sources = list(dict.fromkeys(format_citation(chunk) for chunk in context_chunks_with_metadata))
+                    if len(sources) > 0:
+                        st.info(f"📖 **Sources trouvées par FAISS :** {', '.join(sources[:3])}" + ("..." if len(sources) > 3 else ""))
         
-        with st.spinner("🤖 Analyse avec Mistral AI..."):
-            answer = smart_text_analysis_with_mistral(
-                context_chunks_with_metadata, 
-                prompt, 
-                st.session_state.messages
-            )
+            started = time.perf_counter()
+            # Origine de la réponse : seules les réponses tirées des documents (LLM ou cache)
+            # servent ensuite à reformuler les questions de relance
+            outcome = {}
+            if STREAM_ANSWERS:
+                # Les morceaux s'affichent dès leur arrivée ; un nouveau rerun interrompt le flux
+                with chat_container:
+                    with st.chat_message("assistant", avatar="🤖"):
+                        answer = st.write_stream(smart_text_analysis_stream(
+                            context_chunks_with_metadata,
+                            prompt,
+                            st.session_state.messages,
+                            question_embedding=question_embedding,
+                            outcome=outcome
+                        ))
+                        st.caption(f"🕒 {current_time}")
+            else:
+                with st.spinner("🤖 Analyse avec Mistral AI..."):
+                    answer = smart_text_analysis_with_mistral(
+                        context_chunks_with_metadata, 
+                        prompt, 
+                        st.session_state.messages,
+                        question_embedding=question_embedding,
+                        outcome=outcome
+                    )
         
+            timings["LLM"] = time.perf_counter() - started
+
         st.session_state.messages.append(
-            {"type": "answer", "text": answer, "time": current_time}
+            {"type": "answer", "text": answer, "time": current_time, "timings": timings, "trace": stages,
+             "grounded": outcome.get('source') in ("LLM", "cache")}
         )
         
-        with chat_container:
-            with st.chat_message("assistant", avatar="🤖"):
-                st.write(answer)
-                st.caption(f"🕒 {current_time}")
+        if not STREAM_ANSWERS:
+            with chat_container:
+                with st.chat_message("assistant", avatar="🤖"):
+                    st.write(answer)
+                    st.caption(f"🕒 {current_time}")
         
         st.rerun()
 
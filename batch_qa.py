@@ -0,0 +1,209 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import mistral_client
+from llm_client import LLM_MAX_CONCURRENCY, LLM_RATE_LIMIT, AsyncLLMClient, LLMAPIError
+from metrics import inc
+from mistral_client import build_mistral_payload, canned_answer, format_citation, record_token_usage
+from rag_system import FAISSIndex
+
+# -----------------------
+# CONFIGURATION QUESTIONS-RÉPONSES EN LOT
+# -----------------------
+
+# Questions vectorisées et cherchées ensemble (un passage du modèle, un appel FAISS)
+BATCH_SIZE = int(os.environ.get("RAG_BATCH_SIZE", 64))
+# Réponses en attente d'écriture au-delà des appels en cours (borne la mémoire)
+MAX_PENDING_FACTOR = 4
+PROGRESS_EVERY = 50
+
+def read_questions(path):
+    """Lit un JSONL de questions : {"id"?, "question", "history"?} ; l'id par défaut est le n° de ligne"""
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if isinstance(item, str):
+                item = {'question': item}
+            item.setdefault('id', str(line_number))
+            item['id'] = str(item['id'])
+            yield item
+
+def prepare_output(path, require_answer=True):
+    """Prépare la reprise d'un fichier de sortie existant ; retourne les identifiants déjà répondus
+
+    Le fichier est réécrit avec une seule ligne par identifiant répondu sans erreur : la ligne
+    tronquée par une interruption et les échecs (qui seront retentés) disparaissent, ce qui
+    évite les doublons et garantit que la prochaine ligne commence sur une ligne neuve.
+    Avec require_answer, les lignes sans réponse (exécution --retrieval-only) sont aussi
+    retentées.
+    """
+    if not os.path.exists(path):
+        return set()
+    records = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Dernière ligne tronquée par une interruption
+                continue
+            if record.get('error') is None and (record.get('answer') is not None or not require_answer):
+                records[str(record['id'])] = record
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        for record in records.values():
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    os.replace(path + ".tmp", path)
+    return set(records)
+
+def batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def source_records(context):
+    return [{
+        'chunk_id': chunk.get('chunk_id'),
+        'source': chunk['source'],
+        'citation': format_citation(chunk),
+        'page_start': chunk.get('page_start'),
+        'page_end': chunk.get('page_end'),
+        'score': chunk.get('score'),
+        'similarity': chunk.get('similarity'),
+        'rerank_score': chunk.get('rerank_score')
+    } for chunk in context]
+
+async def answer_question(client, item, context, timings, use_llm=True):
+    """Réponse d'une question déjà associée à son contexte ; retourne l'enregistrement de sortie"""
+    record = {
+        'id': item['id'],
+        'question': item['question'],
+        'answer': None,
+        'sources': source_records(context),
+        'timings': timings,
+        'usage': None,
+        'error': None
+    }
+    answer = canned_answer(context, item['question'])
+    if answer is not None:
+        record['answer'] = answer
+        inc("rag_answers_total", source="prédéfinie")
+        return record
+    if not use_llm:
+        return record
+
+    payload = build_mistral_payload(context, item['question'], item.get('history') or [])
+    started = time.perf_counter()
+    try:
+        # Tentatives, limite de débit et concurrence sont gérées par le client
+        result = await client.complete(payload)
+        record['answer'] = result["choices"][0]["message"]["content"]
+        record['usage'] = result.get("usage")
+        inc("rag_answers_total", source="LLM")
+        inc("rag_llm_requests_total", status="ok")
+        record_token_usage(payload, record['answer'], record['usage'])
+    except LLMAPIError as e:
+        record['error'] = str(e)
+        inc("rag_llm_requests_total", status="error")
+    except Exception as e:
+        record['error'] = str(e) or type(e).__name__
+        inc("rag_llm_requests_total", status="error")
+    timings["LLM"] = time.perf_counter() - started
+    return record
+
+async def run_batch(index, questions, output_path, concurrency=LLM_MAX_CONCURRENCY, rate_limit=LLM_RATE_LIMIT,
+                    batch_size=BATCH_SIZE, k=None, use_rerank=None, max_chunks=None, use_llm=True,
+                    progress=None):
+    """Répond à toutes les questions et ajoute une ligne JSON par réponse dans output_path
+
+    La recherche d'un lot (dans un thread) se fait pendant que les appels LLM du lot précédent
+    sont en vol. Les lignes sont écrites dans l'ordre d'arrivée et vidées sur disque une à une :
+    une exécution interrompue reprend en sautant les identifiants déjà répondus.
+    """
+    max_chunks = max_chunks or mistral_client.MAX_CONTEXT_CHUNKS
+    done = prepare_output(output_path, require_answer=use_llm)
+    remaining = (item for item in questions if item['id'] not in done)
+    stats = {'skipped': len(done), 'answered': 0, 'errors': 0}
+    max_pending = max(1, concurrency) * MAX_PENDING_FACTOR
+    started = time.perf_counter()
+
+    async with AsyncLLMClient(mistral_client.MISTRAL_API_URL, mistral_client.MISTRAL_API_KEY,
+                              timeout=mistral_client.MISTRAL_TIMEOUT, max_concurrency=concurrency,
+                              rate_limit=rate_limit, pool_size=max(concurrency, 1)) as client:
+        with open(output_path, "a", encoding="utf-8") as output:
+            pending = set()
+
+            def write(record):
+                output.write(json.dumps(record, ensure_ascii=False) + "\n")
+                output.flush()
+                stats['errors' if record['error'] else 'answered'] += 1
+                total = stats['answered'] + stats['errors']
+                if progress is not None and total % PROGRESS_EVERY == 0:
+                    progress(stats, time.perf_counter() - started)
+
+            async def collect(wait_all=False):
+                nonlocal pending
+                while pending and (wait_all or len(pending) >= max_pending):
+                    finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in finished:
+                        write(task.result())
+
+            try:
+                for batch in batches(remaining, batch_size):
+                    retrieved = await asyncio.to_thread(
+                        index.retrieve_many, [item['question'] for item in batch], k, use_rerank, max_chunks,
+                        histories=[item.get('history') or [] for item in batch]
+                    )
+                    for item, (context, _, timings) in zip(batch, retrieved):
+                        pending.add(asyncio.create_task(answer_question(client, item, context, timings, use_llm)))
+                        await collect()
+                await collect(wait_all=True)
+            finally:
+                for task in pending:
+                    task.cancel()
+    stats['elapsed'] = time.perf_counter() - started
+    stats['llm'] = dict(client.stats)
+    return stats
+
+def print_progress(stats, elapsed):
+    total = stats['answered'] + stats['errors']
+    print(f"{total} réponses ({stats['errors']} erreurs) en {elapsed:.0f} s, {total / max(elapsed, 1e-9):.1f}/s",
+          file=sys.stderr, flush=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Questions-réponses en lot sur un index sauvegardé (JSONL -> JSONL)")
+    parser.add_argument("questions", help='fichier JSONL : {"id": ..., "question": ..., "history": [...]}')
+    parser.add_argument("--output", default="answers.jsonl", help="fichier JSONL de sortie (complété en cas de reprise)")
+    parser.add_argument("--index-dir", default=None, help="répertoire de l'index (RAG_INDEX_DIR par défaut)")
+    parser.add_argument("--concurrency", type=int, default=LLM_MAX_CONCURRENCY, help="appels LLM simultanés")
+    parser.add_argument("--rate-limit", type=float, default=LLM_RATE_LIMIT,
+                        help="requêtes LLM par seconde (quota de l'offre souscrite)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("-k", type=int, default=None, help="candidats par question (avant contexte)")
+    parser.add_argument("--rerank", action=argparse.BooleanOptionalAction, default=None)
+    parser.add_argument("--retrieval-only", action="store_true", help="sources et scores sans appel LLM")
+    args = parser.parse_args()
+
+    index = FAISSIndex.load(args.index_dir)
+    if index is None:
+        sys.exit("❌ Aucun index sauvegardé pour ce modèle et ces paramètres de découpage")
+
+    stats = asyncio.run(run_batch(
+        index, read_questions(args.questions), args.output, concurrency=args.concurrency,
+        rate_limit=args.rate_limit, batch_size=args.batch_size, k=args.k, use_rerank=args.rerank,
+        use_llm=not args.retrieval_only, progress=print_progress
+    ))
+    print(f"✅ {stats['answered']} réponses, {stats['errors']} erreurs, {stats['skipped']} déjà faites "
+          f"({stats['elapsed']:.1f} s) -> {args.output}")
+    if stats['errors']:
+        sys.exit(1)
@@ -0,0 +1,474 @@
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+# Le benchmark travaille sur des caches et des index jetables, jamais sur data/
+_workdir = tempfile.mkdtemp(prefix="rag_bench_")
+os.environ.setdefault("RAG_EMBEDDING_CACHE", os.path.join(_workdir, "embedding_cache.sqlite"))
+os.environ.setdefault("RAG_INDEX_DIR", os.path.join(_workdir, "index"))
+os.environ["RAG_ANSWER_CACHE"] = ""
+
+import numpy as np
+
+import mistral_client
+from embeddings import EMBEDDING_BACKEND, EMBEDDING_MODEL_NAME
+from ingestion import IngestionPipeline
+from mistral_stub import MistralStubServer
+from query_cache import query_embedding_cache, search_results_cache
+from rag_system import CHUNK_OVERLAP, CHUNK_SIZE, FAISSIndex
+from vector_index import index_memory_bytes
+
+# -----------------------
+# CONFIGURATION BENCHMARKS
+# -----------------------
+
+# Tailles des corpus synthétiques (nombre total de pages)
+BENCHMARK_SIZES = (20, 100, 500)
+BENCHMARK_QUERIES = 200
+BENCHMARK_E2E_QUERIES = 20
+BENCHMARK_K = 8
+# Types d'index mesurés, chacun imposé : les corpus synthétiques restent sous FLAT_MAX et le
+# choix automatique donnerait toujours un index exact (rappel trivialement égal à 1)
+BENCHMARK_INDEX_TYPES = ("flat", "hnsw", "ivf", "ivfpq")
+PAGES_PER_DOCUMENT = 50
+WORDS_PER_PAGE = 350
+# Part des documents générés au format DOCX
+DOCX_SHARE = 0.2
+# Variation relative tolérée avant de signaler une régression (--compare)
+REGRESSION_TOLERANCE = 0.10
+# Budget de démarrage : import de app.py (premier affichage) dans un interpréteur neuf
+STARTUP_BUDGET = float(os.environ.get("RAG_STARTUP_BUDGET", 1.0))
+
+VOCABULARY = (
+    "contrat bail locataire bailleur loyer charges préavis résiliation durée article clause "
+    "paiement échéance indemnité garantie dépôt révision indice obligation partie signature "
+    "avenant litige tribunal médiation assurance sinistre entretien réparation travaux local "
+    "commercial activité cession sous-location renouvellement congé délai notification "
+    "facture montant taxe redevance pénalité intérêt retard exécution force majeure"
+).split()
+
+# -----------------------
+# CORPUS
+# -----------------------
+
+def synthetic_page(rng, words=WORDS_PER_PAGE):
+    """Page de texte pseudo-juridique : phrases de 8 à 20 mots, paragraphes de 4 phrases"""
+    sentences = []
+    while sum(len(sentence.split()) for sentence in sentences) < words:
+        sentence = " ".join(rng.choice(VOCABULARY) for _ in range(rng.randint(8, 20)))
+        sentences.append(sentence.capitalize() + ".")
+    return "\n".join(" ".join(sentences[i:i + 4]) for i in range(0, len(sentences), 4))
+
+def _pdf_escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def make_pdf(pages):
+    """PDF minimal (police Helvetica, une ligne par paragraphe) lisible par PyPDF2"""
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [{}] /Count {} >>".format(
+            " ".join(f"{4 + 2 * i} 0 R" for i in range(len(pages))), len(pages)),
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+    ]
+    for i, text in enumerate(pages):
+        lines = " ".join(f"({_pdf_escape(line)}) Tj T*" for line in text.split("\n"))
+        stream = f"BT /F1 9 Tf 40 800 Td 11 TL {lines} ET"
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>")
+        objects.append(f"<< /Length {len(stream.encode('cp1252'))} >>\nstream\n{stream}\nendstream")
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(out.tell())
+        out.write(f"{number} 0 obj\n{body}\nendobj\n".encode("cp1252"))
+    xref = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+    out.write("".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode())
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+    return out.getvalue()
+
+def make_docx(pages):
+    import docx
+    document = docx.Document()
+    for text in pages:
+        for paragraph in text.split("\n"):
+            document.add_paragraph(paragraph)
+    out = io.BytesIO()
+    document.save(out)
+    return out.getvalue()
+
+def synthetic_corpus(total_pages, seed=0, pages_per_document=PAGES_PER_DOCUMENT, docx_share=DOCX_SHARE):
+    """Liste de (nom, contenu) totalisant total_pages pages, en PDF et DOCX"""
+    rng = random.Random(seed)
+    files = []
+    remaining = total_pages
+    while remaining > 0:
+        count = min(pages_per_document, remaining)
+        pages = [synthetic_page(rng) for _ in range(count)]
+        number = len(files) + 1
+        # Le premier document est toujours un PDF : les pages d'un DOCX ne sont pas comptées
+        if number > 1 and rng.random() < docx_share:
+            files.append((f"synthetique_{seed}_{number}.docx", make_docx(pages)))
+        else:
+            files.append((f"synthetique_{seed}_{number}.pdf", make_pdf(pages)))
+        remaining -= count
+    return files
+
+def load_sample_corpus(directory):
+    """Fichiers PDF/DOCX réels d'un répertoire"""
+    files = []
+    for name in sorted(os.listdir(directory)):
+        if name.endswith((".pdf", ".docx")):
+            with open(os.path.join(directory, name), "rb") as f:
+                files.append((name, f.read()))
+    return files
+
+# -----------------------
+# MESURES
+# -----------------------
+
+def percentiles(samples):
+    """Statistiques de latence en millisecondes"""
+    if not samples:
+        return None
+    values = np.asarray(samples, dtype=np.float64) * 1000
+    return {
+        'p50_ms': float(np.percentile(values, 50)),
+        'p95_ms': float(np.percentile(values, 95)),
+        'p99_ms': float(np.percentile(values, 99)),
+        'mean_ms': float(values.mean()),
+        'count': len(values)
+    }
+
+def rss_mb():
+    """Mémoire résidente actuelle (Linux), sinon pic du processus"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        return peak_rss_mb()
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss est en octets sous macOS, en kilo-octets sous Linux
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+def make_queries(texts, count, seed=0, words=6):
+    """Questions tirées de passages du corpus (toutes distinctes pour ne pas toucher les caches)"""
+    rng = random.Random(seed)
+    queries = set()
+    attempts = 0
+    while len(queries) < count and attempts < count * 20:
+        attempts += 1
+        tokens = rng.choice(texts).split()
+        if len(tokens) <= words:
+            continue
+        start = rng.randrange(len(tokens) - words)
+        queries.add(" ".join(tokens[start:start + words]))
+    return sorted(queries)
+
+def bench_ingestion(files, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    """Extraction + découpage (sans index) : pages/s et chunks produits"""
+    # Démarrage du pool de processus hors mesure
+    IngestionPipeline(chunk_size=chunk_size, chunk_overlap=chunk_overlap).run([("warmup.pdf", make_pdf(["warmup"]))])
+    started = time.perf_counter()
+    result = IngestionPipeline(chunk_size=chunk_size, chunk_overlap=chunk_overlap).run(files)
+    elapsed = time.perf_counter() - started
+    pages = sum(doc['page_count'] for doc in result['documents'])
+    return {
+        'documents': len(result['documents']),
+        'pages': pages,
+        'chunks': len(result['chunks']),
+        'errors': len(result['errors']),
+        'seconds': elapsed,
+        'pages_per_s': pages / elapsed if elapsed else None,
+        'mb_per_s': sum(doc['size'] for doc in result['documents']) / 2 ** 20 / elapsed if elapsed else None
+    }, result['chunks']
+
+def bench_embedding(index, texts):
+    """Vectorisation des chunks (cache d'embeddings vide : tout passe par le modèle)"""
+    # Le modèle est chargé au premier usage : chargement et préchauffage hors mesure
+    index.embeddings.embed_query("warmup")
+    started = time.perf_counter()
+    vectors = np.asarray(index.embeddings.embed_documents(texts), dtype=np.float32)
+    elapsed = time.perf_counter() - started
+    return {
+        'chunks': len(texts),
+        'seconds': elapsed,
+        'chunks_per_s': len(texts) / elapsed if elapsed else None,
+        'dimension': int(vectors.shape[1]) if len(vectors) else None
+    }, vectors
+
+def bench_index_build(index, chunks, vectors):
+    rss_before = rss_mb()
+    started = time.perf_counter()
+    index.add(chunks, vectors=vectors)
+    elapsed = time.perf_counter() - started
+    return {
+        'index_type': index.index_type,
+        'storage': index.index_params.get('storage'),
+        'ntotal': index.ntotal,
+        'seconds': elapsed,
+        'index_mb': index_memory_bytes(index.faiss_index) / 2 ** 20,
+        'rss_delta_mb': rss_mb() - rss_before
+    }
+
+def bench_search(index, queries, k=BENCHMARK_K):
+    """Latence de recherche (caches vidés, questions distinctes) et de la chaîne complète"""
+    query_embedding_cache.clear()
+    search_results_cache.clear()
+    search_times = []
+    for query in queries:
+        started = time.perf_counter()
+        index.search(query, k=k)
+        search_times.append(time.perf_counter() - started)
+
+    # Seconde passe : tout est en cache, ce qui mesure le chemin chaud
+    cached_times = []
+    for query in queries:
+        started = time.perf_counter()
+        index.search(query, k=k)
+        cached_times.append(time.perf_counter() - started)
+
+    query_embedding_cache.clear()
+    search_results_cache.clear()
+    retrieve_times = []
+    for query in queries:
+        started = time.perf_counter()
+        index.retrieve(query, max_chunks=mistral_client.MAX_CONTEXT_CHUNKS)
+        retrieve_times.append(time.perf_counter() - started)
+
+    return {
+        'k': k,
+        'search': percentiles(search_times),
+        'search_cached': percentiles(cached_times),
+        'retrieve': percentiles(retrieve_times)
+    }
+
+def bench_end_to_end(index, questions, first_token_delay, token_delay):
+    """Question -> contexte -> réponse streamée par le stub Mistral local"""
+    total_times = []
+    first_token_times = []
+    with MistralStubServer(first_token_delay=first_token_delay, token_delay=token_delay) as stub:
+        previous_url = mistral_client.MISTRAL_API_URL
+        mistral_client.MISTRAL_API_URL = stub.url
+        try:
+            query_embedding_cache.clear()
+            search_results_cache.clear()
+            for question in questions:
+                started = time.perf_counter()
+                context, _, _ = index.retrieve(question, max_chunks=mistral_client.MAX_CONTEXT_CHUNKS)
+                first_token = None
+                for _ in mistral_client.stream_mistral_api(context, question, []):
+                    if first_token is None:
+                        first_token = time.perf_counter() - started
+                total_times.append(time.perf_counter() - started)
+                first_token_times.append(first_token if first_token is not None else total_times[-1])
+        finally:
+            mistral_client.MISTRAL_API_URL = previous_url
+    return {
+        'stub_first_token_delay_s': first_token_delay,
+        'stub_token_delay_s': token_delay,
+        'time_to_first_token': percentiles(first_token_times),
+        'total': percentiles(total_times)
+    }
+
+def run_corpus(label, files, queries=BENCHMARK_QUERIES, e2e_queries=BENCHMARK_E2E_QUERIES, k=BENCHMARK_K,
+               first_token_delay=0.2, token_delay=0.02, seed=0, index_types=BENCHMARK_INDEX_TYPES):
+    """Toutes les mesures pour un corpus ; retourne un dictionnaire sérialisable en JSON
+
+    Les chunks sont vectorisés une fois, puis chaque type d'index de index_types est construit
+    et mesuré (construction, recherche, rappel). La latence de bout en bout est mesurée sur
+    le premier type.
+    """
+    run = {'corpus': label, 'files': len(files), 'bytes': sum(len(data) for _, data in files)}
+    run['ingestion'], chunks = bench_ingestion(files)
+    if not chunks:
+        return run
+
+    texts = [chunk['text'] for chunk in chunks]
+    run['embedding'], vectors = bench_embedding(FAISSIndex(), texts)
+    questions = make_queries(texts, queries, seed)
+
+    run['indexes'] = {}
+    for index_type in index_types:
+        index = FAISSIndex(index_type=index_type)
+        entry = {'index': bench_index_build(index, chunks, vectors)}
+        entry['search'] = bench_search(index, questions, k)
+        recall = index.evaluate_recall(k=k, queries=questions)
+        entry['recall'] = {'k': recall['k'], 'recall': recall['recall'], 'queries': recall['queries']}
+        if not run['indexes']:
+            run['end_to_end'] = bench_end_to_end(index, questions[:e2e_queries], first_token_delay, token_delay)
+        run['indexes'][index_type] = entry
+    run['peak_rss_mb'] = peak_rss_mb()
+    return run
+
+_STARTUP_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter() - started
+from embeddings import start_background_warmup
+start_background_warmup().join()
+print(json.dumps({'import_app_s': imported, 'models_ready_s': time.perf_counter() - started}))
+"""
+
+def bench_startup(budget=STARTUP_BUDGET):
+    """Démarrage à froid : import de app.py (ce qui précède le premier affichage) puis modèles prêts
+
+    Mesuré dans un interpréteur neuf, le préchargement des modèles tournant en arrière-plan.
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [os.path.dirname(os.path.abspath(__file__)),
+                                                                     os.environ.get("PYTHONPATH")])))
+    # app.py crée data/ et uploads/ dans le répertoire courant : on l'isole
+    result = subprocess.run([sys.executable, "-c", _STARTUP_PROBE], capture_output=True, text=True,
+                            cwd=_workdir, env=env)
+    if result.returncode != 0:
+        return {'error': result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "échec"}
+    startup = json.loads(result.stdout.strip().splitlines()[-1])
+    startup['budget_s'] = budget
+    startup['within_budget'] = startup['import_app_s'] <= budget
+    return startup
+
+def environment_info():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'timestamp': datetime.now().isoformat(timespec="seconds"),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'embedding_model': EMBEDDING_MODEL_NAME,
+        'embedding_backend': EMBEDDING_BACKEND,
+        'chunk_size': CHUNK_SIZE,
+        'chunk_overlap': CHUNK_OVERLAP
+    }
+
+# -----------------------
+# COMPARAISON
+# -----------------------
+
+def _flatten(value, prefix=""):
+    if isinstance(value, dict):
+        items = {}
+        for key, item in value.items():
+            items.update(_flatten(item, f"{prefix}{key}."))
+        return items
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix.rstrip("."): float(value)}
+    return {}
+
+def _higher_is_better(metric):
+    return metric.endswith(("_per_s", "recall.recall"))
+
+def _comparable(results):
+    """Mesures comparables d'un fichier de résultats : corpus -> métriques aplaties"""
+    entries = {run['corpus']: _flatten(run) for run in results.get('runs', [])}
+    startup = results.get('startup', {})
+    if 'import_app_s' in startup:
+        entries['démarrage'] = {'import_app_s': startup['import_app_s'], 'models_ready_s': startup['models_ready_s']}
+    return entries
+
+def compare_results(current, baseline, tolerance=REGRESSION_TOLERANCE):
+    """Compare deux fichiers de résultats corpus par corpus ; retourne la liste des régressions"""
+    baseline_entries = _comparable(baseline)
+    regressions = []
+    for corpus, metrics in _comparable(current).items():
+        previous = baseline_entries.get(corpus)
+        if previous is None:
+            continue
+        for metric, value in metrics.items():
+            reference = previous.get(metric)
+            # Seuls les débits, latences, durées, mémoire et rappel sont comparés
+            if not reference or metric.endswith(("count", "k", "files", "bytes", "pages", "chunks", "ntotal",
+                                                 "documents", "errors", "dimension", "queries", "delay_s")):
+                continue
+            change = (value - reference) / abs(reference)
+            worse = change < -tolerance if _higher_is_better(metric) else change > tolerance
+            if worse:
+                regressions.append({'corpus': corpus, 'metric': metric,
+                                    'baseline': reference, 'current': value, 'change': change})
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks ingestion, recherche et latence de bout en bout")
+    parser.add_argument("--sizes", default=",".join(str(size) for size in BENCHMARK_SIZES),
+                        help="tailles des corpus synthétiques en pages (ex. 20,100,500 ; vide pour aucun)")
+    parser.add_argument("--corpus", action="append", default=[],
+                        help="répertoire de PDF/DOCX réels à mesurer (option répétable)")
+    parser.add_argument("--queries", type=int, default=BENCHMARK_QUERIES)
+    parser.add_argument("--e2e-queries", type=int, default=BENCHMARK_E2E_QUERIES)
+    parser.add_argument("-k", type=int, default=BENCHMARK_K)
+    parser.add_argument("--index-types", default=",".join(BENCHMARK_INDEX_TYPES),
+                        help="types d'index à construire et mesurer (ex. flat,hnsw,ivf,ivfpq)")
+    parser.add_argument("--first-token-delay", type=float, default=0.2)
+    parser.add_argument("--token-delay", type=float, default=0.02)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="fichier de résultats de référence")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE)
+    args = parser.parse_args()
+
+    corpora = [(f"synthetique-{size}p", lambda size=size: synthetic_corpus(size, seed=size))
+               for size in (int(value) for value in args.sizes.split(",") if value.strip())]
+    corpora += [(os.path.basename(os.path.normpath(directory)), lambda directory=directory: load_sample_corpus(directory))
+                for directory in args.corpus]
+
+    results = {'environment': environment_info(), 'startup': bench_startup(), 'runs': []}
+    startup = results['startup']
+    if 'error' in startup:
+        print(f"⚠️ Mesure du démarrage impossible : {startup['error']}")
+    else:
+        print(f"▶ démarrage : app.py importé en {startup['import_app_s']:.2f} s (budget {startup['budget_s']:.2f} s), "
+              f"modèles prêts en {startup['models_ready_s']:.2f} s", flush=True)
+    for label, load in corpora:
+        print(f"▶ {label}", flush=True)
+        run = run_corpus(label, load(), args.queries, args.e2e_queries, args.k,
+                         args.first_token_delay, args.token_delay,
+                         index_types=[value.strip() for value in args.index_types.split(",") if value.strip()])
+        results['runs'].append(run)
+        ingestion_stats = run['ingestion']
+        print(f"  {ingestion_stats['pages']} pages, {ingestion_stats['chunks']} chunks, "
+              f"{ingestion_stats['pages_per_s']:.1f} pages/s", flush=True)
+        if 'indexes' in run:
+            print(f"  {run['embedding']['chunks_per_s']:.1f} chunks/s, "
+                  f"bout en bout p95 {run['end_to_end']['total']['p95_ms']:.0f} ms", flush=True)
+            for index_type, entry in run['indexes'].items():
+                # Un type impossible à cette taille (IVF-PQ sur trop peu de vecteurs) retombe sur flat
+                print(f"  {index_type} → index {entry['index']['index_type']} "
+                      f"({entry['index']['storage']}, {entry['index']['index_mb']:.1f} Mo) "
+                      f"en {entry['index']['seconds']:.2f} s, "
+                      f"recherche p95 {entry['search']['search']['p95_ms']:.1f} ms, "
+                      f"rappel@{entry['recall']['k']} {entry['recall']['recall']:.3f}", flush=True)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f"Résultats écrits dans {args.output}")
+
+    if not results['startup'].get('within_budget', True):
+        print(f"⚠️ Budget de démarrage dépassé : {results['startup']['import_app_s']:.2f} s "
+              f"> {results['startup']['budget_s']:.2f} s")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare_results(results, json.load(f), args.tolerance)
+        for item in regressions:
+            print(f"⚠️ {item['corpus']} {item['metric']} : {item['baseline']:.4g} -> {item['current']:.4g} "
+                  f"({item['change']:+.0%})")
+        if regressions:
+            sys.exit(1)
+        print("Aucune régression au-delà de la tolérance")
@@ -0,0 +1,277 @@
+import json
+
+import numpy as np
+
+from utils import MAX_OVERLAP_CHARS, overlap_length
+
+class ChunkStore:
+    """Stockage compact des chunks : un texte par document et des colonnes numpy par chunk
+
+    Chaque chunk est une tranche (offset, longueur) du texte de son document ; le recouvrement
+    entre chunks consécutifs n'est stocké qu'une fois, y compris entre deux appels à add()
+    (lots successifs d'un même document). Les sources sont des entiers, les
+    métadonnées des tableaux, et les dictionnaires de chunk ne sont construits qu'à la demande
+    (résultats de recherche). Les lignes sont triées par vector_id croissant.
+    """
+    def __init__(self):
+        # Table des documents
+        self._buffers = []
+        self._doc_hashes = []
+        self._doc_sources = []
+        self._doc_by_hash = {}
+        self._sources = []
+        self._source_ids = {}
+        # Par file_hash : position et fin du texte du dernier chunk ajouté, pour retrouver le
+        # recouvrement avec le lot suivant du document
+        self._tails = {}
+        # Colonnes des chunks
+        self._vector_ids = np.zeros(0, dtype=np.int64)
+        self._doc_idx = np.zeros(0, dtype=np.int32)
+        self._offsets = np.zeros(0, dtype=np.int64)
+        self._lengths = np.zeros(0, dtype=np.int32)
+        self._positions = np.zeros(0, dtype=np.int32)
+        self._sizes = np.zeros(0, dtype=np.int32)
+        self._hashes = np.zeros(0, dtype="S16")
+        # Plage de pages de chaque chunk (0 = inconnue, par exemple pour un DOCX)
+        self._page_starts = np.zeros(0, dtype=np.int32)
+        self._page_ends = np.zeros(0, dtype=np.int32)
+
+    def __len__(self):
+        return len(self._vector_ids)
+
+    def _source_id(self, source):
+        source_id = self._source_ids.get(source)
+        if source_id is None:
+            source_id = len(self._sources)
+            self._sources.append(source)
+            self._source_ids[source] = source_id
+        return source_id
+
+    def add(self, chunks_with_metadata, vector_ids):
+        """Ajoute des chunks (dans l'ordre du document) sous des vector_id croissants"""
+        vector_ids = np.asarray(vector_ids, dtype=np.int64)
+        if len(self._vector_ids) and len(vector_ids) and vector_ids[0] <= self._vector_ids[-1]:
+            raise ValueError("Les vector_id doivent être croissants")
+
+        doc_idx, offsets, lengths = [], [], []
+        # Par document : morceaux à ajouter au texte, longueur courante, dernier chunk vu
+        pending = {}
+        for chunk in chunks_with_metadata:
+            doc = self._doc_by_hash.get(chunk['file_hash'])
+            if doc is None:
+                doc = len(self._buffers)
+                self._buffers.append("")
+                self._doc_hashes.append(chunk['file_hash'])
+                self._doc_sources.append(self._source_id(chunk['source']))
+                self._doc_by_hash[chunk['file_hash']] = doc
+            state = pending.get(doc)
+            if state is None:
+                state = pending[doc] = {'parts': [self._buffers[doc]], 'length': len(self._buffers[doc]),
+                                        'previous': self._last_chunk(doc)}
+
+            text = chunk['text']
+            shared = 0
+            previous = state['previous']
+            if previous is not None and chunk.get('position') == previous.get('position', -2) + 1:
+                # Chunk voisin du précédent : le recouvrement déjà stocké est réutilisé
+                shared = overlap_length(previous['text'], text)
+            offsets.append(state['length'] - shared)
+            lengths.append(len(text))
+            state['parts'].append(text[shared:])
+            state['length'] += len(text) - shared
+            state['previous'] = chunk
+            doc_idx.append(doc)
+
+        for doc, state in pending.items():
+            self._buffers[doc] = "".join(state['parts'])
+            previous = state['previous']
+            self._tails[self._doc_hashes[doc]] = {'position': previous.get('position', -2),
+                                                  'text': previous['text'][-MAX_OVERLAP_CHARS:]}
+
+        self._vector_ids = np.concatenate([self._vector_ids, vector_ids])
+        self._doc_idx = np.concatenate([self._doc_idx, np.asarray(doc_idx, dtype=np.int32)])
+        self._offsets = np.concatenate([self._offsets, np.asarray(offsets, dtype=np.int64)])
+        self._lengths = np.concatenate([self._lengths, np.asarray(lengths, dtype=np.int32)])
+        self._positions = np.concatenate([self._positions, np.asarray(
+            [chunk.get('position', -1) for chunk in chunks_with_metadata], dtype=np.int32)])
+        self._sizes = np.concatenate([self._sizes, np.asarray(
+            [chunk.get('chunk_size', len(chunk['text'])) for chunk in chunks_with_metadata], dtype=np.int32)])
+        self._hashes = np.concatenate([self._hashes, np.asarray(
+            [(chunk.get('chunk_hash') or "").encode("ascii") for chunk in chunks_with_metadata], dtype="S16")])
+        self._page_starts = np.concatenate([self._page_starts, np.asarray(
+            [chunk.get('page_start') or 0 for chunk in chunks_with_metadata], dtype=np.int32)])
+        self._page_ends = np.concatenate([self._page_ends, np.asarray(
+            [chunk.get('page_end') or 0 for chunk in chunks_with_metadata], dtype=np.int32)])
+
+    def _last_chunk(self, doc):
+        """Position et fin du texte du dernier chunk d'un document (None s'il n'en a pas)"""
+        tail = self._tails.get(self._doc_hashes[doc])
+        if tail is not None:
+            return tail
+        # Stockage relu depuis le disque : le dernier chunk est la dernière ligne du document
+        rows = np.flatnonzero(self._doc_idx == doc)
+        if not len(rows):
+            return None
+        position = int(self._positions[rows[-1]])
+        return {'position': position if position >= 0 else -2, 'text': self._text(rows[-1])[-MAX_OVERLAP_CHARS:]}
+
+    def remove_file_hashes(self, file_hashes):
+        """Retire les documents donnés ; retourne les vector_id supprimés"""
+        docs = {self._doc_by_hash[h] for h in file_hashes if h in self._doc_by_hash}
+        if not docs:
+            return np.zeros(0, dtype=np.int64)
+        removed_rows = np.isin(self._doc_idx, list(docs))
+        removed = self._vector_ids[removed_rows]
+
+        # Renumérotation de la table des documents restants
+        kept_docs = [doc for doc in range(len(self._buffers)) if doc not in docs]
+        remap = np.full(len(self._buffers), -1, dtype=np.int32)
+        remap[kept_docs] = np.arange(len(kept_docs), dtype=np.int32)
+        self._buffers = [self._buffers[doc] for doc in kept_docs]
+        self._doc_hashes = [self._doc_hashes[doc] for doc in kept_docs]
+        self._doc_sources = [self._doc_sources[doc] for doc in kept_docs]
+        self._doc_by_hash = {file_hash: doc for doc, file_hash in enumerate(self._doc_hashes)}
+        for file_hash in file_hashes:
+            self._tails.pop(file_hash, None)
+        self._prune_sources()
+
+        keep = ~removed_rows
+        self._vector_ids = self._vector_ids[keep]
+        self._doc_idx = remap[self._doc_idx[keep]]
+        self._offsets = self._offsets[keep]
+        self._lengths = self._lengths[keep]
+        self._positions = self._positions[keep]
+        self._sizes = self._sizes[keep]
+        self._hashes = self._hashes[keep]
+        self._page_starts = self._page_starts[keep]
+        self._page_ends = self._page_ends[keep]
+        return removed
+
+    def rename(self, file_hash, source):
+        """Change le nom de fichier source d'un document ; retourne son nombre de chunks (0 si absent)"""
+        doc = self._doc_by_hash.get(file_hash)
+        if doc is None:
+            return 0
+        self._doc_sources[doc] = self._source_id(source)
+        self._prune_sources()
+        return int(np.count_nonzero(self._doc_idx == doc))
+
+    def _prune_sources(self):
+        """Retire de la table des sources les noms de fichiers sans document restant"""
+        used_sources = sorted(set(self._doc_sources))
+        if len(used_sources) < len(self._sources):
+            source_remap = {old: new for new, old in enumerate(used_sources)}
+            self._sources = [self._sources[old] for old in used_sources]
+            self._source_ids = {source: source_id for source_id, source in enumerate(self._sources)}
+            self._doc_sources = [source_remap[old] for old in self._doc_sources]
+
+    def _row(self, vector_id):
+        row = int(np.searchsorted(self._vector_ids, vector_id))
+        if row < len(self._vector_ids) and self._vector_ids[row] == vector_id:
+            return row
+        return None
+
+    def _text(self, row):
+        start = int(self._offsets[row])
+        return self._buffers[self._doc_idx[row]][start:start + int(self._lengths[row])]
+
+    def _materialize(self, row):
+        doc = self._doc_idx[row]
+        file_hash = self._doc_hashes[doc]
+        position = int(self._positions[row])
+        return {
+            'chunk_id': f"{file_hash}-{position}",
+            'vector_id': int(self._vector_ids[row]),
+            'text': self._text(row),
+            'source': self._sources[self._doc_sources[doc]],
+            'file_hash': file_hash,
+            'chunk_hash': self._hashes[row].decode("ascii") or None,
+            'chunk_size': int(self._sizes[row]),
+            'position': position,
+            'page_start': int(self._page_starts[row]) or None,
+            'page_end': int(self._page_ends[row]) or None
+        }
+
+    def get(self, vector_id):
+        """Chunk (dictionnaire construit à la demande) d'un vector_id, ou None"""
+        row = self._row(int(vector_id))
+        return None if row is None else self._materialize(row)
+
+    def vector_ids(self):
+        return self._vector_ids.copy()
+
+    def vector_ids_for(self, file_hashes):
+        """vector_id (croissants) des chunks des documents donnés"""
+        docs = [self._doc_by_hash[h] for h in file_hashes if h in self._doc_by_hash]
+        if not docs:
+            return np.zeros(0, dtype=np.int64)
+        return self._vector_ids[np.isin(self._doc_idx, docs)]
+
+    def file_hashes_for(self, sources):
+        """file_hash des documents dont le nom de fichier source fait partie de sources"""
+        source_ids = {self._source_ids[source] for source in sources if source in self._source_ids}
+        return {file_hash for file_hash, source_id in zip(self._doc_hashes, self._doc_sources)
+                if source_id in source_ids}
+
+    def texts(self, vector_ids=None):
+        """Textes des chunks, pour des vector_id donnés ou pour tout le stockage"""
+        if vector_ids is None:
+            return [self._text(row) for row in range(len(self))]
+        return [self._text(self._row(int(vector_id))) for vector_id in vector_ids]
+
+    def document_hashes(self):
+        """file_hash -> nom du fichier source, pour les documents ayant des chunks"""
+        return {self._doc_hashes[doc]: self._sources[self._doc_sources[doc]] for doc in np.unique(self._doc_idx)}
+
+    def document_stats(self):
+        """Nom du fichier source -> nombre de chunks"""
+        counts = np.bincount(self._doc_idx, minlength=len(self._buffers))
+        stats = {}
+        for doc, count in enumerate(counts):
+            if count:
+                source = self._sources[self._doc_sources[doc]]
+                stats[source] = stats.get(source, 0) + int(count)
+        return stats
+
+    def save(self, path):
+        documents = [{'file_hash': file_hash, 'source': self._sources[source_id], 'text': buffer}
+                     for file_hash, source_id, buffer in zip(self._doc_hashes, self._doc_sources, self._buffers)]
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                documents=np.frombuffer(json.dumps(documents, ensure_ascii=False).encode("utf-8"), dtype=np.uint8),
+                vector_ids=self._vector_ids,
+                doc_idx=self._doc_idx,
+                offsets=self._offsets,
+                lengths=self._lengths,
+                positions=self._positions,
+                sizes=self._sizes,
+                hashes=self._hashes,
+                page_starts=self._page_starts,
+                page_ends=self._page_ends
+            )
+
+    @classmethod
+    def load(cls, path):
+        store = cls()
+        with np.load(path) as data:
+            documents = json.loads(data['documents'].tobytes().decode("utf-8"))
+            store._vector_ids = data['vector_ids']
+            store._doc_idx = data['doc_idx']
+            store._offsets = data['offsets']
+            store._lengths = data['lengths']
+            store._positions = data['positions']
+            store._sizes = data['sizes']
+            store._hashes = data['hashes']
+            if 'page_starts' in data:
+                store._page_starts = data['page_starts']
+                store._page_ends = data['page_ends']
+            else:
+                store._page_starts = np.zeros(len(store._vector_ids), dtype=np.int32)
+                store._page_ends = np.zeros(len(store._vector_ids), dtype=np.int32)
+        for doc, document in enumerate(documents):
+            store._buffers.append(document['text'])
+            store._doc_hashes.append(document['file_hash'])
+            store._doc_sources.append(store._source_id(document['source']))
+            store._doc_by_hash[document['file_hash']] = doc
+        return store
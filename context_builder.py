@@ -0,0 +1,164 @@
+import os
+
+import numpy as np
+
+from utils import overlap_length
+
+# -----------------------
+# CONFIGURATION CONTEXTE
+# -----------------------
+
+# Budget de tokens du contexte documentaire envoyé au LLM
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("RAG_CONTEXT_TOKEN_BUDGET", 1500))
+# Compromis pertinence / diversité du MMR (1 = pertinence seule)
+MMR_LAMBDA = float(os.environ.get("RAG_MMR_LAMBDA", 0.7))
+# Nombre de candidats récupérés avant sélection
+CONTEXT_CANDIDATES = int(os.environ.get("RAG_CONTEXT_CANDIDATES", 12))
+
+def estimate_tokens(text):
+    """Estimation rapide du nombre de tokens (≈ 3,5 caractères par token en français)"""
+    return int(len(text) / 3.5) + 1
+
+def chunk_position(chunk):
+    """Rang du chunk dans son document, déduit de l'identifiant '<file_hash>-<n>'"""
+    if chunk.get('chunk_ids'):
+        # Chunk déjà fusionné (il garde la position de son premier membre) : on ne le refusionne pas
+        return None
+    if chunk.get('position') is not None:
+        return chunk['position']
+    try:
+        return int(str(chunk.get('chunk_id', '')).rsplit("-", 1)[1])
+    except (IndexError, ValueError):
+        return None
+
+def maximal_marginal_relevance(query_vector, vectors, lambda_mult=MMR_LAMBDA, limit=None, relevance=None):
+    """Ordre de sélection MMR : pertinence pour la question moins redondance avec la sélection
+
+    relevance remplace la similarité question/chunk (par exemple des scores de reranking).
+    """
+    if len(vectors) == 0:
+        return []
+    vectors = np.asarray(vectors, dtype=np.float32)
+    vectors = vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+    query = np.asarray(query_vector, dtype=np.float32).reshape(-1)
+    query = query / max(float(np.linalg.norm(query)), 1e-12)
+
+    if relevance is None:
+        relevance = vectors @ query
+    else:
+        # Ramène des scores quelconques (logits du cross-encoder) sur [0, 1]
+        relevance = np.asarray(relevance, dtype=np.float32)
+        spread = float(relevance.max() - relevance.min())
+        relevance = (relevance - relevance.min()) / spread if spread > 0 else np.ones_like(relevance)
+    similarity = vectors @ vectors.T
+    limit = min(limit or len(vectors), len(vectors))
+
+    selected = [int(np.argmax(relevance))]
+    redundancy = similarity[selected[0]].copy()
+    while len(selected) < limit:
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[selected] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        redundancy = np.maximum(redundancy, similarity[best])
+    return selected
+
+def merge_adjacent_chunks(chunks):
+    """Fusionne les chunks consécutifs d'un même document en retirant le texte recouvrant
+
+    L'ordre de la liste (pertinence) est conservé : un groupe fusionné prend la place de son
+    meilleur membre.
+    """
+    groups = []
+    by_document = {}
+    for rank, chunk in enumerate(chunks):
+        by_document.setdefault(chunk['file_hash'], []).append((rank, chunk))
+
+    for members in by_document.values():
+        members.sort(key=lambda item: (chunk_position(item[1]) is None, chunk_position(item[1]) or 0))
+        current = None
+        for rank, chunk in members:
+            position = chunk_position(chunk)
+            if current is not None and position is not None and current['last_position'] is not None \
+                    and position == current['last_position'] + 1:
+                cut = overlap_length(current['text'], chunk['text'])
+                current['text'] += ("" if cut else "\n") + chunk['text'][cut:]
+                current['chunk_ids'].append(chunk['chunk_id'])
+                current['page_end'] = chunk.get('page_end') or current['page_end']
+                current['rank'] = min(current['rank'], rank)
+                current['last_position'] = position
+                continue
+            current = {
+                'rank': rank,
+                'last_position': position,
+                'text': chunk['text'],
+                'chunk_ids': [chunk['chunk_id']],
+                'page_end': chunk.get('page_end'),
+                'base': chunk
+            }
+            groups.append(current)
+
+    merged = []
+    for group in sorted(groups, key=lambda g: g['rank']):
+        chunk = dict(group['base'], text=group['text'], chunk_size=len(group['text']))
+        if len(group['chunk_ids']) > 1:
+            chunk['chunk_id'] = "+".join(group['chunk_ids'])
+            chunk['chunk_ids'] = group['chunk_ids']
+            chunk['page_end'] = group['page_end']
+            # Le contenu a changé : l'empreinte sera recalculée à partir du texte fusionné
+            chunk['chunk_hash'] = None
+        merged.append(chunk)
+    return merged
+
+def build_context(chunks, query_vector=None, chunk_vectors=None, token_budget=CONTEXT_TOKEN_BUDGET,
+                  lambda_mult=MMR_LAMBDA, max_chunks=None):
+    """Sélectionne (MMR), fusionne et tasse les chunks dans le budget de tokens
+
+    Les chunks renvoyés sont marqués 'packed' : un contexte déjà construit n'est pas retraité
+    (voir is_packed).
+    """
+    if not chunks:
+        return []
+
+    if query_vector is not None and chunk_vectors is not None and len(chunk_vectors) == len(chunks):
+        relevance = None
+        if all(chunk.get('rerank_score') is not None for chunk in chunks):
+            relevance = [chunk['rerank_score'] for chunk in chunks]
+        order = maximal_marginal_relevance(query_vector, chunk_vectors, lambda_mult, relevance=relevance)
+        chunks = [chunks[i] for i in order]
+
+    # Sélection gloutonne dans le budget, puis fusion qui libère le recouvrement
+    selected = []
+    used = 0
+    for chunk in chunks:
+        cost = estimate_tokens(chunk['text'])
+        if selected and used + cost > token_budget:
+            continue
+        selected.append(chunk)
+        used += cost
+
+    context = merge_adjacent_chunks(selected)
+    packed = []
+    used = 0
+    for chunk in context:
+        cost = estimate_tokens(chunk['text'])
+        if packed and used + cost > token_budget:
+            continue
+        packed.append(dict(chunk, packed=True))
+        used += cost
+        if max_chunks and len(packed) >= max_chunks:
+            break
+    return packed
+
+def is_packed(chunks):
+    """Vrai si les chunks forment déjà un contexte construit par build_context"""
+    return bool(chunks) and all(chunk.get('packed') for chunk in chunks)
+
+def pack_context(index, query, candidates, token_budget=CONTEXT_TOKEN_BUDGET,
+                 lambda_mult=MMR_LAMBDA, max_chunks=None):
+    """Construit le contexte à partir des candidats de FAISSIndex.search et des vecteurs de l'index"""
+    if not candidates:
+        return []
+    query_vector = index.embed_query(query)
+    chunk_vectors = index.get_vectors([chunk['vector_id'] for chunk in candidates])
+    return build_context(candidates, query_vector, chunk_vectors, token_budget, lambda_mult, max_chunks)
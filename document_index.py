@@ -0,0 +1,104 @@
+import json
+
+import numpy as np
+
+class DocumentIndex:
+    """Index des documents : un centroïde (moyenne normalisée des vecteurs de chunks) par document
+
+    Sert au routage des questions : les centroïdes les plus proches désignent les documents
+    dans lesquels chercher les chunks. La recherche est exacte (produit matriciel) : quelques
+    milliers de documents ne représentent que quelques Mo. Les documents sont adressés par
+    leur file_hash.
+    """
+    def __init__(self):
+        self._file_hashes = []
+        self._rows = {}
+        # Somme des vecteurs (normalisés) et nombre de chunks de chaque document
+        self._sums = np.zeros((0, 0), dtype=np.float32)
+        self._counts = np.zeros(0, dtype=np.int64)
+        self._centroids = None
+
+    def __len__(self):
+        return len(self._file_hashes)
+
+    def add(self, file_hashes, vectors):
+        """Ajoute des vecteurs de chunks (un file_hash par ligne) aux centroïdes de leurs documents"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not len(vectors):
+            return
+        if not self._file_hashes:
+            self._sums = np.zeros((0, vectors.shape[1]), dtype=np.float32)
+
+        rows = []
+        for file_hash in file_hashes:
+            row = self._rows.get(file_hash)
+            if row is None:
+                row = len(self._file_hashes)
+                self._file_hashes.append(file_hash)
+                self._rows[file_hash] = row
+            rows.append(row)
+
+        added = len(self._file_hashes) - len(self._counts)
+        if added:
+            self._sums = np.vstack([self._sums, np.zeros((added, self._sums.shape[1]), dtype=np.float32)])
+            self._counts = np.concatenate([self._counts, np.zeros(added, dtype=np.int64)])
+        np.add.at(self._sums, rows, vectors)
+        np.add.at(self._counts, rows, 1)
+        self._centroids = None
+
+    def remove(self, file_hashes):
+        """Retire des documents"""
+        removed = {file_hash for file_hash in file_hashes if file_hash in self._rows}
+        if not removed:
+            return
+        keep = [row for row, file_hash in enumerate(self._file_hashes) if file_hash not in removed]
+        self._file_hashes = [self._file_hashes[row] for row in keep]
+        self._rows = {file_hash: row for row, file_hash in enumerate(self._file_hashes)}
+        self._sums = self._sums[keep]
+        self._counts = self._counts[keep]
+        self._centroids = None
+
+    def centroids(self):
+        """Matrice des centroïdes normalisés (une ligne par document)"""
+        if self._centroids is None:
+            norms = np.linalg.norm(self._sums, axis=1, keepdims=True)
+            self._centroids = self._sums / np.clip(norms, 1e-12, None)
+        return self._centroids
+
+    def search(self, query_vectors, n, allowed=None):
+        """Pour chaque question, file_hash des n documents aux centroïdes les plus proches
+
+        allowed restreint le choix à un ensemble de file_hash (filtre par document).
+        """
+        centroids = self.centroids()
+        if allowed is None:
+            rows = np.arange(len(self._file_hashes))
+        else:
+            rows = np.asarray(sorted(self._rows[file_hash] for file_hash in allowed if file_hash in self._rows),
+                              dtype=np.int64)
+        query_vectors = np.asarray(query_vectors, dtype=np.float32)
+        n = min(n, len(rows))
+        if n == 0:
+            return [[] for _ in query_vectors]
+        scores = query_vectors @ centroids[rows].T
+        top = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+        return [[self._file_hashes[rows[column]] for column in row] for row in top]
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                file_hashes=np.frombuffer(json.dumps(self._file_hashes).encode("utf-8"), dtype=np.uint8),
+                sums=self._sums,
+                counts=self._counts
+            )
+
+    @classmethod
+    def load(cls, path):
+        index = cls()
+        with np.load(path) as data:
+            index._file_hashes = json.loads(data['file_hashes'].tobytes().decode("utf-8"))
+            index._sums = data['sums']
+            index._counts = data['counts']
+        index._rows = {file_hash: row for row, file_hash in enumerate(index._file_hashes)}
+        return index
@@ -0,0 +1,442 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from metrics import register_collector
+
+logger = logging.getLogger(__name__)
+
+# -----------------------
+# CONFIGURATION EMBEDDINGS
+# -----------------------
+
+EMBEDDING_MODEL_NAME = os.environ.get("RAG_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+EMBEDDING_DEVICE = os.environ.get("RAG_EMBEDDING_DEVICE", "cpu")
+# Backends : "torch" (référence), "torch-int8", "onnx", "onnx-int8"
+EMBEDDING_BACKEND = os.environ.get("RAG_EMBEDDING_BACKEND", "torch")
+EMBEDDING_BATCH_SIZE = int(os.environ.get("RAG_EMBEDDING_BATCH_SIZE", 64))
+# Nombre de threads CPU pour l'inférence (0 = valeur par défaut de la bibliothèque)
+EMBEDDING_THREADS = int(os.environ.get("RAG_EMBEDDING_THREADS", 0))
+EMBEDDING_MAX_LENGTH = 256
+ONNX_MODELS_DIR = os.environ.get("RAG_ONNX_DIR", os.path.join("data", "models"))
+# Cache persistant des embeddings de chunks (vide pour le désactiver)
+EMBEDDING_CACHE_PATH = os.environ.get("RAG_EMBEDDING_CACHE", os.path.join("data", "embedding_cache.sqlite"))
+# Nombre maximal de vecteurs conservés (les moins récemment utilisés sont supprimés au-delà)
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get("RAG_EMBEDDING_CACHE_MAX_ENTRIES", 500000))
+
+EMBEDDING_BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8")
+
+# Registre des modèles chargés : un seul exemplaire par (modèle, device, backend) et par processus
+_embedding_models = {}
+_cached_models = {}
+_embedding_caches = {}
+_warmed_up = set()
+_registry_lock = threading.Lock()
+# Préchargement en arrière-plan (start_background_warmup) et durées mesurées au démarrage
+_background_warmup = None
+_warmup_lock = threading.Lock()
+startup_timings = {}
+
+def embedding_model_id(model_name=None, backend=None):
+    """Identifiant des vecteurs produits : les backends quantifiés ne partagent pas le cache du modèle de référence"""
+    model_name = model_name or EMBEDDING_MODEL_NAME
+    backend = backend or EMBEDDING_BACKEND
+    return model_name if backend == "torch" else f"{model_name}#{backend}"
+
+def _registry_key(model_name, device, backend):
+    return (model_name or EMBEDDING_MODEL_NAME, device or EMBEDDING_DEVICE, backend or EMBEDDING_BACKEND)
+
+def get_embedding_model(model_name=None, device=None, backend=None):
+    """Retourne le modèle d'embeddings partagé du processus (chargé une seule fois)"""
+    key = _registry_key(model_name, device, backend)
+    model = _embedding_models.get(key)
+    if model is not None:
+        return model
+
+    with _registry_lock:
+        # Double vérification : un autre thread a pu charger le modèle entre-temps
+        model = _embedding_models.get(key)
+        if model is None:
+            model = _build_backend(*key)
+            _embedding_models[key] = model
+    return model
+
+def warmup_embedding_model(model_name=None, device=None, backend=None):
+    """Charge le modèle et effectue un premier encodage pour éviter la latence à la première requête"""
+    key = _registry_key(model_name, device, backend)
+    model = get_embedding_model(*key)
+    if key not in _warmed_up:
+        model.embed_query("warmup")
+        _warmed_up.add(key)
+    return model
+
+def start_background_warmup(*extra_warmups, model_name=None, device=None, backend=None):
+    """Charge et préchauffe le modèle (puis extra_warmups) dans un thread, une fois par processus
+
+    L'interface s'affiche sans attendre ; une recherche lancée avant la fin attend simplement
+    le modèle (verrou du registre). Retourne le thread de préchargement.
+    """
+    global _background_warmup
+    with _warmup_lock:
+        if _background_warmup is None:
+            def run():
+                started = time.perf_counter()
+                try:
+                    warmup_embedding_model(model_name, device, backend)
+                    for warmup in extra_warmups:
+                        warmup()
+                except Exception:
+                    # Sans conséquence : le modèle sera chargé à la première recherche
+                    logger.warning("Préchargement des modèles impossible", exc_info=True)
+                startup_timings['warmup'] = time.perf_counter() - started
+
+            _background_warmup = threading.Thread(target=run, name="rag-warmup", daemon=True)
+            _background_warmup.start()
+    return _background_warmup
+
+def models_ready():
+    """Vrai quand le préchargement en arrière-plan est terminé (ou n'a pas été lancé)"""
+    return _background_warmup is None or not _background_warmup.is_alive()
+
+# -----------------------
+# BACKENDS D'INFÉRENCE
+# -----------------------
+
+def _build_backend(model_name, device, backend):
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Backend d'embeddings inconnu : {backend} (attendu : {', '.join(EMBEDDING_BACKENDS)})")
+
+    if backend.startswith("onnx"):
+        return OnnxEmbeddings(model_name, quantize=backend == "onnx-int8")
+
+    if EMBEDDING_THREADS:
+        import torch
+        torch.set_num_threads(EMBEDDING_THREADS)
+
+    # Import différé : langchain, sentence-transformers et torch ne sont chargés qu'ici
+    from langchain.embeddings import HuggingFaceEmbeddings
+    model = HuggingFaceEmbeddings(
+        model_name=model_name,
+        model_kwargs={"device": device},
+        encode_kwargs={"batch_size": EMBEDDING_BATCH_SIZE}
+    )
+    if backend == "torch-int8":
+        # Quantification dynamique int8 des couches linéaires (CPU uniquement)
+        import torch
+        model.client = torch.quantization.quantize_dynamic(model.client, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+class OnnxEmbeddings:
+    """Embeddings sentence-transformers exécutés avec ONNX Runtime (optionnellement en int8)
+
+    Le modèle est exporté une fois vers ONNX_MODELS_DIR (RAG_ONNX_DIR) puis réutilisé. Reproduit le pipeline
+    de all-MiniLM-L6-v2 : mean pooling sur le masque d'attention puis normalisation L2.
+    """
+    def __init__(self, model_name, quantize=False, batch_size=None, threads=None, models_dir=None):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise ImportError("Le backend ONNX nécessite le paquet onnxruntime (pip install onnxruntime)") from e
+        from transformers import AutoTokenizer
+
+        self.model_name = model_name
+        self.batch_size = batch_size or EMBEDDING_BATCH_SIZE
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model_path = self._export(models_dir or ONNX_MODELS_DIR, quantize)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        threads = threads if threads is not None else EMBEDDING_THREADS
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def _export(self, models_dir, quantize):
+        """Exporte le modèle HuggingFace en ONNX (et sa version int8) s'il n'existe pas déjà"""
+        directory = os.path.join(models_dir, self.model_name.replace("/", "_"))
+        fp32_path = os.path.join(directory, "model.onnx")
+        int8_path = os.path.join(directory, "model-int8.onnx")
+
+        if not os.path.exists(fp32_path):
+            import torch
+            from transformers import AutoModel
+
+            os.makedirs(directory, exist_ok=True)
+            model = AutoModel.from_pretrained(self.model_name).eval()
+            sample = self.tokenizer(["export"], return_tensors="pt")
+            input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+            dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+            dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+            torch.onnx.export(
+                model,
+                tuple(sample[name] for name in input_names),
+                fp32_path + ".tmp",
+                input_names=input_names,
+                output_names=["last_hidden_state"],
+                dynamic_axes=dynamic_axes,
+                opset_version=14
+            )
+            os.replace(fp32_path + ".tmp", fp32_path)
+
+        if not quantize:
+            return fp32_path
+
+        if not os.path.exists(int8_path):
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            quantize_dynamic(fp32_path, int8_path + ".tmp", weight_type=QuantType.QInt8)
+            os.replace(int8_path + ".tmp", int8_path)
+        return int8_path
+
+    def _encode(self, texts):
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = self.tokenizer(
+                texts[start:start + self.batch_size],
+                padding=True,
+                truncation=True,
+                max_length=EMBEDDING_MAX_LENGTH,
+                return_tensors="np"
+            )
+            feeds = {name: batch[name].astype(np.int64) for name in self.input_names}
+            hidden = self.session.run(None, feeds)[0]
+
+            # Mean pooling pondéré par le masque puis normalisation L2
+            mask = batch["attention_mask"][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            vectors.append(pooled.astype(np.float32))
+        return np.vstack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+
+    def embed_documents(self, texts):
+        return self._encode(list(texts)).tolist()
+
+    def embed_query(self, text):
+        return self._encode([text])[0].tolist()
+
+PARITY_SAMPLE_TEXTS = [
+    "Le présent contrat prend effet à la date de signature par les deux parties.",
+    "Article 12 : la résiliation doit être notifiée par lettre recommandée avec accusé de réception.",
+    "Le montant total de la prestation s'élève à 45 000 euros hors taxes.",
+    "The supplier shall deliver the goods within thirty days of the purchase order.",
+    "Annexe B – Conditions particulières applicables aux sites de Lyon et de Marseille.",
+    "Bonjour",
+]
+
+def check_embedding_parity(backend, model_name=None, texts=None, min_cosine=0.99):
+    """Compare un backend aux embeddings de référence (torch fp32) par similarité cosinus"""
+    texts = texts or PARITY_SAMPLE_TEXTS
+    reference = np.asarray(get_embedding_model(model_name, "cpu", "torch").embed_documents(texts), dtype=np.float32)
+    candidate = np.asarray(get_embedding_model(model_name, "cpu", backend).embed_documents(texts), dtype=np.float32)
+
+    cosines = (reference * candidate).sum(axis=1) / (
+        np.linalg.norm(reference, axis=1) * np.linalg.norm(candidate, axis=1) + 1e-12
+    )
+    return {
+        'backend': backend,
+        'min_cosine': float(cosines.min()),
+        'mean_cosine': float(cosines.mean()),
+        'ok': bool(cosines.min() >= min_cosine)
+    }
+
+class EmbeddingCache:
+    """Cache persistant (SQLite) des vecteurs, indexé par hash du texte du chunk et du modèle
+
+    Borné à max_entries vecteurs : au-delà, les moins récemment lus ou écrits sont supprimés
+    (jusqu'à 90 % de la limite, pour ne pas élaguer à chaque lot).
+    """
+    # Limite SQLite du nombre de paramètres par requête
+    BATCH = 500
+
+    def __init__(self, path, max_entries=EMBEDDING_CACHE_MAX_ENTRIES):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_entries = max_entries
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, "
+            "last_used REAL NOT NULL DEFAULT 0)"
+        )
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(embeddings)")]
+        if "last_used" not in columns:
+            # Cache créé avant la limite de taille : ses entrées sont les premières évincées
+            self._conn.execute("ALTER TABLE embeddings ADD COLUMN last_used REAL NOT NULL DEFAULT 0")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        self._size = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model_name, text):
+        return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys):
+        """Retourne {clé: vecteur float32} pour les clés présentes dans le cache"""
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        now = time.time()
+        with self._lock:
+            for start in range(0, len(unique_keys), self.BATCH):
+                batch = unique_keys[start:start + self.BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+            if found:
+                self._touch(list(found), now)
+                self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(unique_keys) - len(found)
+        return found
+
+    def put_many(self, items):
+        """Enregistre une liste de (clé, vecteur)"""
+        now = time.time()
+        rows = [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in items]
+        with self._lock:
+            # Une clé couvre modèle et texte : un vecteur déjà présent est identique, seule sa date change
+            inserted = self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)", rows
+            ).rowcount
+            if inserted < len(rows):
+                self._touch([key for key, _, _ in rows], now)
+            self._size += max(inserted, 0)
+            if self._size > self.max_entries:
+                self._evict()
+            self._conn.commit()
+
+    def _touch(self, keys, now):
+        for start in range(0, len(keys), self.BATCH):
+            batch = keys[start:start + self.BATCH]
+            placeholders = ",".join("?" * len(batch))
+            self._conn.execute(f"UPDATE embeddings SET last_used = ? WHERE key IN ({placeholders})", [now] + batch)
+
+    def _evict(self):
+        """Éviction LRU jusqu'à 90 % de max_entries ; à appeler sous le verrou"""
+        excess = self._size - int(self.max_entries * 0.9)
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (excess,)
+        )
+        self._size = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+class CachedEmbeddings:
+    """Embeddings (interface LangChain) qui consultent le cache avant d'appeler le modèle"""
+    def __init__(self, model, cache, model_name):
+        self.model = model
+        self.cache = cache
+        self.model_name = model_name
+
+    def embed_documents(self, texts):
+        keys = [EmbeddingCache.make_key(self.model_name, text) for text in texts]
+        cached = self.cache.get_many(keys)
+
+        # Seuls les textes absents du cache (dédupliqués) passent par le modèle
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        if missing:
+            vectors = self.model.embed_documents(list(missing.values()))
+            new_items = list(zip(missing.keys(), vectors))
+            self.cache.put_many(new_items)
+            for key, vector in new_items:
+                cached[key] = np.asarray(vector, dtype=np.float32)
+
+        return [cached[key].tolist() for key in keys]
+
+    def embed_query(self, text):
+        return self.model.embed_query(text)
+
+def get_embedding_cache(path=None):
+    """Retourne le cache d'embeddings partagé pour ce fichier (None si désactivé)"""
+    path = path if path is not None else EMBEDDING_CACHE_PATH
+    if not path:
+        return None
+    with _registry_lock:
+        cache = _embedding_caches.get(path)
+        if cache is None:
+            cache = EmbeddingCache(path)
+            _embedding_caches[path] = cache
+    return cache
+
+def embed_queries(embeddings, texts):
+    """Vecteurs d'un lot de questions (matrice float32) en un seul passage du modèle
+
+    Le cache persistant est contourné : il est réservé aux chunks des documents.
+    """
+    model = embeddings.model if isinstance(embeddings, CachedEmbeddings) else embeddings
+    return np.asarray(model.embed_documents(list(texts)), dtype=np.float32)
+
+def cached_document_vectors(embeddings, texts):
+    """Vecteurs de chunks déjà présents dans le cache persistant, sans appel au modèle
+
+    Retourne une liste alignée sur texts (None pour les textes absents, ou partout si le
+    cache est désactivé).
+    """
+    if not isinstance(embeddings, CachedEmbeddings):
+        return [None] * len(texts)
+    keys = [EmbeddingCache.make_key(embeddings.model_name, text) for text in texts]
+    found = embeddings.cache.get_many(keys)
+    return [found.get(key) for key in keys]
+
+def _embedding_cache_metrics():
+    metrics = []
+    for path, cache in list(_embedding_caches.items()):
+        metrics += [
+            ("rag_embedding_cache_hits", {'path': path}, cache.hits),
+            ("rag_embedding_cache_misses", {'path': path}, cache.misses),
+            ("rag_embedding_cache_hit_rate", {'path': path}, cache.hit_rate)
+        ]
+    return metrics
+
+register_collector(_embedding_cache_metrics)
+
+def get_cached_embedding_model(model_name=None, device=None, backend=None, cache_path=None):
+    """Modèle partagé enveloppé par le cache persistant des embeddings de chunks"""
+    model = get_embedding_model(model_name, device, backend)
+    cache = get_embedding_cache(cache_path)
+    if cache is None:
+        return model
+
+    key = _registry_key(model_name, device, backend) + (cache_path,)
+    with _registry_lock:
+        wrapper = _cached_models.get(key)
+        if wrapper is None:
+            wrapper = CachedEmbeddings(model, cache, embedding_model_id(model_name, backend))
+            _cached_models[key] = wrapper
+    return wrapper
+
+if __name__ == "__main__":
+    # Vérification de parité et débit : python embeddings.py [backend ...]
+    import sys
+
+    for backend in sys.argv[1:] or EMBEDDING_BACKENDS[1:]:
+        print(check_embedding_parity(backend))
+        model = get_embedding_model(backend=backend)
+        texts = PARITY_SAMPLE_TEXTS * 50
+        start = time.perf_counter()
+        model.embed_documents(texts)
+        elapsed = time.perf_counter() - start
+        start = time.perf_counter()
+        model.embed_query(texts[0])
+        query_ms = (time.perf_counter() - start) * 1000
+        print(f"{backend}: {len(texts) / elapsed:.1f} chunks/s, requête {query_ms:.1f} ms")
@@ -0,0 +1,363 @@
+import multiprocessing
+import os
+import queue
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+
+from metrics import inc, registry, span
+from utils import PageSplitter, content_hash
+
+# -----------------------
+# CONFIGURATION INGESTION
+# -----------------------
+
+EXTRACT_WORKERS = int(os.environ.get("RAG_EXTRACT_WORKERS", os.cpu_count() or 1))
+EMBED_BATCH_SIZE = int(os.environ.get("RAG_EMBED_BATCH_SIZE", 64))
+PAGES_PER_TASK = int(os.environ.get("RAG_PAGES_PER_TASK", 8))
+# Lots de pages en cours d'extraction ou en attente de découpage (borne la mémoire)
+MAX_PENDING_TASKS = int(os.environ.get("RAG_MAX_PENDING_TASKS", 2 * EXTRACT_WORKERS))
+# Lots de chunks en attente d'embeddings : l'extraction attend quand l'embedding prend du retard
+MAX_PENDING_BATCHES = int(os.environ.get("RAG_MAX_PENDING_BATCHES", 4))
+
+# Pools de processus partagés entre les ingestions (créés à la demande)
+_pools = {}
+_pools_lock = threading.Lock()
+
+def _get_pool(workers):
+    with _pools_lock:
+        pool = _pools.get(workers)
+        # Un pool dont un processus est mort refuse toute nouvelle tâche : il est remplacé
+        if pool is None or getattr(pool, "_broken", False):
+            # "spawn" évite de forker un processus qui a déjà chargé torch
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _pools[workers] = pool
+    return pool
+
+def _replace_pool(workers, broken):
+    """Retire un pool cassé (processus mort : plantage, mémoire) et en retourne un neuf"""
+    with _pools_lock:
+        if _pools.get(workers) is broken:
+            del _pools[workers]
+    broken.shutdown(wait=False, cancel_futures=True)
+    return _get_pool(workers)
+
+# -----------------------
+# TÂCHES EXÉCUTÉES DANS LES PROCESSUS
+# -----------------------
+
+def _count_pdf_pages(path):
+    from PyPDF2 import PdfReader
+    return len(PdfReader(path).pages)
+
+def _extract_pdf_pages(path, start, end):
+    """Extrait les pages [start, end) d'un PDF : liste de (numéro de page, texte)"""
+    from PyPDF2 import PdfReader
+    reader = PdfReader(path)
+    return [(page_num + 1, reader.pages[page_num].extract_text() or "") for page_num in range(start, end)]
+
+def _extract_docx(path):
+    import docx
+    doc = docx.Document(path)
+    return [(None, "\n".join(para.text for para in doc.paragraphs if para.text.strip()))]
+
+# -----------------------
+# PIPELINE
+# -----------------------
+
+class IngestionPipeline:
+    """Pipeline extraction → découpage → embeddings, chaque étape avançant en parallèle
+
+    Les pages des PDF sont extraites par lots dans un pool de processus. Les lots sont
+    découpés dans l'ordre au fil de l'eau (PageSplitter) et les chunks partent par lots vers
+    un thread d'embeddings : ni le texte complet d'un document ni tous ses chunks ne sont
+    gardés en mémoire. Chaque chunk porte sa plage de pages (page_start, page_end).
+
+    L'extraction tourne dans d'autres processus : plutôt qu'un générateur de pages, chaque
+    tâche retourne la liste de ses pages_per_task pages, et PageSplitter (avec état) reçoit
+    ces listes dans l'ordre. La mémoire reste bornée par max_pending_tasks lots de pages,
+    le tampon du découpeur et max_pending_batches lots de chunks.
+    """
+    def __init__(self, extract_workers=EXTRACT_WORKERS, embed_batch_size=EMBED_BATCH_SIZE,
+                 pages_per_task=PAGES_PER_TASK, chunk_size=800, chunk_overlap=100,
+                 max_pending_tasks=MAX_PENDING_TASKS, max_pending_batches=MAX_PENDING_BATCHES):
+        self.extract_workers = max(1, extract_workers)
+        self.embed_batch_size = max(1, embed_batch_size)
+        self.pages_per_task = max(1, pages_per_task)
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.max_pending_tasks = max(1, max_pending_tasks)
+        self.max_pending_batches = max(1, max_pending_batches)
+
+    def run(self, files, index=None, on_progress=None):
+        """Ingère une liste de (nom, contenu binaire)
+
+        Si index est fourni, les chunks sont vectorisés et ajoutés à l'index par lots dès
+        qu'ils sont prêts, au plus max_pending_batches lots en attente ; result['chunks'] reste
+        alors vide (les chunks sont dans l'index, result['documents'] en donne le compte). Un fichier
+        déjà indexé sous le même nom et avec le même contenu n'est pas retraité
+        (result['unchanged']) ; un contenu déjà indexé sous un autre nom est simplement renommé,
+        sans être réextrait ; une nouvelle version ne remplace l'ancienne qu'une fois
+        entièrement indexée.
+        on_progress(étape, nom_fichier, terminés, total) est toujours appelé depuis le
+        thread appelant.
+        """
+        result = {'documents': [], 'chunks': [], 'indexed': [], 'errors': [], 'empty': [], 'duplicates': [],
+                  'unchanged': []}
+        extract_pool = _get_pool(self.extract_workers)
+
+        embed_queue = queue.Queue(maxsize=self.max_pending_batches)
+        done_queue = queue.Queue()
+        embedder = None
+        if index is not None:
+            embedder = threading.Thread(
+                target=self._embed_loop, args=(index, embed_queue, done_queue), daemon=True
+            )
+            embedder.start()
+
+        tmp_dir = tempfile.mkdtemp(prefix="rag_ingest_")
+        futures = {}
+        documents = []
+        renamed = []
+        seen_hashes = set()
+        indexed = index.get_document_hashes() if index is not None else {}
+        try:
+            for name, data in files:
+                file_hash = content_hash(data)
+                if file_hash in seen_hashes:
+                    result['duplicates'].append(name)
+                    continue
+                seen_hashes.add(file_hash)
+                if indexed.get(file_hash) == name:
+                    result['unchanged'].append(name)
+                    continue
+
+                # Les processus lisent le fichier depuis le disque plutôt que de recevoir les octets
+                path = os.path.join(tmp_dir, f"{file_hash}{os.path.splitext(name)[1]}")
+                with open(path, "wb") as f:
+                    f.write(data)
+                doc = {'name': name, 'file_hash': file_hash, 'size': len(data), 'tasks': []}
+
+                try:
+                    if name.endswith(".pdf"):
+                        page_count = _count_pdf_pages(path)
+                        doc['tasks'] = [(_extract_pdf_pages, path, start, min(start + self.pages_per_task, page_count))
+                                        for start in range(0, page_count, self.pages_per_task)]
+                    elif name.endswith(".docx"):
+                        page_count = 1
+                        doc['tasks'] = [(_extract_docx, path)]
+                except Exception as e:
+                    result['errors'].append((name, str(e)))
+                    continue
+
+                if file_hash in indexed and doc['tasks']:
+                    # Même contenu déjà indexé sous un autre nom : la copie indexée est renommée (et
+                    # les anciennes versions de ce nom retirées) en une seule opération
+                    chunk_count = index.rename_document(file_hash, name)
+                    if chunk_count:
+                        doc.update({'chunk_count': chunk_count, 'page_count': page_count,
+                                    'processed_at': datetime.now().strftime("%H:%M")})
+                        renamed.append(doc)
+                        result['indexed'].append(name)
+                        continue
+
+                if not doc['tasks']:
+                    result['empty'].append(name)
+                    continue
+                doc.update({
+                    'submitted': 0,
+                    'consumed': 0,
+                    'ready': {},
+                    'splitter': PageSplitter(self.chunk_size, self.chunk_overlap),
+                    'batch': [],
+                    'chunk_count': 0,
+                    'batches': 0,
+                    'page_count': 0
+                })
+                documents.append(doc)
+
+            total = len(documents)
+            extracted = 0
+            waiting = list(documents)
+            while waiting or futures:
+                # Soumission dans l'ordre des documents, en nombre borné
+                for doc in waiting:
+                    pending = len(futures) + sum(len(d['ready']) for d in documents)
+                    while (doc['submitted'] < len(doc['tasks']) and pending < self.max_pending_tasks
+                           and not doc.get('failed')):
+                        task = doc['tasks'][doc['submitted']]
+                        try:
+                            future = extract_pool.submit(*task)
+                        except BrokenProcessPool as e:
+                            extract_pool = _replace_pool(self.extract_workers, extract_pool)
+                            self._fail(doc, e, result, embed_queue if embedder else None)
+                            break
+                        futures[future] = (doc, doc['submitted'], time.perf_counter(), extract_pool)
+                        doc['submitted'] += 1
+                        pending += 1
+                waiting = [doc for doc in waiting if doc['submitted'] < len(doc['tasks']) and not doc.get('failed')]
+                if not futures:
+                    break
+
+                done, _ = wait(list(futures), return_when=FIRST_COMPLETED)
+                for future in done:
+                    doc, position, submitted_at, pool = futures.pop(future)
+                    if doc.get('failed'):
+                        continue
+                    # Durée vue du pipeline (attente dans le pool comprise) : l'extraction tourne
+                    # dans un autre processus, dont les métriques ne remontent pas
+                    registry.observe("rag_stage_seconds", time.perf_counter() - submitted_at, stage="extraction")
+                    try:
+                        doc['ready'][position] = future.result()
+                    except Exception as e:
+                        if isinstance(e, BrokenProcessPool) and pool is extract_pool:
+                            # Toutes les tâches du pool échouent : les documents suivants repartent sur un pool neuf
+                            extract_pool = _replace_pool(self.extract_workers, extract_pool)
+                        self._fail(doc, e, result, embed_queue if embedder else None)
+                        continue
+
+                    # Les lots sont découpés dans l'ordre des pages, dès qu'ils sont disponibles
+                    while doc['consumed'] in doc['ready']:
+                        pages = doc['ready'].pop(doc['consumed'])
+                        doc['consumed'] += 1
+                        doc['page_count'] += len(pages)
+                        inc("rag_pages_extracted_total", len(pages))
+                        with span("découpage"):
+                            chunks = doc['splitter'].feed(pages)
+                        self._emit(doc, chunks, result, embed_queue if embedder else None)
+
+                    if doc['consumed'] == len(doc['tasks']):
+                        extracted += 1
+                        self._notify(on_progress, "extraction", doc['name'], extracted, total)
+                        self._finish_document(doc, result, embed_queue if embedder else None)
+                        self._notify(on_progress, "découpage", doc['name'], extracted, total)
+
+                self._drain(done_queue, result, on_progress, total)
+
+            if embedder is not None:
+                embed_queue.put(None)
+                while embedder.is_alive() or not done_queue.empty():
+                    embedder.join(timeout=0.1)
+                    self._drain(done_queue, result, on_progress, total)
+        finally:
+            for future in list(futures):
+                future.cancel()
+            if embedder is not None and embedder.is_alive():
+                embed_queue.put(None)
+            for file_name in os.listdir(tmp_dir):
+                os.remove(os.path.join(tmp_dir, file_name))
+            os.rmdir(tmp_dir)
+
+        result['documents'] = [{
+            'name': doc['name'],
+            'file_hash': doc['file_hash'],
+            'size': doc['size'],
+            'chunk_count': doc['chunk_count'],
+            'page_count': doc['page_count'],
+            'processed_at': doc['processed_at']
+        } for doc in renamed + documents if not doc.get('failed')]
+        return result
+
+    def _fail(self, doc, error, result, embed_queue):
+        doc['failed'] = True
+        doc['ready'] = {}
+        result['errors'].append((doc['name'], str(error)))
+        if embed_queue is not None and doc['batches']:
+            # Des lots sont déjà partis vers l'index : le document partiel sera retiré
+            embed_queue.put((doc, None, False))
+
+    def _emit(self, doc, chunks, result, embed_queue, last=False):
+        """Transforme les chunks découpés en enregistrements et envoie les lots complets"""
+        for text, page_start, page_end in chunks:
+            doc['batch'].append({
+                'text': text,
+                'source': doc['name'],
+                'file_hash': doc['file_hash'],
+                'chunk_hash': content_hash(text),
+                'chunk_size': len(text),
+                'position': doc['chunk_count'],
+                'page_start': page_start,
+                'page_end': page_end
+            })
+            doc['chunk_count'] += 1
+        inc("rag_chunks_created_total", len(chunks))
+
+        if len(doc['batch']) >= self.embed_batch_size or (last and doc['batch']):
+            records, doc['batch'] = doc['batch'], []
+            if embed_queue is not None:
+                embed_queue.put((doc, records, last))
+            else:
+                result['chunks'].extend(records)
+            doc['batches'] += 1
+        elif last and embed_queue is not None and doc['batches']:
+            embed_queue.put((doc, [], True))
+
+    def _finish_document(self, doc, result, embed_queue):
+        with span("découpage"):
+            chunks = doc['splitter'].finish()
+        self._emit(doc, chunks, result, embed_queue, last=True)
+        doc['splitter'] = None
+        doc['processed_at'] = datetime.now().strftime("%H:%M")
+        if doc['chunk_count'] == 0:
+            doc['failed'] = True
+            result['empty'].append(doc['name'])
+
+    def _embed_loop(self, index, embed_queue, done_queue):
+        """Thread d'embeddings : vectorise chaque lot et l'ajoute à l'index
+
+        La version précédente d'un document (même nom, autre contenu) reste cherchable jusqu'à
+        ce que le dernier lot de la nouvelle soit indexé ; si un lot échoue, les lots déjà
+        ajoutés du document sont retirés et l'ancienne version est conservée. Un document reçu
+        ici n'est jamais déjà indexé : les contenus connus sont renommés par run().
+        """
+        try:
+            while True:
+                item = embed_queue.get()
+                if item is None:
+                    return
+                doc, chunk_records, last = item
+                if doc.get('embed_failed'):
+                    continue
+                if chunk_records is None:
+                    index.remove_document(doc['file_hash'])
+                    continue
+                try:
+                    if chunk_records:
+                        with span("embedding_chunks"):
+                            vectors = index.embeddings.embed_documents([chunk['text'] for chunk in chunk_records])
+                        index.add(chunk_records, replace=False, vectors=vectors)
+                    if last:
+                        index.remove_previous_versions(doc['file_hash'], doc['name'])
+                        done_queue.put((doc, None))
+                except Exception as e:
+                    doc['embed_failed'] = True
+                    index.remove_document(doc['file_hash'])
+                    done_queue.put((doc, e))
+        except Exception:
+            # Erreur hors d'un lot (retrait d'un document) : la file est vidée jusqu'au bout, sans
+            # quoi l'extraction resterait bloquée sur une file pleine
+            while embed_queue.get() is not None:
+                pass
+            raise
+
+    def _drain(self, done_queue, result, on_progress, total):
+        while True:
+            try:
+                doc, error = done_queue.get_nowait()
+            except queue.Empty:
+                return
+            if error is not None:
+                doc['failed'] = True
+                result['errors'].append((doc['name'], str(error)))
+            else:
+                result['indexed'].append(doc['name'])
+                inc("rag_documents_indexed_total")
+            self._notify(on_progress, "indexation", doc['name'], len(result['indexed']), total)
+
+    @staticmethod
+    def _notify(on_progress, stage, name, done, total):
+        if on_progress is not None:
+            on_progress(stage, name, done, total)
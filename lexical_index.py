@@ -0,0 +1,211 @@
+import json
+import re
+import unicodedata
+
+import numpy as np
+
+# -----------------------
+# CONFIGURATION BM25
+# -----------------------
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Postings en attente au-delà desquels add() compacte l'index (les listes Python par terme
+# coûtent cher en mémoire et chaque recherche les reconvertit en tableaux numpy)
+BM25_PENDING_MAX = 200_000
+
+# Mots vides français et anglais les plus fréquents (aucun intérêt lexical)
+STOP_WORDS = {
+    "le", "la", "les", "un", "une", "des", "du", "de", "d", "l", "et", "ou", "en", "au", "aux",
+    "a", "est", "que", "qui", "dans", "par", "pour", "sur", "ce", "ces", "se", "sa", "son", "ses",
+    "il", "elle", "ils", "elles", "ne", "pas", "plus", "avec", "comme", "the", "of", "and", "to",
+    "in", "is", "for", "on", "by", "an", "be", "or",
+}
+
+# Mots simples, et identifiants composés comme "L.1234-5", "2023/45" ou "art.12"
+_TOKEN_PATTERN = re.compile(r"\w+(?:[.\-/]\w+)*")
+
+def tokenize(text):
+    """Découpe en termes normalisés (minuscules, sans accents), identifiants composés conservés"""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    tokens = []
+    for token in _TOKEN_PATTERN.findall(text):
+        if token in STOP_WORDS:
+            continue
+        tokens.append(token)
+        # Les parties d'un identifiant composé restent cherchables séparément
+        if any(sep in token for sep in ".-/"):
+            tokens.extend(part for part in re.split(r"[.\-/]", token) if part and part not in STOP_WORDS)
+    return tokens
+
+class BM25Index:
+    """Index inversé BM25 incrémental à postings compacts (tableaux numpy)
+
+    Les postings compactés sont stockés au format CSR (offsets + identifiants + fréquences) ;
+    les ajouts récents restent dans de petites listes par terme jusqu'à la prochaine compaction,
+    déclenchée par add() dès que BM25_PENDING_MAX postings sont en attente.
+    Les documents sont adressés par le vector_id de FAISSIndex.
+    """
+    def __init__(self):
+        self.vocabulary = {}
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._post_ids = np.zeros(0, dtype=np.int64)
+        self._post_tf = np.zeros(0, dtype=np.float32)
+        self._pending = {}
+        self._pending_count = 0
+        self._lengths = np.zeros(0, dtype=np.float32)
+        self._alive = np.zeros(0, dtype=bool)
+        self._doc_count = 0
+        self._total_length = 0.0
+
+    def _ensure_capacity(self, max_id):
+        if max_id < len(self._lengths):
+            return
+        size = max(max_id + 1, 2 * len(self._lengths), 1024)
+        lengths = np.zeros(size, dtype=np.float32)
+        lengths[:len(self._lengths)] = self._lengths
+        alive = np.zeros(size, dtype=bool)
+        alive[:len(self._alive)] = self._alive
+        self._lengths, self._alive = lengths, alive
+
+    def add(self, doc_ids, texts):
+        """Indexe des textes sous les identifiants donnés"""
+        doc_ids = [int(doc_id) for doc_id in doc_ids]
+        if not doc_ids:
+            return
+        self._ensure_capacity(max(doc_ids))
+        for doc_id, text in zip(doc_ids, texts):
+            tokens = tokenize(text)
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, count in counts.items():
+                term_id = self.vocabulary.get(token)
+                if term_id is None:
+                    term_id = len(self.vocabulary)
+                    self.vocabulary[token] = term_id
+                self._pending.setdefault(term_id, []).append((doc_id, count))
+            self._pending_count += len(counts)
+            self._lengths[doc_id] = len(tokens)
+            self._alive[doc_id] = True
+            self._doc_count += 1
+            self._total_length += len(tokens)
+        if self._pending_count >= BM25_PENDING_MAX:
+            self.compact()
+
+    def remove(self, doc_ids):
+        """Retire des documents (les postings sont purgés à la compaction suivante)"""
+        for doc_id in doc_ids:
+            doc_id = int(doc_id)
+            if doc_id < len(self._alive) and self._alive[doc_id]:
+                self._alive[doc_id] = False
+                self._doc_count -= 1
+                self._total_length -= float(self._lengths[doc_id])
+
+    def _postings(self, term_id):
+        if term_id + 1 < len(self._offsets):
+            start, end = self._offsets[term_id], self._offsets[term_id + 1]
+            ids, tf = self._post_ids[start:end], self._post_tf[start:end]
+        else:
+            ids, tf = self._post_ids[:0], self._post_tf[:0]
+        pending = self._pending.get(term_id)
+        if pending:
+            pending = np.asarray(pending, dtype=np.float64)
+            ids = np.concatenate([ids, pending[:, 0].astype(np.int64)])
+            tf = np.concatenate([tf, pending[:, 1].astype(np.float32)])
+        mask = self._alive[ids]
+        return ids[mask], tf[mask]
+
+    def search(self, query, k=10, allowed=None):
+        """Retourne (identifiants, scores BM25) des k meilleurs documents
+
+        allowed (tableau d'identifiants) restreint les résultats à ces documents.
+        """
+        if self._doc_count <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        avg_length = self._total_length / self._doc_count
+
+        all_ids = []
+        all_scores = []
+        for token in set(tokenize(query)):
+            term_id = self.vocabulary.get(token)
+            if term_id is None:
+                continue
+            ids, tf = self._postings(term_id)
+            if len(ids) == 0:
+                continue
+            idf = np.log(1.0 + (self._doc_count - len(ids) + 0.5) / (len(ids) + 0.5))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self._lengths[ids] / avg_length)
+            all_ids.append(ids)
+            all_scores.append(idf * tf * (BM25_K1 + 1) / (tf + norm))
+
+        if not all_ids:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        ids, inverse = np.unique(np.concatenate(all_ids), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(all_scores)).astype(np.float32)
+        if allowed is not None:
+            mask = np.isin(ids, allowed)
+            ids, scores = ids[mask], scores[mask]
+        top = np.argsort(-scores)[:k]
+        return ids[top], scores[top]
+
+    def compact(self):
+        """Fusionne les ajouts en attente dans le CSR et purge les documents retirés"""
+        n_terms = len(self.vocabulary)
+        terms = np.repeat(np.arange(len(self._offsets) - 1, dtype=np.int64), np.diff(self._offsets))
+        ids, tf = self._post_ids, self._post_tf
+        if self._pending:
+            pending_terms = np.concatenate([np.full(len(postings), term_id, dtype=np.int64)
+                                            for term_id, postings in self._pending.items()])
+            pending = np.asarray([posting for postings in self._pending.values() for posting in postings],
+                                 dtype=np.int64)
+            terms = np.concatenate([terms, pending_terms])
+            ids = np.concatenate([ids, pending[:, 0]])
+            tf = np.concatenate([tf, pending[:, 1].astype(np.float32)])
+        mask = self._alive[ids]
+        terms, ids, tf = terms[mask], ids[mask], tf[mask]
+        # Tri stable par terme : l'ordre d'ajout des postings est conservé
+        order = np.argsort(terms, kind="stable")
+        self._offsets = np.concatenate([[0], np.cumsum(np.bincount(terms, minlength=n_terms))]).astype(np.int64)
+        self._post_ids = ids[order].astype(np.int64)
+        self._post_tf = tf[order].astype(np.float32)
+        self._pending = {}
+        self._pending_count = 0
+
+    def save(self, path):
+        self.compact()
+        terms = sorted(self.vocabulary, key=self.vocabulary.get)
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                terms=np.frombuffer(json.dumps(terms, ensure_ascii=False).encode("utf-8"), dtype=np.uint8),
+                offsets=self._offsets,
+                post_ids=self._post_ids,
+                post_tf=self._post_tf,
+                lengths=self._lengths,
+                alive=self._alive
+            )
+
+    @classmethod
+    def load(cls, path):
+        index = cls()
+        with np.load(path) as data:
+            terms = json.loads(data['terms'].tobytes().decode("utf-8"))
+            index.vocabulary = {term: term_id for term_id, term in enumerate(terms)}
+            index._offsets = data['offsets']
+            index._post_ids = data['post_ids']
+            index._post_tf = data['post_tf']
+            index._lengths = data['lengths']
+            index._alive = data['alive']
+        index._doc_count = int(index._alive.sum())
+        index._total_length = float(index._lengths[index._alive].sum())
+        return index
+
+def reciprocal_rank_fusion(rankings, k=60, weights=None):
+    """Fusionne plusieurs classements (listes d'identifiants) : score = Σ poids / (k + rang)"""
+    scores = {}
+    for ranking, weight in zip(rankings, weights or [1.0] * len(rankings)):
+        for rank, item in enumerate(ranking, 1):
+            scores[item] = scores.get(item, 0.0) + weight / (k + rank)
+    return sorted(scores.items(), key=lambda pair: pair[1], reverse=True)
@@ -0,0 +1,279 @@
+import asyncio
+import email.utils
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# -----------------------
+# CONFIGURATION CLIENT LLM
+# -----------------------
+
+LLM_MAX_RETRIES = int(os.environ.get("RAG_LLM_MAX_RETRIES", 4))
+LLM_BACKOFF_BASE = float(os.environ.get("RAG_LLM_BACKOFF_BASE", 0.5))
+LLM_BACKOFF_MAX = float(os.environ.get("RAG_LLM_BACKOFF_MAX", 20))
+# Requêtes simultanées maximales vers l'API et débit maximal (requêtes par seconde, 0 = illimité)
+LLM_MAX_CONCURRENCY = int(os.environ.get("RAG_LLM_MAX_CONCURRENCY", 4))
+LLM_RATE_LIMIT = float(os.environ.get("RAG_LLM_RATE_LIMIT", 5))
+LLM_POOL_SIZE = int(os.environ.get("RAG_LLM_POOL_SIZE", 10))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+class LLMAPIError(Exception):
+    """Erreur HTTP définitive (après épuisement des tentatives)"""
+    def __init__(self, status_code, message=""):
+        super().__init__(f"HTTP {status_code}: {message}")
+        self.status_code = status_code
+
+def parse_retry_after(value):
+    """Durée d'attente demandée par l'en-tête Retry-After (secondes ou date HTTP)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        parsed = email.utils.parsedate_to_datetime(value)
+        return max(0.0, parsed.timestamp() - time.time()) if parsed else None
+
+def backoff_delay(attempt, retry_after=None, base=LLM_BACKOFF_BASE, cap=LLM_BACKOFF_MAX):
+    """Backoff exponentiel à gigue complète, jamais inférieur au Retry-After du serveur"""
+    delay = random.uniform(0, min(cap, base * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, cap))
+    return delay
+
+def request_key(payload):
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+class RateLimiter:
+    """Seau à jetons : au plus `rate` requêtes par seconde, avec une rafale de `burst`"""
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        """Réserve un jeton et retourne le temps d'attente nécessaire"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def acquire(self):
+        if self.rate > 0:
+            time.sleep(self._reserve())
+
+    async def acquire_async(self):
+        if self.rate > 0:
+            await asyncio.sleep(self._reserve())
+
+class LLMClient:
+    """Client HTTP partagé : pool de connexions keep-alive, tentatives avec backoff,
+    limite de débit, plafond de concurrence et fusion des requêtes identiques en vol
+    """
+    def __init__(self, url, api_key, timeout=45, max_retries=LLM_MAX_RETRIES,
+                 max_concurrency=LLM_MAX_CONCURRENCY, rate_limit=LLM_RATE_LIMIT, pool_size=LLM_POOL_SIZE):
+        self.url = url
+        self.api_key = api_key
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.max_concurrency = max_concurrency
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self.rate_limiter = RateLimiter(rate_limit)
+        self._in_flight = {}
+        self._in_flight_lock = threading.Lock()
+        self.stats = {'requests': 0, 'retries': 0, 'coalesced': 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def headers(self, stream=False):
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        if stream:
+            headers["Accept"] = "text/event-stream"
+        return headers
+
+    def _post(self, payload, stream=False, timeout=None):
+        """POST avec tentatives ; retourne la réponse réussie ou lève LLMAPIError
+
+        Chaque tentative occupe un créneau de concurrence, rendu avant l'attente du backoff ;
+        celui de la réponse réussie reste pris et doit être libéré par l'appelant.
+        """
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            self._semaphore.acquire()
+            self._count('requests')
+            try:
+                response = self.session.post(self.url, headers=self.headers(stream), json=payload,
+                                             stream=stream, timeout=timeout or self.timeout)
+            except requests.exceptions.ConnectionError:
+                self._semaphore.release()
+                if attempt == self.max_retries:
+                    raise
+                self._count('retries')
+                time.sleep(backoff_delay(attempt))
+                continue
+            except BaseException:
+                self._semaphore.release()
+                raise
+
+            if response.status_code < 400:
+                return response
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            message = response.text[:200]
+            response.close()
+            self._semaphore.release()
+            if response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                raise LLMAPIError(response.status_code, message)
+            self._count('retries')
+            time.sleep(backoff_delay(attempt, retry_after))
+
+    def complete(self, payload):
+        """Appel chat-completions non streamé ; les requêtes identiques en vol partagent un seul appel"""
+        key = request_key(payload)
+        with self._in_flight_lock:
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._in_flight[key] = future
+            else:
+                self._count('coalesced')
+        if not owner:
+            return future.result()
+
+        try:
+            response = self._post(payload)
+            try:
+                result = response.json()
+            finally:
+                self._semaphore.release()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._in_flight_lock:
+                self._in_flight.pop(key, None)
+
+    def open_stream(self, payload, timeout=None):
+        """Ouvre un flux SSE (tentatives avant le premier octet uniquement)
+
+        Le créneau de concurrence est libéré à la fermeture de la réponse.
+        """
+        response = self._post(payload, stream=True, timeout=timeout)
+        release = self._semaphore.release
+        original_close = response.close
+        released = []
+
+        def close():
+            original_close()
+            if not released:
+                released.append(True)
+                release()
+        response.close = close
+        return response
+
+class AsyncLLMClient:
+    """Variante asyncio (aiohttp) du client : mêmes tentatives, débit, concurrence et fusion"""
+    def __init__(self, url, api_key, timeout=45, max_retries=LLM_MAX_RETRIES,
+                 max_concurrency=LLM_MAX_CONCURRENCY, rate_limit=LLM_RATE_LIMIT, pool_size=LLM_POOL_SIZE):
+        self.url = url
+        self.api_key = api_key
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.pool_size = pool_size
+        self.max_concurrency = max_concurrency
+        self.rate_limiter = RateLimiter(rate_limit)
+        self._semaphore = None
+        self._session = None
+        self._in_flight = {}
+        self.stats = {'requests': 0, 'retries': 0, 'coalesced': 0}
+
+    async def __aenter__(self):
+        import aiohttp
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.pool_size),
+            timeout=aiohttp.ClientTimeout(total=self.timeout)
+        )
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def complete(self, payload):
+        key = request_key(payload)
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.stats['coalesced'] += 1
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            result = await self._post(payload)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            # Appel annulé : les requêtes fusionnées qui l'attendaient sont annulées aussi
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Évite l'avertissement "exception never retrieved" quand personne n'attendait
+            future.exception()
+            raise
+        finally:
+            self._in_flight.pop(key, None)
+
+    async def _post(self, payload):
+        import aiohttp
+        headers = {"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"}
+        for attempt in range(self.max_retries + 1):
+            await self.rate_limiter.acquire_async()
+            self.stats['requests'] += 1
+            try:
+                # Le créneau de concurrence n'est tenu que pendant la requête, pas pendant le backoff
+                async with self._semaphore, self._session.post(self.url, headers=headers, json=payload) as response:
+                    if response.status < 400:
+                        return await response.json()
+                    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                    message = (await response.text())[:200]
+                    status = response.status
+            except aiohttp.ClientConnectionError:
+                if attempt == self.max_retries:
+                    raise
+                self.stats['retries'] += 1
+                await asyncio.sleep(backoff_delay(attempt))
+                continue
+
+            if status not in RETRY_STATUSES or attempt == self.max_retries:
+                raise LLMAPIError(status, message)
+            self.stats['retries'] += 1
+            await asyncio.sleep(backoff_delay(attempt, retry_after))
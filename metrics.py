@@ -0,0 +1,236 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# -----------------------
+# CONFIGURATION MÉTRIQUES
+# -----------------------
+
+# Désactivées par défaut : span() et inc() ne font alors qu'un test de booléen
+METRICS_ENABLED = os.environ.get("RAG_METRICS", "0") == "1"
+# Port d'exposition /metrics du processus Streamlit (0 = pas d'exposition)
+METRICS_PORT = int(os.environ.get("RAG_METRICS_PORT", 0))
+# Bornes des histogrammes de latence, en secondes
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+class MetricsRegistry:
+    """Compteurs et histogrammes de latence par étape, exportables au format Prometheus
+
+    Les valeurs calculées à la demande (taux de succès des caches, tailles) sont fournies par
+    des collecteurs enregistrés avec register_collector() et lus uniquement à l'export.
+    """
+    def __init__(self, enabled=METRICS_ENABLED, buckets=LATENCY_BUCKETS):
+        self.enabled = enabled
+        self.buckets = tuple(buckets)
+        self._counters = {}
+        # (nom, labels) -> [comptes par borne, somme, nombre]
+        self._histograms = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+
+    def register_collector(self, collector):
+        """collector() retourne une liste de (nom, labels, valeur) lue à chaque export"""
+        self._collectors.append(collector)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def _collect(self):
+        gauges = []
+        for collector in self._collectors:
+            try:
+                gauges.extend(collector())
+            except Exception:
+                continue
+        return gauges
+
+    def stage_stats(self, name="rag_stage_seconds"):
+        """Par étape : nombre d'appels, latence moyenne et p95 estimé (ms), pour l'interface"""
+        with self._lock:
+            histograms = {dict(labels).get('stage', ""): (list(counts), total, count)
+                          for (metric, labels), (counts, total, count) in self._histograms.items()
+                          if metric == name}
+        stats = {}
+        for stage, (counts, total, count) in sorted(histograms.items()):
+            stats[stage] = {
+                'count': count,
+                'mean_ms': total / count * 1000 if count else 0.0,
+                'p95_ms': self._quantile(counts, count, 0.95) * 1000
+            }
+        return stats
+
+    def _quantile(self, counts, count, q):
+        """Estimation d'un quantile par interpolation linéaire dans les bornes de l'histogramme"""
+        if not count:
+            return 0.0
+        target = q * count
+        lower, below = 0.0, 0
+        for bound, cumulative in zip(self.buckets, counts):
+            if cumulative >= target:
+                inside = cumulative - below
+                return lower + (bound - lower) * ((target - below) / inside if inside else 1.0)
+            lower, below = bound, cumulative
+        return self.buckets[-1]
+
+    def counters(self):
+        """Compteurs sous forme {nom{labels}: valeur}, pour l'interface"""
+        with self._lock:
+            items = list(self._counters.items())
+        return {_series(name, labels): value for (name, labels), value in sorted(items)}
+
+    def gauges(self):
+        return {_series(name, tuple(sorted(labels.items()))): value for name, labels, value in self._collect()}
+
+    def render(self):
+        """Export texte au format d'exposition Prometheus"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, (list(counts), total, count))
+                                for key, (counts, total, count) in self._histograms.items())
+        lines = []
+        typed = set()
+
+        def declare(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            declare(name, "counter")
+            lines.append(f"{_series(name, labels)} {_number(value)}")
+        for (name, labels), (counts, total, count) in histograms:
+            declare(name, "histogram")
+            for bound, cumulative in zip(self.buckets, counts):
+                lines.append(f"{_series(name + '_bucket', labels + (('le', _number(bound)),))} {cumulative}")
+            lines.append(f"{_series(name + '_bucket', labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{_series(name + '_sum', labels)} {_number(total)}")
+            lines.append(f"{_series(name + '_count', labels)} {count}")
+        for name, labels, value in sorted(self._collect(), key=lambda item: item[0]):
+            declare(name, "gauge")
+            lines.append(f"{_series(name, tuple(sorted(labels.items())))} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+def _series(name, labels):
+    if not labels:
+        return name
+    escaped = ",".join('{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+                       for key, value in labels)
+    return f"{name}{{{escaped}}}"
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+# Registre partagé par tout le processus
+registry = MetricsRegistry()
+_local = threading.local()
+
+def inc(name, value=1, **labels):
+    registry.inc(name, value, **labels)
+
+def register_collector(collector):
+    registry.register_collector(collector)
+
+class _Span:
+    __slots__ = ("stage", "started")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.started
+        registry.observe("rag_stage_seconds", elapsed, stage=self.stage)
+        trace = getattr(_local, "trace", None)
+        if trace is not None:
+            trace[self.stage] = trace.get(self.stage, 0.0) + elapsed
+        return False
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NO_SPAN = _NoSpan()
+
+def span(stage):
+    """Mesure la durée d'une étape (histogramme rag_stage_seconds et trace en cours)"""
+    if not registry.enabled:
+        return _NO_SPAN
+    return _Span(stage)
+
+@contextmanager
+def trace():
+    """Collecte, pour le thread courant, la durée cumulée de chaque étape : {étape: secondes}
+
+    Utilisé pour détailler une question (embedding, FAISS, BM25, prompt...) ; reste vide si
+    les métriques sont désactivées.
+    """
+    previous = getattr(_local, "trace", None)
+    stages = {}
+    _local.trace = stages
+    try:
+        yield stages
+    finally:
+        _local.trace = previous
+
+def serve_metrics(port=METRICS_PORT, host="0.0.0.0"):
+    """Expose /metrics dans un thread (une seule fois par processus) ; retourne le serveur"""
+    global _metrics_server
+    with _server_lock:
+        if _metrics_server is None and port:
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.split("?")[0] != "/metrics":
+                        self.send_error(404)
+                        return
+                    data = registry.render().encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+
+                def log_message(self, format, *args):
+                    pass
+
+            _metrics_server = ThreadingHTTPServer((host, port), Handler)
+            _metrics_server.daemon_threads = True
+            threading.Thread(target=_metrics_server.serve_forever, daemon=True).start()
+    return _metrics_server
+
+_metrics_server = None
+_server_lock = threading.Lock()
@@ -1,27 +1,32 @@
+import hashlib
+import json
+import os
+import threading
+import time
 import requests
-import streamlit as st
+
+from answer_cache import context_key, get_answer_cache
+from context_builder import CONTEXT_TOKEN_BUDGET, build_context, estimate_tokens, is_packed
+from llm_client import LLMAPIError, LLMClient
+from metrics import inc, register_collector, registry, span
 
 # -----------------------
 # CONFIGURATION MISTRAL
 # -----------------------
 
-MISTRAL_API_URL = "https://api.mistral.ai/v1/chat/completions"
-MISTRAL_API_KEY = "uXm9QqcIgCCylmcePxiZacnYdICgSouW"
+MISTRAL_API_URL = os.environ.get("MISTRAL_API_URL", "https://api.mistral.ai/v1/chat/completions")
+MISTRAL_API_KEY = os.environ.get("MISTRAL_API_KEY", "uXm9QqcIgCCylmcePxiZacnYdICgSouW")
 MISTRAL_MODEL = "mistral-tiny"
+MISTRAL_TEMPERATURE = 0.2
+MISTRAL_MAX_TOKENS = 1200
+MISTRAL_TOP_P = 0.9
+MAX_CONTEXT_CHUNKS = 6
+MISTRAL_TIMEOUT = 45
+# Délai maximal entre deux morceaux du flux SSE
+MISTRAL_STREAM_READ_TIMEOUT = 30
 
-def get_mistral_api_key():
-    return MISTRAL_API_KEY
-
-def call_mistral_api(context_chunks_with_metadata, question, conversation_history=[]):
-    """Appelle l'API Mistral avec un prompt amélioré pour une meilleure intelligence"""
-    
-    headers = {
-        "Authorization": f"Bearer {MISTRAL_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    
-    # Construction du prompt ultra-optimisé pour l'analyse documentaire
-    system_prompt = """Tu es un expert en analyse documentaire avec des capacités de raisonnement avancées.
+# Construction du prompt ultra-optimisé pour l'analyse documentaire
+SYSTEM_PROMPT = """Tu es un expert en analyse documentaire avec des capacités de raisonnement avancées.
 
 🎯 TON RÔLE :
 Analyser profondément les documents pour fournir des réponses intelligentes, contextuelles et précises.
@@ -47,10 +52,92 @@ Analyser profondément les documents pour fournir des réponses intelligentes, c
 
 Ton objectif : être l'analyste documentaire le plus compétent et fiable."""
 
-    messages = [{"role": "system", "content": system_prompt}]
+def get_mistral_api_key():
+    return MISTRAL_API_KEY
+
+def settings_signature():
+    """Empreinte du modèle, des paramètres de génération et du prompt système"""
+    signature = f"{MISTRAL_MODEL}|{MISTRAL_TEMPERATURE}|{MISTRAL_MAX_TOKENS}|{MISTRAL_TOP_P}|{MAX_CONTEXT_CHUNKS}|{CONTEXT_TOKEN_BUDGET}|{SYSTEM_PROMPT}"
+    return hashlib.sha256(signature.encode()).hexdigest()[:16]
+
+def call_mistral_api(context_chunks_with_metadata, question, conversation_history=[]):
+    """Appelle l'API Mistral avec un prompt amélioré pour une meilleure intelligence"""
+    answer, _ = _call_mistral_api(context_chunks_with_metadata, question, conversation_history)
+    return answer
+
+_llm_client = None
+_llm_client_settings = None
+_llm_client_lock = threading.Lock()
+
+def get_llm_client():
+    """Client HTTP partagé par le processus (pool de connexions, tentatives, limite de débit)
+
+    Recréé quand l'URL, la clé API ou le délai d'attente changent.
+    """
+    global _llm_client, _llm_client_settings
+    settings = (MISTRAL_API_URL, MISTRAL_API_KEY, MISTRAL_TIMEOUT)
+    with _llm_client_lock:
+        if _llm_client is None or _llm_client_settings != settings:
+            _llm_client = LLMClient(MISTRAL_API_URL, MISTRAL_API_KEY, timeout=MISTRAL_TIMEOUT)
+            _llm_client_settings = settings
+    return _llm_client
+
+def _llm_client_metrics():
+    client = _llm_client
+    if client is None:
+        return []
+    return [(f"rag_llm_client_{name}", {}, value) for name, value in client.stats.items()]
+
+register_collector(_llm_client_metrics)
+
+def record_token_usage(payload, answer, usage=None):
+    """Compte les tokens d'un appel : usage renvoyé par l'API, sinon estimation sur le texte"""
+    if not registry.enabled:
+        return
+    usage = usage or {}
+    prompt_tokens = usage.get("prompt_tokens") or sum(estimate_tokens(message["content"])
+                                                      for message in payload["messages"])
+    completion_tokens = usage.get("completion_tokens") or estimate_tokens(answer)
+    inc("rag_llm_prompt_tokens_total", prompt_tokens)
+    inc("rag_llm_completion_tokens_total", completion_tokens)
+
+def select_context(context_chunks_with_metadata):
+    """Chunks réellement envoyés : fusion des voisins et budget de tokens (cf. context_builder)
+
+    Un contexte déjà construit par retrieve() (chunks marqués 'packed') est repris tel quel.
+    """
+    if is_packed(context_chunks_with_metadata):
+        return list(context_chunks_with_metadata[:MAX_CONTEXT_CHUNKS])
+    return build_context(context_chunks_with_metadata, max_chunks=MAX_CONTEXT_CHUNKS)
+
+def format_citation(chunk):
+    """Référence d'un chunk à partir de ses métadonnées : 'rapport.pdf, p. 3-4'"""
+    page_start, page_end = chunk.get('page_start'), chunk.get('page_end')
+    if not page_start:
+        return chunk['source']
+    if page_end and page_end != page_start:
+        return f"{chunk['source']}, p. {page_start}-{page_end}"
+    return f"{chunk['source']}, p. {page_start}"
+
+def sent_history(conversation_history, question=None):
+    """Messages d'historique réellement envoyés au modèle avec la question
+
+    L'interface passe la conversation qui se termine déjà par la question posée : ce dernier
+    message est écarté, la question étant envoyée à part (et, pour le cache des réponses,
+    comparée par similarité plutôt que par son texte exact).
+    """
+    if (question is not None and conversation_history and conversation_history[-1]["type"] == "question"
+            and conversation_history[-1]["text"] == question):
+        conversation_history = conversation_history[:-1]
+    return conversation_history[-3:]  # Garde les 3 derniers échanges
+
+def build_mistral_payload(context_chunks_with_metadata, question, conversation_history, stream=False):
+    """Construit la charge utile de l'appel chat-completions"""
+
+    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
     
     # Ajout de l'historique récent avec contexte conversationnel
-    for msg in conversation_history[-3:]:  # Garde les 3 derniers échanges
+    for msg in sent_history(conversation_history, question):
         if msg["type"] == "question":
             messages.append({"role": "user", "content": msg["text"]})
         else:
@@ -58,8 +145,8 @@ Ton objectif : être l'analyste documentaire le plus compétent et fiable."""
     
     # Préparation du contexte enrichi avec métadonnées
     context_parts = []
-    for i, chunk_data in enumerate(context_chunks_with_metadata[:6]):  # 6 chunks max
-        source_info = f"[Source: {chunk_data['source']}]"
+    for i, chunk_data in enumerate(select_context(context_chunks_with_metadata)):
+        source_info = f"[Source: {format_citation(chunk_data)}]"
         context_parts.append(f"{source_info}\n{chunk_data['text']}")
     
     context_text = "\n\n" + "="*50 + "\n".join(context_parts) + "\n" + "="*50
@@ -83,35 +170,129 @@ En tant qu'expert en analyse documentaire, fournis une réponse :
     payload = {
         "model": MISTRAL_MODEL,
         "messages": messages,
-        "temperature": 0.2,
-        "max_tokens": 1200,
-        "top_p": 0.9
+        "temperature": MISTRAL_TEMPERATURE,
+        "max_tokens": MISTRAL_MAX_TOKENS,
+        "top_p": MISTRAL_TOP_P,
+        "stream": stream
     }
+    return payload
+
+def _status_error_message(status_code):
+    """Message utilisateur pour les statuts HTTP d'erreur connus (None sinon)"""
+    if status_code == 429:
+        return "🔄 Trop de requêtes. Veuillez patienter quelques instants avant de réessayer."
+    elif status_code == 401:
+        return "🔐 Problème d'authentification. Clé API invalide."
+    elif status_code == 403:
+        return "🚫 Accès non autorisé. Vérifiez vos permissions API."
+    elif status_code == 400:
+        return "⚠️ Requête mal formée. Le service peut être temporairement surchargé."
+    return None
+
+TIMEOUT_MESSAGE = "⏰ Délai de réponse dépassé. Le service met plus de temps à répondre en raison de la complexité de l'analyse."
+
+def _call_mistral_api(context_chunks_with_metadata, question, conversation_history):
+    """Appel effectif : retourne (texte, succès) pour ne mettre en cache que les vraies réponses"""
+    with span("prompt"):
+        payload = build_mistral_payload(context_chunks_with_metadata, question, conversation_history)
     
     try:
-        response = requests.post(MISTRAL_API_URL, headers=headers, json=payload, timeout=45)
-        
-        if response.status_code == 429:
-            return "🔄 Trop de requêtes. Veuillez patienter quelques instants avant de réessayer."
-        elif response.status_code == 401:
-            return "🔐 Problème d'authentification. Clé API invalide."
-        elif response.status_code == 403:
-            return "🚫 Accès non autorisé. Vérifiez vos permissions API."
-        elif response.status_code == 400:
-            return "⚠️ Requête mal formée. Le service peut être temporairement surchargé."
-        
-        response.raise_for_status()
-        
-        result = response.json()
-        return result["choices"][0]["message"]["content"]
+        # Les 429/5xx sont retentés par le client avant d'arriver ici
+        with span("LLM"):
+            result = get_llm_client().complete(payload)
+        answer = result["choices"][0]["message"]["content"]
+        inc("rag_llm_requests_total", status="ok")
+        record_token_usage(payload, answer, result.get("usage"))
+        return answer, True
         
+    except LLMAPIError as e:
+        inc("rag_llm_requests_total", status="error")
+        return _status_error_message(e.status_code) or f"❌ Erreur technique: {str(e)}", False
+    except requests.exceptions.Timeout:
+        inc("rag_llm_requests_total", status="error")
+        return TIMEOUT_MESSAGE, False
+    except Exception as e:
+        inc("rag_llm_requests_total", status="error")
+        return f"❌ Erreur technique: {str(e)}", False
+
+def stream_mistral_api(context_chunks_with_metadata, question, conversation_history=[]):
+    """Variante en streaming : générateur des morceaux de texte au fil de leur arrivée"""
+    for kind, text in _stream_mistral_events(context_chunks_with_metadata, question, conversation_history):
+        yield text
+
+def _stream_mistral_events(context_chunks_with_metadata, question, conversation_history):
+    """Lit le flux SSE chat-completions et produit des événements ("token" | "error", texte)
+
+    Fermer le générateur (annulation côté interface) ferme la connexion HTTP. Une coupure en
+    cours de flux produit un événement "error" après les morceaux déjà reçus.
+    """
+    with span("prompt"):
+        payload = build_mistral_payload(context_chunks_with_metadata, question, conversation_history, stream=True)
+    with span("LLM"):
+        yield from _read_stream(payload)
+
+def _read_stream(payload):
+    started = time.perf_counter()
+    try:
+        response = get_llm_client().open_stream(payload, timeout=(MISTRAL_TIMEOUT, MISTRAL_STREAM_READ_TIMEOUT))
+    except LLMAPIError as e:
+        inc("rag_llm_requests_total", status="error")
+        yield "error", _status_error_message(e.status_code) or f"❌ Erreur technique: {str(e)}"
+        return
     except requests.exceptions.Timeout:
-        return "⏰ Délai de réponse dépassé. Le service met plus de temps à répondre en raison de la complexité de l'analyse."
+        inc("rag_llm_requests_total", status="error")
+        yield "error", TIMEOUT_MESSAGE
+        return
+    except Exception as e:
+        inc("rag_llm_requests_total", status="error")
+        yield "error", f"❌ Erreur technique: {str(e)}"
+        return
+
+    received = False
+    finished = False
+    parts = []
+    usage = None
+    try:
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                finished = True
+                break
+            event = json.loads(data)
+            # Mistral renvoie l'usage (tokens) dans le dernier événement du flux
+            usage = event.get("usage") or usage
+            choice = event["choices"][0]
+            content = choice.get("delta", {}).get("content")
+            if content:
+                if not received:
+                    registry.observe("rag_llm_first_token_seconds", time.perf_counter() - started)
+                received = True
+                parts.append(content)
+                yield "token", content
+            if choice.get("finish_reason"):
+                finished = True
+        if not received:
+            yield "error", "❌ Erreur technique: flux de réponse vide"
+        elif not finished:
+            # Flux terminé sans fin de génération ni [DONE] : réponse tronquée
+            yield "error", "\n\n⚠️ Réponse interrompue : la connexion avec le service a été perdue."
+    except (requests.exceptions.Timeout, requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError):
+        if received:
+            yield "error", "\n\n⚠️ Réponse interrompue : la connexion avec le service a été perdue."
+        else:
+            yield "error", TIMEOUT_MESSAGE
     except Exception as e:
-        return f"❌ Erreur technique: {str(e)}"
+        yield "error", f"\n\n❌ Erreur technique: {str(e)}" if received else f"❌ Erreur technique: {str(e)}"
+    finally:
+        response.close()
+        inc("rag_llm_requests_total", status="ok" if received and finished else "error")
+        if received:
+            record_token_usage(payload, "".join(parts), usage)
 
-def smart_text_analysis_with_mistral(context_chunks_with_metadata, question, conversation_history):
-    """Analyse intelligente avec Mistral pour plusieurs documents"""
+def canned_answer(context_chunks_with_metadata, question):
+    """Réponses traitées sans LLM (aucun contexte, salutations, aide), None sinon"""
     if not context_chunks_with_metadata:
         return "🔍 Aucune information pertinente trouvée dans les documents pour répondre à cette question. Essayez de reformuler ou vérifiez que les documents contiennent bien ces informations."
     
@@ -130,7 +311,7 @@ def smart_text_analysis_with_mistral(context_chunks_with_metadata, question, con
 
 **📤 IMPORTATION :**
 - Allez dans l'onglet 'Documents'
-- Uploader jusqu'à 5 fichiers PDF ou DOCX
+- Uploader vos fichiers PDF ou DOCX (plusieurs milliers possibles)
 - Cliquez sur 'Indexer les documents'
 
 **💬 CONVERSATION INTELLIGENTE :**
@@ -151,6 +332,82 @@ def smart_text_analysis_with_mistral(context_chunks_with_metadata, question, con
 - Réponses détaillées et structurées
         """
     
-    else:
-        # Pour toutes les autres questions, on utilise Mistral avec le contexte enrichi
-        return call_mistral_api(context_chunks_with_metadata, question, conversation_history)
\ No newline at end of file
+    return None
+
+def _set_outcome(outcome, source):
+    if outcome is not None:
+        outcome['source'] = source
+
+def smart_text_analysis_with_mistral(context_chunks_with_metadata, question, conversation_history,
+                                     question_embedding=None, outcome=None):
+    """Analyse intelligente avec Mistral pour plusieurs documents
+
+    Si question_embedding est fourni, le cache sémantique des réponses est consulté avant
+    l'appel (payant) à l'API. outcome (dictionnaire) reçoit l'origine de la réponse :
+    'prédéfinie', 'cache', 'LLM' ou 'erreur'.
+    """
+    answer = canned_answer(context_chunks_with_metadata, question)
+    if answer is not None:
+        inc("rag_answers_total", source="prédéfinie")
+        _set_outcome(outcome, "prédéfinie")
+        return answer
+
+    # Pour toutes les autres questions, on utilise Mistral avec le contexte enrichi
+    cache = get_answer_cache() if question_embedding is not None else None
+    if cache is None:
+        inc("rag_answers_total", source="LLM")
+        answer, ok = _call_mistral_api(context_chunks_with_metadata, question, conversation_history)
+        _set_outcome(outcome, "LLM" if ok else "erreur")
+        return answer
+
+    used_chunks = select_context(context_chunks_with_metadata)
+    key = context_key(used_chunks, settings_signature(), sent_history(conversation_history, question))
+    cached_answer = cache.lookup(key, question_embedding)
+    if cached_answer is not None:
+        inc("rag_answers_total", source="cache")
+        _set_outcome(outcome, "cache")
+        return cached_answer
+
+    inc("rag_answers_total", source="LLM")
+    answer, ok = _call_mistral_api(context_chunks_with_metadata, question, conversation_history)
+    _set_outcome(outcome, "LLM" if ok else "erreur")
+    if ok:
+        cache.store(key, question_embedding, question, answer, [chunk['file_hash'] for chunk in used_chunks])
+    return answer
+
+def smart_text_analysis_stream(context_chunks_with_metadata, question, conversation_history,
+                               question_embedding=None, outcome=None):
+    """Comme smart_text_analysis_with_mistral, mais produit la réponse morceau par morceau"""
+    answer = canned_answer(context_chunks_with_metadata, question)
+    if answer is not None:
+        inc("rag_answers_total", source="prédéfinie")
+        _set_outcome(outcome, "prédéfinie")
+        yield answer
+        return
+
+    cache = get_answer_cache() if question_embedding is not None else None
+    used_chunks = select_context(context_chunks_with_metadata)
+    key = (context_key(used_chunks, settings_signature(), sent_history(conversation_history, question))
+           if cache is not None else None)
+    if cache is not None:
+        cached_answer = cache.lookup(key, question_embedding)
+        if cached_answer is not None:
+            inc("rag_answers_total", source="cache")
+            _set_outcome(outcome, "cache")
+            yield cached_answer
+            return
+
+    inc("rag_answers_total", source="LLM")
+    parts = []
+    failed = False
+    for kind, text in _stream_mistral_events(context_chunks_with_metadata, question, conversation_history):
+        if kind == "error":
+            failed = True
+        else:
+            parts.append(text)
+        yield text
+    _set_outcome(outcome, "erreur" if failed or not parts else "LLM")
+
+    # Seules les réponses complètes sont mises en cache
+    if cache is not None and parts and not failed:
+        cache.store(key, question_embedding, question, "".join(parts), [chunk['file_hash'] for chunk in used_chunks])
@@ -0,0 +1,156 @@
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# -----------------------
+# SERVEUR LOCAL IMITANT L'API MISTRAL
+# -----------------------
+
+DEFAULT_ANSWER = (
+    "D'après les documents fournis, le contrat prend effet à la date de signature "
+    "et peut être résilié par lettre recommandée avec un préavis de trois mois."
+)
+
+class MistralStubServer:
+    """Serveur chat-completions local (réponses JSON ou flux SSE) pour les tests et benchmarks
+
+    Paramètres de simulation : délai avant le premier morceau, délai entre morceaux,
+    statut d'erreur forcé (pour les fail_count premières requêtes, ou toujours si None),
+    en-tête Retry-After et coupure du flux après N morceaux.
+    """
+    def __init__(self, host="127.0.0.1", port=0, answer=DEFAULT_ANSWER, first_token_delay=0.2,
+                 token_delay=0.02, fail_status=None, fail_count=None, retry_after=None, drop_after=None):
+        self.answer = answer
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+        self.fail_status = fail_status
+        self.fail_count = fail_count
+        self.retry_after = retry_after
+        self.drop_after = drop_after
+        self.active_requests = 0
+        self.max_active_requests = 0
+        self.requests = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+    def tokens(self):
+        # Découpage grossier en "tokens" : mots avec leur espace
+        words = self.answer.split(" ")
+        return [word + (" " if i < len(words) - 1 else "") for i, word in enumerate(words)]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                with stub._lock:
+                    stub.requests.append(payload)
+                    failing = stub.fail_status and (stub.fail_count is None or len(stub.requests) <= stub.fail_count)
+                    stub.active_requests += 1
+                    stub.max_active_requests = max(stub.max_active_requests, stub.active_requests)
+                try:
+                    self._respond(payload, failing)
+                finally:
+                    with stub._lock:
+                        stub.active_requests -= 1
+
+            def _respond(self, payload, failing):
+                if failing:
+                    headers = {"Retry-After": str(stub.retry_after)} if stub.retry_after is not None else {}
+                    self._send_json(stub.fail_status, {"message": "erreur simulée"}, headers)
+                    return
+
+                time.sleep(stub.first_token_delay)
+                if payload.get("stream"):
+                    self._stream(payload)
+                else:
+                    self._send_json(200, {
+                        "id": "stub",
+                        "object": "chat.completion",
+                        "model": payload.get("model"),
+                        "choices": [{"index": 0, "finish_reason": "stop",
+                                     "message": {"role": "assistant", "content": stub.answer}}],
+                        "usage": {"prompt_tokens": 0, "completion_tokens": len(stub.tokens())}
+                    })
+
+            def _send_json(self, status, body, headers=None):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _stream(self, payload):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.end_headers()
+                tokens = stub.tokens()
+                for i, token in enumerate(tokens):
+                    if stub.drop_after is not None and i >= stub.drop_after:
+                        # Coupure brutale du flux, sans fin de génération
+                        return
+                    last = i == len(tokens) - 1
+                    chunk = {
+                        "id": "stub",
+                        "object": "chat.completion.chunk",
+                        "model": payload.get("model"),
+                        "choices": [{"index": 0, "delta": {"content": token},
+                                     "finish_reason": "stop" if last else None}]
+                    }
+                    try:
+                        self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                        self.wfile.flush()
+                    except (BrokenPipeError, ConnectionResetError):
+                        # Le client a annulé la génération
+                        return
+                    time.sleep(stub.token_delay)
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+
+        return Handler
+
+if __name__ == "__main__":
+    # Exemple : python mistral_stub.py --port 8765
+    # puis MISTRAL_API_URL=http://127.0.0.1:8765/v1/chat/completions streamlit run app.py
+    parser = argparse.ArgumentParser(description="Serveur local imitant l'API chat-completions de Mistral")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--first-token-delay", type=float, default=0.2)
+    parser.add_argument("--token-delay", type=float, default=0.02)
+    args = parser.parse_args()
+
+    server = MistralStubServer(port=args.port, first_token_delay=args.first_token_delay, token_delay=args.token_delay)
+    print(f"Serveur Mistral local : {server.url}")
+    server._server.serve_forever()
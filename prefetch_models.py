@@ -0,0 +1,40 @@
+import argparse
+import json
+import time
+
+from embeddings import EMBEDDING_BACKEND, EMBEDDING_MODEL_NAME, warmup_embedding_model
+from reranker import RERANK_ENABLED, RERANK_MODEL_NAME, warmup_reranker
+
+# -----------------------
+# PRÉCHARGEMENT DES MODÈLES
+# -----------------------
+
+def prefetch(rerank=RERANK_ENABLED):
+    """Télécharge (cache Hugging Face), exporte (ONNX) et préchauffe les modèles ; retourne les durées
+
+    À lancer à la construction de l'image ou au démarrage du conteneur : le premier
+    démarrage de l'application ne dépend plus du réseau ni de l'export ONNX.
+    """
+    timings = {}
+    started = time.perf_counter()
+    warmup_embedding_model()
+    timings['embeddings'] = time.perf_counter() - started
+    if rerank:
+        started = time.perf_counter()
+        warmup_reranker()
+        timings['rerank'] = time.perf_counter() - started
+    return timings
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Téléchargement et préchauffage des modèles d'embeddings et de rerank")
+    parser.add_argument("--rerank", action=argparse.BooleanOptionalAction, default=RERANK_ENABLED,
+                        help="inclure le cross-encoder de rerank (RAG_RERANK par défaut)")
+    args = parser.parse_args()
+
+    timings = prefetch(args.rerank)
+    print(json.dumps({
+        'embedding_model': EMBEDDING_MODEL_NAME,
+        'embedding_backend': EMBEDDING_BACKEND,
+        'rerank_model': RERANK_MODEL_NAME if args.rerank else None,
+        'seconds': timings
+    }, indent=2))
@@ -0,0 +1,85 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import register_collector
+
+# -----------------------
+# CONFIGURATION CACHE DES REQUÊTES
+# -----------------------
+
+QUERY_CACHE_SIZE = int(os.environ.get("RAG_QUERY_CACHE_SIZE", 1024))
+# Durée de vie des entrées en secondes (0 = sans expiration)
+QUERY_CACHE_TTL = float(os.environ.get("RAG_QUERY_CACHE_TTL", 3600))
+
+def normalize_query(query):
+    """Normalise une question pour que les variantes triviales partagent la même entrée"""
+    return re.sub(r"\s+", " ", query.strip().lower()).rstrip(" ?!.")
+
+class LRUCache:
+    """Cache LRU borné en taille, avec expiration optionnelle et statistiques de succès"""
+    def __init__(self, maxsize=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, stored_at = entry
+                if not self.ttl or time.monotonic() - stored_at < self.ttl:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0
+        }
+
+# Caches partagés par toutes les sessions du processus :
+# - (modèle, question normalisée) -> embedding de la question
+# - (index, version, question normalisée, k, mode) -> résultats de recherche
+query_embedding_cache = LRUCache()
+search_results_cache = LRUCache()
+
+def query_cache_stats():
+    """Statistiques des deux caches de requêtes (taille, succès, taux de succès)"""
+    return {
+        'embeddings': query_embedding_cache.stats(),
+        'results': search_results_cache.stats()
+    }
+
+def _query_cache_metrics():
+    return [(f"rag_query_cache_{field}", {'cache': name}, stats[field])
+            for name, stats in query_cache_stats().items()
+            for field in ("size", "hits", "misses", "hit_rate")]
+
+register_collector(_query_cache_metrics)
@@ -0,0 +1,98 @@
+import os
+from collections import Counter
+
+from lexical_index import reciprocal_rank_fusion, tokenize
+from query_cache import normalize_query
+
+# -----------------------
+# CONFIGURATION REQUÊTES MULTIPLES
+# -----------------------
+
+# Recherche avec plusieurs formulations tirées de la conversation (question seule, question
+# précédente + question, termes clés), fusionnées par RRF
+MULTI_QUERY = os.environ.get("RAG_MULTI_QUERY", "1") == "1"
+# Questions précédentes dont les termes clés sont repris
+MULTI_QUERY_TURNS = 2
+# Termes les plus fréquents repris de la dernière réponse (ce à quoi renvoie "le deuxième")
+ANSWER_TERMS = 5
+MAX_KEY_TERMS = 16
+# Poids de la question brute dans la fusion (les formulations dérivées comptent pour 1)
+RAW_QUERY_WEIGHT = 2.0
+
+# Mots de question et de relance sans intérêt pour la recherche
+_QUESTION_WORDS = {
+    "quel", "quelle", "quels", "quelles", "comment", "pourquoi", "quand", "combien", "est-ce",
+    "lequel", "laquelle", "lesquels", "lesquelles", "quoi", "cela", "ceci", "celui", "celle",
+    "premier", "premiere", "deuxieme", "second", "seconde", "troisieme", "dernier", "derniere",
+    "aussi", "alors", "encore", "autre", "autres", "sont", "etre", "peut", "fait", "what", "which",
+    "how", "why", "when", "are",
+}
+
+def _key_terms(text):
+    return [term for term in tokenize(text)
+            if term not in _QUESTION_WORDS and (len(term) > 2 or (len(term) > 1 and term.isdigit()))]
+
+def key_terms(question, previous_questions=(), previous_answer=None, limit=MAX_KEY_TERMS):
+    """Termes clés de la question et des derniers échanges, dédupliqués, dans l'ordre d'apparition"""
+    terms = _key_terms(question)
+    for text in reversed(previous_questions):
+        terms += _key_terms(text)
+    if previous_answer:
+        terms += [term for term, _ in Counter(_key_terms(previous_answer)).most_common(ANSWER_TERMS)]
+    return list(dict.fromkeys(terms))[:limit]
+
+def previous_answer(history):
+    """Réponse à la dernière question, si elle suit directement celle-ci et vient des documents
+
+    Les messages marqués "grounded": False (accueil, réponses prédéfinies, erreurs) sont ignorés.
+    """
+    questions = [i for i, msg in enumerate(history) if msg.get("type") == "question"]
+    if not questions or questions[-1] + 1 >= len(history):
+        return None
+    answer = history[questions[-1] + 1]
+    if answer.get("type") == "question" or not answer.get("grounded", True):
+        return None
+    return answer["text"]
+
+def build_query_variants(question, history=None, turns=MULTI_QUERY_TURNS):
+    """Formulations à chercher pour une question, à partir de l'historique (messages de session)
+
+    history suit le format de st.session_state.messages ({"type": "question"|"answer", "text"})
+    et ne contient pas la question courante. La question brute reste toujours la première ;
+    sans question précédente, elle est la seule.
+    """
+    history = history or []
+    previous_questions = [msg["text"] for msg in history if msg.get("type") == "question"][-turns:]
+    if not previous_questions:
+        return [question]
+
+    variants = [question]
+    variants.append(f"{previous_questions[-1]} {question}")
+    terms = key_terms(question, previous_questions, previous_answer(history))
+    if terms:
+        variants.append(" ".join(terms))
+
+    # Deux variantes identiques une fois normalisées ne coûtent qu'une recherche
+    unique = {}
+    for variant in variants:
+        unique.setdefault(normalize_query(variant), variant)
+    return list(unique.values())
+
+def fuse_results(results, k, rrf_k=60):
+    """Fusionne par RRF les résultats (scores, indices, chunks) de plusieurs formulations
+
+    Le premier résultat (question brute) pèse RAW_QUERY_WEIGHT ; chaque chunk garde la
+    meilleure similarité cosinus obtenue parmi les formulations.
+    """
+    best = {}
+    rankings = []
+    for _, _, chunks in results:
+        rankings.append([chunk['vector_id'] for chunk in chunks])
+        for chunk in chunks:
+            known = best.get(chunk['vector_id'])
+            if known is None or chunk.get('similarity', 0.0) > known.get('similarity', 0.0):
+                best[chunk['vector_id']] = chunk
+    weights = [RAW_QUERY_WEIGHT] + [1.0] * (len(rankings) - 1)
+    fused = reciprocal_rank_fusion(rankings, k=rrf_k, weights=weights)[:k]
+    return ([score for _, score in fused], list(range(len(fused))),
+            [dict(best[vector_id]) for vector_id, _ in fused])
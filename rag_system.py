@@ -1,124 +1,892 @@
 import hashlib
+import json
+import os
+import threading
+import time
+import uuid
 from datetime import datetime
-import streamlit as st
 
-# Import LangChain pour FAISS
-from langchain.vectorstores import FAISS
-from langchain.embeddings import HuggingFaceEmbeddings
-from langchain.schema import Document
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+import numpy as np
 
-from utils import extract_text, split_text
+from chunk_store import ChunkStore
+from context_builder import CONTEXT_CANDIDATES, pack_context
+from document_index import DocumentIndex
+from embeddings import (
+    EMBEDDING_MODEL_NAME, CachedEmbeddings, cached_document_vectors, embed_queries, embedding_model_id,
+    get_cached_embedding_model
+)
+from ingestion import IngestionPipeline
+from lexical_index import BM25Index, reciprocal_rank_fusion
+from metrics import inc, registry, span
+from query_cache import normalize_query, query_embedding_cache, search_results_cache
+from query_variants import MULTI_QUERY, build_query_variants, fuse_results
+from reranker import RERANK_CANDIDATES, RERANK_ENABLED, rerank
+from retrieval_client import RetrievalServiceError
+from utils import ReadWriteLock
+from vector_index import (
+    INDEX_TYPE, apply_search_params, build_index, choose_index_type, exact_search, is_lossy,
+    normalize_vectors, recall_at_k, resolve_params, supports_removal
+)
+
+# -----------------------
+# CONFIGURATION INDEX
+# -----------------------
+
+INDEX_DIR = os.environ.get("RAG_INDEX_DIR", os.path.join("data", "index"))
+INDEX_FORMAT_VERSION = 7
+CHUNK_SIZE = 800
+CHUNK_OVERLAP = 100
+# Recherche hybride FAISS + BM25 fusionnée par RRF
+HYBRID_SEARCH = os.environ.get("RAG_HYBRID_SEARCH", "1") == "1"
+HYBRID_CANDIDATES = 30
+RRF_K = 60
+# Similarité cosinus minimale entre la question et un chunk : en dessous, le chunk n'est pas
+# renvoyé (ni transmis au LLM). 0 désactive le seuil.
+MIN_SIMILARITY = float(os.environ.get("RAG_MIN_SIMILARITY", 0.15))
+# Routage : au-delà de ce nombre de documents, une question n'est cherchée que dans les
+# documents dont le centroïde est le plus proche (0 désactive le routage)
+ROUTING_DOCUMENTS = int(os.environ.get("RAG_ROUTING_DOCUMENTS", 20))
+# Nombre maximal de fichiers importés en une fois depuis l'interface
+MAX_FILES = int(os.environ.get("RAG_MAX_FILES", 5000))
 
 class FAISSIndex:
-    """Index FAISS avec embeddings HuggingFace pour la recherche vectorielle"""
-    def __init__(self):
-        self.vector_store = None
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/all-MiniLM-L6-v2"
-        )
-        self.chunks_with_metadata = []
+    """Index FAISS avec embeddings HuggingFace pour la recherche vectorielle
+
+    Le type d'index (exact, HNSW, IVF, IVF-PQ) est choisi selon la taille du corpus, sauf si
+    index_type est imposé ; index_params surcharge nlist, nprobe, M, ef_search, storage
+    (float32, float16, int8), etc. Les vecteurs sont normalisés : les scores de similarité
+    sont des cosinus.
+    """
+    def __init__(self, model_name=None, device=None, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP,
+                 backend=None, index_type=None, index_params=None, hybrid=None):
+        self.faiss_index = None
+        # (uid, version) identifie un état de l'index : toute modification incrémente la version
+        # et invalide de fait les résultats mis en cache
+        self.uid = uuid.uuid4().hex[:12]
+        self.version = 0
+        # Index lexical BM25 tenu à jour en parallèle de FAISS
+        self.lexical_index = BM25Index()
+        # Centroïdes des documents, pour le routage des questions
+        self.document_index = DocumentIndex()
+        self.hybrid = HYBRID_SEARCH if hybrid is None else hybrid
+        self.model_name = model_name or EMBEDDING_MODEL_NAME
+        # Identifiant des vecteurs : modèle + backend d'inférence (quantifié ou non)
+        self.model_id = embedding_model_id(self.model_name, backend)
+        self.device = device
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.backend = backend
+        # Modèle partagé entre toutes les sessions du processus, derrière le cache d'embeddings ;
+        # chargé au premier usage seulement (ouvrir un index ne charge pas torch)
+        self._embeddings = None
+        self.requested_index_type = index_type or INDEX_TYPE
+        self.index_type = None
+        self.index_params = dict(index_params or {})
+        # Textes et métadonnées des chunks, adressés par vector_id (identifiant int64 dans FAISS)
+        self.chunk_store = ChunkStore()
+        self._next_vector_id = 0
+        # Vecteurs retirés mais encore présents dans un index HNSW
+        self._deleted_ids = set()
+        # Chargement différé depuis le disque (voir FAISSIndex.load)
+        self._pending_dir = None
+        self._pending_ntotal = 0
+        self._index_path = None
+        self._read_only = False
+        self._load_lock = threading.Lock()
+        # Les recherches des différentes sessions se font en parallèle (lecture partagée) ;
+        # les modifications sont exclusives. FAISS ne permet pas d'ajouter dans un index
+        # pendant qu'on y cherche, et le copier à chaque ajout rendrait l'ingestion quadratique.
+        self._lock = ReadWriteLock()
     
-    def add(self, chunks_with_metadata):
-        """Ajoute les chunks à l'index FAISS avec LangChain"""
-        self.chunks_with_metadata = chunks_with_metadata
-        
-        # Conversion en documents LangChain
-        documents = []
-        for chunk in chunks_with_metadata:
-            doc = Document(
-                page_content=chunk['text'],
-                metadata={
-                    'source': chunk['source'],
-                    'file_hash': chunk['file_hash'],
-                    'chunk_size': chunk['chunk_size']
-                }
-            )
-            documents.append(doc)
-        
-       
-        self.vector_store = FAISS.from_documents(documents, self.embeddings)
+    @property
+    def embeddings(self):
+        if self._embeddings is None:
+            self._embeddings = get_cached_embedding_model(self.model_name, self.device, self.backend)
+        return self._embeddings
+
+    @embeddings.setter
+    def embeddings(self, model):
+        self._embeddings = model
+
+    def add(self, chunks_with_metadata, replace=True, vectors=None):
+        """Ajoute des chunks à l'index existant sans réindexer le corpus
+
+        Avec replace=True, les versions précédentes des documents sont d'abord retirées : même
+        contenu (file_hash) ou même nom de fichier avec un autre contenu. vectors permet de
+        fournir des embeddings déjà calculés (pipeline d'ingestion).
+        """
+        with self._lock.write():
+            self._ensure_loaded()
+            chunks_with_metadata = assign_chunk_ids(chunks_with_metadata)
+            if not chunks_with_metadata:
+                return []
+
+            if replace:
+                new_hashes = {chunk['file_hash'] for chunk in chunks_with_metadata}
+                sources = {chunk['source'] for chunk in chunks_with_metadata}
+                known = (new_hashes & set(self.get_document_hashes())) | self.chunk_store.file_hashes_for(sources)
+                if known:
+                    self._remove_file_hashes(known)
+
+            if vectors is None:
+                with span("embedding_chunks"):
+                    vectors = self.embeddings.embed_documents([chunk['text'] for chunk in chunks_with_metadata])
+            vectors = normalize_vectors(vectors)
+
+            vector_ids = np.arange(self._next_vector_id, self._next_vector_id + len(chunks_with_metadata), dtype=np.int64)
+            self._next_vector_id += len(chunks_with_metadata)
+
+            with span("indexation"):
+                target_type = self._target_index_type(self.ntotal + len(chunks_with_metadata))
+                self.chunk_store.add(chunks_with_metadata, vector_ids)
+                if self.faiss_index is None or target_type != self.index_type:
+                    # Premier ajout ou changement de palier : reconstruction avec le nouveau type
+                    self._rebuild(target_type, new_vectors=(vector_ids, vectors))
+                else:
+                    self._make_writable()
+                    self.faiss_index.add_with_ids(vectors, vector_ids)
+
+                self.lexical_index.add(vector_ids, [chunk['text'] for chunk in chunks_with_metadata])
+                self.document_index.add([chunk['file_hash'] for chunk in chunks_with_metadata], vectors)
+            self.version += 1
+            inc("rag_chunks_indexed_total", len(chunks_with_metadata))
+            return [chunk['chunk_id'] for chunk in chunks_with_metadata]
+
+    def remove_document(self, file_hash):
+        """Retire tous les chunks d'un document de l'index"""
+        with self._lock.write():
+            self._ensure_loaded()
+            return self._remove_file_hashes({file_hash})
+
+    def remove_previous_versions(self, file_hash, source):
+        """Retire les documents du même nom de fichier que source dont le contenu diffère de file_hash"""
+        with self._lock.write():
+            self._ensure_loaded()
+            return self._remove_file_hashes(self.chunk_store.file_hashes_for({source}) - {file_hash})
+
+    def rename_document(self, file_hash, source):
+        """Renomme un document déjà indexé (même contenu importé sous un autre nom de fichier)
+
+        Les documents qui portaient déjà ce nom avec un autre contenu sont retirés dans la même
+        opération. Retourne le nombre de chunks du document (0 s'il n'est pas indexé).
+        """
+        with self._lock.write():
+            self._ensure_loaded()
+            if file_hash not in self.chunk_store.document_hashes():
+                return 0
+            self._remove_file_hashes(self.chunk_store.file_hashes_for({source}) - {file_hash})
+            self.version += 1
+            return self.chunk_store.rename(file_hash, source)
+
+    def _remove_file_hashes(self, file_hashes):
+        vector_ids = self.chunk_store.remove_file_hashes(file_hashes)
+        if len(vector_ids) == 0:
+            return 0
+        self.version += 1
+        self.lexical_index.remove(vector_ids)
+        self.document_index.remove(file_hashes)
+
+        if len(self.chunk_store) == 0:
+            self.faiss_index = None
+            self.index_type = None
+            self.lexical_index = BM25Index()
+            self.document_index = DocumentIndex()
+            self._deleted_ids = set()
+        elif supports_removal(self.index_type):
+            self._make_writable()
+            self.faiss_index.remove_ids(vector_ids)
+        else:
+            self._deleted_ids.update(int(vector_id) for vector_id in vector_ids)
+            # Trop de pierres tombales : on reconstruit un graphe propre
+            if len(self._deleted_ids) > 0.2 * len(self.chunk_store):
+                self._rebuild(self.index_type)
+        return len(vector_ids)
+
+    def _target_index_type(self, ntotal):
+        index_type = self.requested_index_type
+        if index_type == "auto":
+            index_type = choose_index_type(ntotal)
+            # Sans cache d'embeddings, les vecteurs d'un index IVF ne seraient plus relisibles
+            if index_type in ("ivf", "ivfpq") and not self._vectors_cached():
+                index_type = "hnsw"
+        # IVF-PQ a besoin d'au moins 2^nbits vecteurs pour entraîner ses codebooks
+        params = resolve_params(ntotal, self.index_params)
+        if index_type == "ivfpq" and ntotal < 2 ** params['pq_nbits']:
+            return "flat"
+        return index_type
+
+    def _rebuild(self, index_type, new_vectors=None):
+        """Reconstruit l'index FAISS (et l'entraîne) à partir de tous les chunks courants"""
+        known_ids = self.chunk_store.vector_ids()
+        if new_vectors is not None:
+            known_ids = known_ids[~np.isin(known_ids, new_vectors[0])]
+        params = resolve_params(len(known_ids) + (0 if new_vectors is None else len(new_vectors[0])),
+                                self.index_params)
+        if (index_type in ("ivf", "ivfpq") or is_lossy(index_type, params)) and not self._vectors_cached():
+            raise ValueError(f"L'index {index_type} (stockage {params['storage']}) ne conserve pas les vecteurs "
+                             "exacts : il nécessite le cache d'embeddings (RAG_EMBEDDING_CACHE)")
+
+        # Les vecteurs existants sont relus dans FAISS ou dans le cache d'embeddings (sans recalcul)
+        parts_ids = []
+        parts_vectors = []
+        if len(known_ids):
+            parts_ids.append(known_ids)
+            parts_vectors.append(self._stored_vectors(known_ids))
+        if new_vectors is not None:
+            parts_ids.append(new_vectors[0])
+            parts_vectors.append(new_vectors[1])
+        ids = np.concatenate(parts_ids)
+        vectors = normalize_vectors(np.vstack(parts_vectors))
+
+        index = build_index(index_type, vectors.shape[1], vectors, params)
+        index.add_with_ids(vectors, ids)
+        # Le stockage est fixé à la construction (un index relu garde le sien)
+        self.index_params['storage'] = params['storage']
+
+        self.faiss_index = index
+        self.index_type = index_type
+        self._deleted_ids = set()
+        self._read_only = False
+
+    def rebuild(self, index_type=None, **index_params):
+        """Force la reconstruction avec un autre type d'index ou d'autres paramètres"""
+        with self._lock.write():
+            self._ensure_loaded()
+            if index_type:
+                self.requested_index_type = index_type
+            self.index_params.update(index_params)
+            self.version += 1
+            if len(self.chunk_store):
+                self._rebuild(self._target_index_type(len(self.chunk_store)))
+
+    def _make_writable(self):
+        """Relit en mémoire un index ouvert en lecture seule (mmap) avant modification"""
+        if self._read_only:
+            import faiss
+            self.faiss_index = faiss.read_index(self._index_path)
+            self._read_only = False
     
-    def search(self, query, k=8):
-        """Recherche vectorielle avec FAISS et scores de similarité"""
-        if self.vector_store is None:
-            return [], [], []
-      
-        docs_and_scores = self.vector_store.similarity_search_with_score(query, k=k)
-        
-        scores = []
-        indices = []
-        top_chunks = []
-        
-        for i, (doc, score) in enumerate(docs_and_scores):
-            scores.append(1 - score)  # Convertir distance en similarité (1 - distance)
-            indices.append(i)
-            top_chunks.append({
-                'text': doc.page_content,
-                'source': doc.metadata['source'],
-                'file_hash': doc.metadata['file_hash'],
-                'chunk_size': doc.metadata.get('chunk_size', 0)
-            })
-        
-        return scores, indices, top_chunks
+    def search(self, query, k=8, hybrid=None, min_similarity=None, sources=None, file_hashes=None):
+        """Recherche vectorielle avec FAISS et scores de similarité cosinus
+
+        En mode hybride, les classements FAISS et BM25 sont fusionnés par reciprocal-rank
+        fusion et les scores renvoyés sont les scores RRF. Dans les deux modes, les chunks dont
+        la similarité cosinus (conservée dans chunk['similarity']) est inférieure à
+        min_similarity (RAG_MIN_SIMILARITY par défaut) sont écartés.
+
+        sources (noms de fichiers) et file_hashes limitent la recherche aux documents désignés.
+        Au-delà de RAG_ROUTING_DOCUMENTS documents, la recherche vectorielle ne parcourt que les
+        chunks des documents dont le centroïde est le plus proche de la question.
+        """
+        return self.search_many([query], k, hybrid, min_similarity, sources, file_hashes)[0]
+
+    def search_many(self, queries, k=8, hybrid=None, min_similarity=None, sources=None, file_hashes=None):
+        """Recherche groupée : liste de (scores, indices, chunks), une entrée par question
+
+        Les questions absentes du cache sont vectorisées en un seul passage du modèle et
+        cherchées en un seul appel FAISS (un appel par question quand le routage s'applique).
+        """
+        self._ensure_loaded()
+        hybrid = self.hybrid if hybrid is None else hybrid
+        min_similarity = MIN_SIMILARITY if min_similarity is None else min_similarity
+        sources = _as_filter(sources)
+        file_hashes = _as_filter(file_hashes)
+        results = [None] * len(queries)
+        missing = []
+        for i, query in enumerate(queries):
+            cached = search_results_cache.get((self.uid, self.version, normalize_query(query), k, hybrid,
+                                               min_similarity, sources, file_hashes))
+            if cached is not None:
+                scores, indices, top_chunks = cached
+                results[i] = (list(scores), list(indices), [dict(chunk) for chunk in top_chunks])
+            else:
+                missing.append(i)
+        if not missing:
+            return results
+
+        # Embeddings hors verrou : une question ne bloque ni les autres recherches ni l'ingestion
+        query_vectors = self._embed_queries([queries[i] for i in missing])
+
+        # Lecture partagée : FAISS, BM25 et matérialisation des chunks retenus, sur l'état
+        # (version) courant de l'index
+        with self._lock.read():
+            if self.faiss_index is None:
+                for i in missing:
+                    results[i] = ([], [], [])
+                return results
+            version = self.version
+            fetch = max(k, HYBRID_CANDIDATES) if hybrid else k
+            allowed_ids, candidate_ids = self._route(query_vectors, sources, file_hashes)
+            with span("faiss"):
+                dense_hits = self._dense_search(query_vectors, fetch, candidate_ids)
+            all_hits = []
+            for i, query_vector, hits in zip(missing, query_vectors, dense_hits):
+                similarities = dict(hits)
+                lexical_only, known, texts = [], [], []
+                if hybrid:
+                    # BM25 couvre tout le corpus (filtre explicite excepté) : il rattrape les
+                    # documents écartés à tort par le routage
+                    with span("bm25"):
+                        lexical_ids, _ = self.lexical_index.search(queries[i], fetch, allowed_ids)
+                    dense_ids = [vector_id for vector_id, _ in hits]
+                    hits = reciprocal_rank_fusion([dense_ids, [int(i) for i in lexical_ids]], k=RRF_K)[:k]
+                    # Chunks trouvés par BM25 seul : similarité calculée sur leurs vecteurs
+                    lexical_only = [vector_id for vector_id, _ in hits if vector_id not in similarities]
+                    if lexical_only:
+                        known, texts = self._known_vectors(lexical_only)
+                # Seuls les k chunks retenus sont matérialisés en dictionnaires
+                all_hits.append(([(self.chunk_store.get(vector_id), score) for vector_id, score in hits],
+                                 similarities, lexical_only, known, texts))
+
+        for i, query_vector, (hits, similarities, lexical_only, known, texts) in zip(missing, query_vectors, all_hits):
+            if lexical_only:
+                vectors = self._complete_vectors(known, texts)
+                similarities.update(zip(lexical_only, (vectors @ query_vector).tolist()))
+            scores = []
+            indices = []
+            top_chunks = []
+
+            hits = [(chunk, score) for chunk, score in hits
+                    if chunk is None or similarities[chunk['vector_id']] >= min_similarity]
+            for position, (chunk, score) in enumerate(hits):
+                if chunk is None:
+                    continue
+                similarity = similarities[chunk['vector_id']]
+                chunk['similarity'] = float(similarity)
+                scores.append(score)
+                indices.append(position)
+                top_chunks.append(chunk)
+
+            results_key = (self.uid, version, normalize_query(queries[i]), k, hybrid, min_similarity,
+                           sources, file_hashes)
+            search_results_cache.put(results_key, (scores, indices, [dict(chunk) for chunk in top_chunks]))
+            results[i] = (scores, indices, top_chunks)
+        return results
+
+    def _retrieve_settings(self, k, use_rerank):
+        use_rerank = RERANK_ENABLED if use_rerank is None else use_rerank
+        if k is None:
+            k = max(CONTEXT_CANDIDATES, RERANK_CANDIDATES) if use_rerank else CONTEXT_CANDIDATES
+        return k, use_rerank
+
+    def retrieve(self, query, k=None, use_rerank=None, max_chunks=None, sources=None, file_hashes=None,
+                 history=None):
+        """Chaîne complète recherche -> rerank (optionnel) -> contexte compacté
+
+        Avec history (messages précédents de la conversation), la recherche porte aussi sur des
+        formulations tirées des derniers échanges (voir search_conversation).
+        Retourne (chunks du contexte, embedding de la question, latences par étape en secondes).
+        """
+        k, use_rerank = self._retrieve_settings(k, use_rerank)
+        started = time.perf_counter()
+        scores, _, candidates = self.search_conversation([query], [history], k, sources, file_hashes)[0]
+        timings = {"recherche": time.perf_counter() - started}
+        return self._build_context(query, scores, candidates, use_rerank, max_chunks, timings)
+
+    def retrieve_many(self, queries, k=None, use_rerank=None, max_chunks=None, sources=None, file_hashes=None,
+                      histories=None):
+        """retrieve() pour un lot de questions, avec embeddings et recherche FAISS groupés
+
+        histories donne, si besoin, l'historique de conversation de chaque question. La durée
+        de la recherche groupée est répartie à parts égales entre les questions.
+        """
+        k, use_rerank = self._retrieve_settings(k, use_rerank)
+        started = time.perf_counter()
+        searched = self.search_conversation(queries, histories or [None] * len(queries), k, sources, file_hashes)
+        search_time = (time.perf_counter() - started) / max(len(queries), 1)
+        return [self._build_context(query, scores, candidates, use_rerank, max_chunks, {"recherche": search_time})
+                for query, (scores, _, candidates) in zip(queries, searched)]
+
+    def search_conversation(self, queries, histories, k=8, sources=None, file_hashes=None):
+        """Recherche de questions posées dans une conversation : (scores, indices, chunks) par question
+
+        Chaque question est cherchée sous plusieurs formulations (question brute, question
+        précédente + question, termes clés des derniers échanges) dont les classements sont
+        fusionnés par RRF. Toutes les formulations de toutes les questions sont vectorisées en
+        un seul passage du modèle et cherchées en un seul appel FAISS. Sans historique (ou avec
+        RAG_MULTI_QUERY=0), revient à search_many.
+        """
+        variants = [build_query_variants(query, history) if MULTI_QUERY and history else [query]
+                    for query, history in zip(queries, histories)]
+        searched = self.search_many([variant for group in variants for variant in group], k=k,
+                                    sources=sources, file_hashes=file_hashes)
+        results = []
+        start = 0
+        for group in variants:
+            group_results = searched[start:start + len(group)]
+            start += len(group)
+            results.append(group_results[0] if len(group) == 1 else fuse_results(group_results, k, RRF_K))
+        return results
+
+    def _build_context(self, query, scores, candidates, use_rerank, max_chunks, timings):
+        # Score de recherche conservé dans chaque chunk (sorties du mode batch, diagnostics)
+        for chunk, score in zip(candidates, scores):
+            chunk['score'] = float(score)
+
+        if use_rerank:
+            started = time.perf_counter()
+            # Budget dépassé : l'ordre vectoriel est conservé
+            candidates, _ = rerank(query, candidates)
+            timings["rerank"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        # Sélection MMR et fusion des chunks voisins dans le budget de tokens
+        context = pack_context(self, query, candidates, max_chunks=max_chunks)
+        timings["contexte"] = time.perf_counter() - started
+        for stage, seconds in timings.items():
+            registry.observe("rag_stage_seconds", seconds, stage=stage)
+        inc("rag_context_chunks_total", len(context))
+        return context, self.embed_query(query), timings
+
+    def embed_query(self, query):
+        """Vecteur de la question (partagé avec le cache des requêtes)"""
+        return self._embed_queries([query])[0]
+
+    def _embed_queries(self, queries):
+        """Embeddings normalisés des questions (matrice n x d), mis en cache par modèle et question
+
+        Les questions absentes du cache sont vectorisées ensemble, en un seul lot.
+        """
+        keys = [(self.model_id, normalize_query(query)) for query in queries]
+        vectors = [query_embedding_cache.get(key) for key in keys]
+        missing = {}
+        for key, query, vector in zip(keys, queries, vectors):
+            if vector is None:
+                missing.setdefault(key, query)
+        if missing:
+            with span("embedding_question"):
+                computed = normalize_vectors(embed_queries(self.embeddings, list(missing.values())))
+            computed = {key: vector[None, :] for key, vector in zip(missing, computed)}
+            for key, vector in computed.items():
+                query_embedding_cache.put(key, vector)
+            vectors = [computed[key] if vector is None else vector for key, vector in zip(keys, vectors)]
+        return np.vstack(vectors)
+
+    def get_vectors(self, vector_ids):
+        """Vecteurs normalisés stockés pour des vector_id (matrice n x d)"""
+        self._ensure_loaded()
+        with self._lock.read():
+            known, texts = self._known_vectors(vector_ids)
+        return self._complete_vectors(known, texts)
+
+    def _vectors_cached(self):
+        """Vrai si les vecteurs des chunks sont relisibles dans le cache d'embeddings persistant"""
+        return isinstance(self.embeddings, CachedEmbeddings)
+
+    def _stored_vectors(self, vector_ids):
+        """Vecteurs exacts et normalisés de chunks indexés, sans recalcul par le modèle
+
+        Relus directement dans FAISS pour les index Flat/HNSW en float32 ; les index IVF ne
+        gardent pas de table d'adressage et les index quantifiés sont avec pertes : on repasse
+        par le cache d'embeddings. Seuls les textes absents du cache passent par le modèle.
+        """
+        return self._complete_vectors(*self._known_vectors(vector_ids))
+
+    def _known_vectors(self, vector_ids):
+        """Vecteurs relisibles sans le modèle (None si absent du cache) et textes des chunks
+
+        Lit l'état de l'index : à appeler sous le verrou.
+        """
+        vector_ids = np.asarray(vector_ids, dtype=np.int64)
+        params = resolve_params(self.ntotal, self.index_params)
+        if (self.faiss_index is not None and self.index_type in ("flat", "hnsw")
+                and not is_lossy(self.index_type, params)):
+            return list(self.faiss_index.reconstruct_batch(vector_ids)), None
+        texts = self.chunk_store.texts(vector_ids)
+        return cached_document_vectors(self.embeddings, texts), texts
+
+    def _complete_vectors(self, vectors, texts):
+        """Matrice normalisée des vecteurs, les absents du cache étant calculés par le modèle"""
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            computed = self.embeddings.embed_documents([texts[i] for i in missing])
+            for i, vector in zip(missing, computed):
+                vectors[i] = np.asarray(vector, dtype=np.float32)
+        return normalize_vectors(np.vstack(vectors))
+
+    def _route(self, query_vectors, sources, file_hashes):
+        """Chunks admis pour chaque question : (vector_id du filtre, vector_id par question)
+
+        Chaque élément vaut None quand il ne restreint rien (pas de filtre, pas de routage).
+        """
+        allowed = None
+        if sources is not None or file_hashes is not None:
+            allowed = set(file_hashes or ()) | self.chunk_store.file_hashes_for(sources or ())
+        allowed_ids = None if allowed is None else self.chunk_store.vector_ids_for(allowed)
+
+        documents = len(self.document_index) if allowed is None else len(allowed)
+        if ROUTING_DOCUMENTS and documents > ROUTING_DOCUMENTS:
+            with span("routage"):
+                routed = self.document_index.search(query_vectors, ROUTING_DOCUMENTS, allowed)
+                return allowed_ids, [self.chunk_store.vector_ids_for(docs) for docs in routed]
+        if allowed_ids is None:
+            return None, None
+        return allowed_ids, [allowed_ids] * len(query_vectors)
+
+    def _dense_search(self, query_vectors, k, candidate_ids=None):
+        """Recherche FAISS brute d'une matrice de questions : par question, liste de (vector_id, cosinus)
+
+        candidate_ids (un tableau de vector_id par question) limite la recherche à ces chunks.
+        Avec un stockage quantifié, rescore_factor fois plus de candidats sont cherchés puis
+        reclassés selon leur similarité exacte.
+        """
+        params = resolve_params(self.ntotal, self.index_params)
+        apply_search_params(self.faiss_index, self.index_type, params)
+        lossy = is_lossy(self.index_type, params)
+        candidates = k * params['rescore_factor'] if lossy else k
+        query_vectors = np.ascontiguousarray(query_vectors, dtype=np.float32)
+        if candidate_ids is None:
+            # Sur-échantillonnage pour compenser les vecteurs retirés d'un index HNSW
+            fetch = min(candidates + len(self._deleted_ids), self.faiss_index.ntotal)
+            rows = zip(*self.faiss_index.search(query_vectors, fetch))
+        else:
+            rows = [self._search_subset(query_vector, ids, candidates, params)
+                    for query_vector, ids in zip(query_vectors, candidate_ids)]
+        hits = [[(int(vector_id), float(similarity))
+                 for similarity, vector_id in zip(row_similarities, row_ids)
+                 if vector_id >= 0 and int(vector_id) not in self._deleted_ids][:candidates]
+                for row_similarities, row_ids in rows]
+        if lossy:
+            hits = self._rescore(query_vectors, hits)
+        return [row[:k] for row in hits]
+
+    def _search_subset(self, query_vector, vector_ids, k, params):
+        """Recherche d'une question parmi des vector_id donnés : coût proportionnel à leur nombre"""
+        k = min(k, len(vector_ids))
+        if k == 0:
+            return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+        if self.index_type == "hnsw":
+            # Un graphe HNSW filtré perd du rappel quand peu de nœuds sont admis : calcul exact
+            similarities = self.faiss_index.reconstruct_batch(vector_ids) @ query_vector
+            top = np.argsort(-similarities)[:k]
+            return similarities[top], vector_ids[top]
+        import faiss
+        selector = faiss.IDSelectorBatch(vector_ids)
+        if self.index_type in ("ivf", "ivfpq"):
+            search_params = faiss.SearchParametersIVF(sel=selector, nprobe=params['nprobe'])
+        else:
+            search_params = faiss.SearchParameters(sel=selector)
+        similarities, found_ids = self.faiss_index.search(query_vector[None, :], k, params=search_params)
+        return similarities[0], found_ids[0]
+
+    def _rescore(self, query_vectors, hits):
+        """Remplace les similarités approchées par les similarités exactes et reclasse les candidats
+
+        Les vecteurs exacts sont lus dans le cache d'embeddings, sans appel au modèle ; un
+        candidat absent du cache garde sa similarité approchée.
+        """
+        candidate_ids = sorted({vector_id for row in hits for vector_id, _ in row})
+        if not candidate_ids:
+            return hits
+        with span("rescoring"):
+            cached = cached_document_vectors(self.embeddings, self.chunk_store.texts(candidate_ids))
+            found = [(vector_id, vector) for vector_id, vector in zip(candidate_ids, cached) if vector is not None]
+            if not found:
+                return hits
+            exact = dict(zip([vector_id for vector_id, _ in found], normalize_vectors([vector for _, vector in found])))
+            rescored = []
+            for query_vector, row in zip(query_vectors, hits):
+                row = [(vector_id, float(exact[vector_id] @ query_vector) if vector_id in exact else similarity)
+                       for vector_id, similarity in row]
+                row.sort(key=lambda hit: hit[1], reverse=True)
+                rescored.append(row)
+        return rescored
+
+    def evaluate_recall(self, k=10, sample_size=200, queries=None):
+        """Mesure le rappel@k de l'index courant par rapport à une recherche exacte
+
+        Sans requêtes fournies, un échantillon des chunks indexés sert de requêtes.
+        """
+        self._ensure_loaded()
+        with self._lock.read():
+            if self.faiss_index is None:
+                return {'index_type': None, 'recall': 1.0, 'k': k, 'queries': 0}
+            ids = self.chunk_store.vector_ids()
+            vectors = self._stored_vectors(ids)
+
+            if queries is None:
+                rng = np.random.default_rng(0)
+                picked = rng.choice(len(ids), min(sample_size, len(ids)), replace=False)
+                query_vectors = vectors[picked]
+            else:
+                # Questions vectorisées sans passer par le cache persistant réservé aux chunks
+                query_vectors = normalize_vectors(embed_queries(self.embeddings, list(queries)))
+
+            k = min(k, len(ids))
+            # Rappel de la recherche telle que servie (re-scoring compris pour un stockage quantifié)
+            approx_ids = [[vector_id for vector_id, _ in row] for row in self._dense_search(query_vectors, k)]
+            _, exact_ids = exact_search(vectors, ids, query_vectors, k)
+        return {
+            'index_type': self.index_type,
+            'storage': resolve_params(len(ids), self.index_params)['storage'],
+            'recall': recall_at_k(approx_ids, exact_ids, k),
+            'k': k,
+            'queries': len(query_vectors)
+        }
     
     @property
     def ntotal(self):
-        return len(self.chunks_with_metadata)
+        if self._pending_dir is not None:
+            return self._pending_ntotal
+        return len(self.chunk_store)
     
     def get_document_stats(self):
-        doc_stats = {}
-        for chunk in self.chunks_with_metadata:
-            source = chunk['source']
-            if source not in doc_stats:
-                doc_stats[source] = 0
-            doc_stats[source] += 1
-        return doc_stats
-
-def process_multiple_files(uploaded_files, document_texts, max_files=5):
-    """Traite plusieurs fichiers avec meilleure gestion des métadonnées"""
+        self._ensure_loaded()
+        with self._lock.read():
+            return self.chunk_store.document_stats()
+
+    def get_document_hashes(self):
+        """Documents indexés : file_hash -> nom du fichier source"""
+        self._ensure_loaded()
+        with self._lock.read():
+            return self.chunk_store.document_hashes()
+
+    # -----------------------
+    # PERSISTANCE SUR DISQUE
+    # -----------------------
+
+    def version_key(self):
+        """Identifiant de version : modèle d'embeddings + paramètres de découpage"""
+        signature = f"v{INDEX_FORMAT_VERSION}|{self.model_id}|{self.chunk_size}|{self.chunk_overlap}"
+        return hashlib.md5(signature.encode()).hexdigest()[:12]
+
+    def index_directory(self, base_dir=None):
+        return os.path.join(base_dir or INDEX_DIR, self.version_key())
+
+    def save(self, base_dir=None):
+        """Sauvegarde l'index FAISS, les chunks et les métadonnées sous data/"""
+        self._ensure_loaded()
+        # Écriture exclusive : la sauvegarde compacte l'index BM25
+        with self._lock.write():
+            return self._save(base_dir)
+
+    def _save(self, base_dir):
+        directory = self.index_directory(base_dir)
+        if self.faiss_index is None:
+            # Index vidé : on invalide la sauvegarde précédente
+            meta_path = os.path.join(directory, "meta.json")
+            if os.path.exists(meta_path):
+                os.remove(meta_path)
+            with _persisted_lock:
+                _persisted_indexes.pop(meta_path, None)
+            return None
+
+        os.makedirs(directory, exist_ok=True)
+
+        # Écriture dans des fichiers temporaires puis renommage atomique
+        import faiss
+        index_path = os.path.join(directory, "index.faiss")
+        faiss.write_index(self.faiss_index, index_path + ".tmp")
+        os.replace(index_path + ".tmp", index_path)
+
+        chunks_path = os.path.join(directory, "chunks.npz")
+        self.chunk_store.save(chunks_path + ".tmp")
+        os.replace(chunks_path + ".tmp", chunks_path)
+
+        lexical_path = os.path.join(directory, "lexical.npz")
+        self.lexical_index.save(lexical_path + ".tmp")
+        os.replace(lexical_path + ".tmp", lexical_path)
+
+        documents_path = os.path.join(directory, "documents.npz")
+        self.document_index.save(documents_path + ".tmp")
+        os.replace(documents_path + ".tmp", documents_path)
+
+        # meta.json est écrit en dernier : sa présence valide la sauvegarde
+        meta = {
+            'format_version': INDEX_FORMAT_VERSION,
+            'model_name': self.model_name,
+            'model_id': self.model_id,
+            'chunk_size': self.chunk_size,
+            'chunk_overlap': self.chunk_overlap,
+            'ntotal': len(self.chunk_store),
+            'index_type': self.index_type,
+            'requested_index_type': self.requested_index_type,
+            'index_params': self.index_params,
+            'next_vector_id': self._next_vector_id,
+            'uid': self.uid,
+            'version': self.version,
+            'deleted_ids': sorted(self._deleted_ids),
+            'saved_at': datetime.now().isoformat(timespec="seconds")
+        }
+        meta_path = os.path.join(directory, "meta.json")
+        with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+        os.replace(meta_path + ".tmp", meta_path)
+        # Les prochaines modifications travailleront sur une copie relue depuis ce fichier
+        self._index_path = index_path
+        _remember_persisted_index(meta_path, self)
+        return directory
+
+    @classmethod
+    def load(cls, base_dir=None, model_name=None, device=None,
+             chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, backend=None):
+        """Ouvre un index sauvegardé ; les données ne sont lues qu'au premier accès"""
+        index = cls(model_name, device, chunk_size, chunk_overlap, backend)
+        directory = index.index_directory(base_dir)
+        meta_path = os.path.join(directory, "meta.json")
+        if not os.path.exists(meta_path):
+            return None
+
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get('format_version') != INDEX_FORMAT_VERSION:
+            return None
+
+        index.index_type = meta['index_type']
+        index.requested_index_type = meta.get('requested_index_type', INDEX_TYPE)
+        index.index_params = meta.get('index_params', {})
+        index._next_vector_id = meta['next_vector_id']
+        index.uid = meta.get('uid', index.uid)
+        index.version = meta.get('version', 0)
+        index._deleted_ids = set(meta.get('deleted_ids', []))
+        index._pending_dir = directory
+        index._pending_ntotal = meta.get('ntotal', 0)
+        return index
+
+    def _ensure_loaded(self):
+        """Lit effectivement l'index sauvegardé (mmap si possible) au premier usage"""
+        if self._pending_dir is None:
+            return
+        with self._load_lock:
+            if self._pending_dir is None:
+                return
+            directory = self._pending_dir
+
+            # Import différé : ouvrir l'application (ou un index jamais interrogé) ne charge pas faiss
+            import faiss
+            self._index_path = os.path.join(directory, "index.faiss")
+            self.faiss_index = faiss.read_index(self._index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+
+            self.chunk_store = ChunkStore.load(os.path.join(directory, "chunks.npz"))
+            self.lexical_index = BM25Index.load(os.path.join(directory, "lexical.npz"))
+            self.document_index = DocumentIndex.load(os.path.join(directory, "documents.npz"))
+            self._read_only = True
+            self._pending_dir = None
+
+def _as_filter(values):
+    """Filtre de recherche normalisé (tuple trié, utilisable en clé de cache) ou None"""
+    if values is None:
+        return None
+    if isinstance(values, str):
+        values = [values]
+    return tuple(sorted(set(values)))
+
+def assign_chunk_ids(chunks_with_metadata):
+    """Attribue à chaque chunk son rang dans le document et l'identifiant stable '<file_hash>-<n>'"""
+    counters = {}
+    result = []
+    for chunk in chunks_with_metadata:
+        position = chunk.get('position')
+        if position is None:
+            position = counters.get(chunk['file_hash'], 0)
+        counters[chunk['file_hash']] = position + 1
+        result.append(dict(chunk, position=position, chunk_id=f"{chunk['file_hash']}-{position}"))
+    return result
+
+# Index persistés déjà ouverts, partagés entre les sessions : chemin -> (mtime, index)
+_persisted_indexes = {}
+_persisted_lock = threading.Lock()
+
+def _remember_persisted_index(meta_path, index):
+    # L'index qui vient d'être sauvegardé est déjà à jour : inutile de le relire
+    with _persisted_lock:
+        _persisted_indexes[meta_path] = (os.path.getmtime(meta_path), index)
+
+def load_persisted_index(base_dir=None, model_name=None, device=None):
+    """Retourne l'index sauvegardé partagé par le processus, rechargé s'il a changé sur disque"""
+    probe = FAISSIndex(model_name, device)
+    meta_path = os.path.join(probe.index_directory(base_dir), "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+
+    mtime = os.path.getmtime(meta_path)
+    with _persisted_lock:
+        cached = _persisted_indexes.get(meta_path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        index = FAISSIndex.load(base_dir, model_name, device)
+        if index is not None:
+            _persisted_indexes[meta_path] = (mtime, index)
+        return index
+
+def get_shared_index(base_dir=None, model_name=None, device=None):
+    """Index dans lequel une session ajoute des documents : l'index sauvegardé s'il existe, sinon
+    un index vide commun à toutes les sessions du processus
+
+    Une session ne crée jamais son propre index vide : en le sauvegardant, elle écraserait
+    celui des autres sessions.
+    """
+    index = load_persisted_index(base_dir, model_name, device)
+    if index is not None:
+        return index
+    probe = FAISSIndex(model_name, device)
+    meta_path = os.path.join(probe.index_directory(base_dir), "meta.json")
+    with _persisted_lock:
+        cached = _persisted_indexes.get(meta_path)
+        if cached is None:
+            # Sans date de modification : remplacé par la version du disque dès qu'elle existe
+            cached = _persisted_indexes[meta_path] = (None, probe)
+        return cached[1]
+
+def process_multiple_files(uploaded_files, document_texts, max_files=MAX_FILES,
+                           chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, index=None):
+    """Traite plusieurs fichiers en parallèle avec meilleure gestion des métadonnées
+
+    Si index est fourni, les documents y sont ajoutés au fil de l'eau par le pipeline et
+    seules leurs métadonnées sont gardées (document_texts). Retourne (nombre de segments
+    des nouveaux documents, noms des fichiers traités).
+    """
+    # Seule fonction du module liée à l'interface : streamlit n'est importé qu'ici
+    import streamlit as st
+
     if len(uploaded_files) > max_files:
         st.warning(f"⚠️ Maximum {max_files} fichiers autorisés. Seuls les {max_files} premiers seront traités.")
         uploaded_files = uploaded_files[:max_files]
-    
-    all_chunks = []
+
+    progress_bar = st.progress(0.0, text="🔍 Analyse approfondie des documents...")
+    stage_weights = {"extraction": 0.0, "découpage": 1.0, "indexation": 2.0}
+    stage_count = 3 if index is not None else 2
+
+    def on_progress(stage, name, done, total):
+        fraction = (stage_weights[stage] + done / max(total, 1)) / stage_count
+        progress_bar.progress(min(fraction, 1.0), text=f"🔍 {stage.capitalize()} : {name} ({done}/{total})")
+
+    files = [(uploaded_file.name, uploaded_file.getvalue()) for uploaded_file in uploaded_files]
+    if index is not None and not isinstance(index, FAISSIndex):
+        # Index distant (retrieval_client.RemoteIndex) : l'ingestion tourne dans le service
+        try:
+            result = index.ingest(files, on_progress=on_progress)
+        except RetrievalServiceError as e:
+            progress_bar.empty()
+            st.error(f"❌ Erreur critique du service de recherche : {e}")
+            return 0, []
+    else:
+        pipeline = IngestionPipeline(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        result = pipeline.run(files, index=index, on_progress=on_progress)
+    progress_bar.empty()
+
+    for name in result['duplicates']:
+        st.info(f"📄 {name} - Contenu identique à un autre fichier, ignoré")
+    for name in result.get('unchanged', []):
+        st.info(f"📄 {name} - Déjà indexé, inchangé")
+    for name in result['empty']:
+        st.warning(f"📄 {name} - Document vide ou illisible")
+    for name, error in result['errors']:
+        st.error(f"❌ Erreur critique avec {name}: {error}")
+
+    # Seules les métadonnées sont conservées par session : le texte vit dans l'index
     processed_files = []
-    
-    for uploaded_file in uploaded_files:
-        with st.spinner(f"🔍 Analyse approfondie de {uploaded_file.name}..."):
-            try:
-                # Extraction du texte
-                text = extract_text(uploaded_file)
-                
-                if not text.strip():
-                    st.warning(f"📄 {uploaded_file.name} - Document vide ou illisible")
-                    continue
-                
-                # Découpage en chunks avec la nouvelle fonction LangChain
-                chunks = split_text(text)
-                
-                # Stockage des textes par fichier
-                file_hash = hashlib.md5(uploaded_file.name.encode()).hexdigest()[:8]
-                document_texts[file_hash] = {
-                    'name': uploaded_file.name,
-                    'text': text,
-                    'chunks': chunks,
-                    'size': uploaded_file.size,
-                    'processed_at': datetime.now().strftime("%H:%M")
-                }
-                
-                # Ajout des chunks avec métadonnées enrichies
-                for chunk in chunks:
-                    all_chunks.append({
-                        'text': chunk,
-                        'source': uploaded_file.name,
-                        'file_hash': file_hash,
-                        'chunk_size': len(chunk)
-                    })
-                
-                processed_files.append(uploaded_file.name)
-                
-            except Exception as e:
-                st.error(f"❌ Erreur critique avec {uploaded_file.name}: {str(e)}")
-    
-    return all_chunks, processed_files
\ No newline at end of file
+    for doc in result['documents']:
+        document_texts[doc['file_hash']] = {
+            'name': doc['name'],
+            'chunk_count': doc['chunk_count'],
+            'page_count': doc['page_count'],
+            'size': doc['size'],
+            'processed_at': doc['processed_at']
+        }
+        processed_files.append(doc['name'])
+    # Fichiers déjà indexés à l'identique : rien à refaire, mais ils comptent comme traités
+    processed_files += result.get('unchanged', [])
+
+    # Les documents en erreur sont absents de result['documents']
+    return sum(doc['chunk_count'] for doc in result['documents']), processed_files
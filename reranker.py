@@ -0,0 +1,94 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+# -----------------------
+# CONFIGURATION RERANKING
+# -----------------------
+
+# Étape de reranking par cross-encoder entre la recherche et l'appel au LLM (désactivée par défaut)
+RERANK_ENABLED = os.environ.get("RAG_RERANK", "0") == "1"
+# Cross-encoder multilingue (entraîné sur mMARCO, couvre le français)
+RERANK_MODEL_NAME = os.environ.get("RAG_RERANK_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+RERANK_DEVICE = os.environ.get("RAG_RERANK_DEVICE", "cpu")
+# Quantification dynamique int8 des couches linéaires (CPU)
+RERANK_QUANTIZE = os.environ.get("RAG_RERANK_QUANTIZE", "0") == "1"
+# Nombre de candidats récupérés par la recherche avant reranking
+RERANK_CANDIDATES = int(os.environ.get("RAG_RERANK_CANDIDATES", 20))
+RERANK_BATCH_SIZE = int(os.environ.get("RAG_RERANK_BATCH_SIZE", 8))
+# Budget de temps par question (secondes) ; au-delà on garde l'ordre vectoriel
+RERANK_TIME_BUDGET = float(os.environ.get("RAG_RERANK_TIME_BUDGET", 1.5))
+RERANK_MAX_LENGTH = 384
+
+# Un seul cross-encoder par (modèle, device, quantification) et par processus
+_rerankers = {}
+_rerankers_lock = threading.Lock()
+
+def get_reranker(model_name=None, device=None, quantize=None):
+    """Retourne le cross-encoder partagé du processus (chargé une seule fois)"""
+    key = (model_name or RERANK_MODEL_NAME, device or RERANK_DEVICE,
+           RERANK_QUANTIZE if quantize is None else quantize)
+    model = _rerankers.get(key)
+    if model is not None:
+        return model
+
+    with _rerankers_lock:
+        model = _rerankers.get(key)
+        if model is None:
+            from sentence_transformers import CrossEncoder
+
+            model = CrossEncoder(key[0], max_length=RERANK_MAX_LENGTH, device=key[1])
+            if key[2]:
+                import torch
+                model.model = torch.quantization.quantize_dynamic(model.model, {torch.nn.Linear}, dtype=torch.qint8)
+            _rerankers[key] = model
+    return model
+
+def warmup_reranker(model_name=None, device=None, quantize=None):
+    """Charge le cross-encoder et score une première paire (hors budget des questions)"""
+    model = get_reranker(model_name, device, quantize)
+    model.predict([("warmup", "warmup")], batch_size=1)
+    return model
+
+def rerank(query, chunks, top_n=None, time_budget=RERANK_TIME_BUDGET, batch_size=RERANK_BATCH_SIZE, model=None):
+    """Réordonne les chunks par score de cross-encoder, dans la limite du budget de temps
+
+    Les candidats sont scorés par lots dans l'ordre vectoriel. Le budget est strict : si un lot
+    finit après l'échéance, ou si elle arrive avant la fin, l'ordre vectoriel est conservé tel
+    quel (aucun score partiel ou tardif n'est utilisé).
+    Retourne (chunks, infos) ; infos contient 'reranked', 'scored' et 'elapsed'.
+    """
+    started = time.perf_counter()
+    info = {'reranked': False, 'scored': 0, 'elapsed': 0.0}
+    if not chunks:
+        return chunks, info
+
+    model = model or get_reranker()
+    deadline = started + time_budget if time_budget else None
+    scores = []
+    batch_time = 0.0
+    for start in range(0, len(chunks), batch_size):
+        # On n'entame pas un lot qui, au rythme des précédents, finirait après l'échéance
+        if deadline is not None and time.perf_counter() + batch_time >= deadline:
+            break
+        batch_started = time.perf_counter()
+        pairs = [(query, chunk['text']) for chunk in chunks[start:start + batch_size]]
+        batch_scores = np.atleast_1d(model.predict(pairs, batch_size=batch_size))
+        finished = time.perf_counter()
+        # Lot terminé après l'échéance : ses scores arrivent trop tard et sont ignorés
+        if deadline is not None and finished > deadline:
+            break
+        scores.extend(float(score) for score in batch_scores)
+        batch_time = max(batch_time, finished - batch_started)
+    info['scored'] = len(scores)
+    info['elapsed'] = time.perf_counter() - started
+
+    if len(scores) < len(chunks):
+        return (chunks[:top_n] if top_n else chunks), info
+
+    order = np.argsort(-np.asarray(scores), kind="stable")
+    reranked = [dict(chunks[i], rerank_score=scores[i]) for i in order]
+    info['reranked'] = True
+    return (reranked[:top_n] if top_n else reranked), info
@@ -0,0 +1,121 @@
+import base64
+import os
+import time
+
+import numpy as np
+import requests
+
+from query_variants import MULTI_QUERY_TURNS
+
+# -----------------------
+# CONFIGURATION CLIENT DU SERVICE DE RECHERCHE
+# -----------------------
+
+# URL du service de recherche (vide = index local dans le processus Streamlit)
+SERVICE_URL = os.environ.get("RAG_SERVICE_URL", "")
+SERVICE_COLLECTION = os.environ.get("RAG_COLLECTION", "default")
+SERVICE_TIMEOUT = float(os.environ.get("RAG_SERVICE_TIMEOUT", 30))
+# Les informations de collection (ntotal, documents) sont relues au plus toutes les N secondes
+INFO_TTL = 2.0
+
+class RetrievalServiceError(Exception):
+    """Erreur renvoyée par le service de recherche"""
+    def __init__(self, status_code, message=""):
+        super().__init__(f"HTTP {status_code}: {message}")
+        self.status_code = status_code
+
+class RemoteIndex:
+    """Client du service de recherche, utilisable à la place de FAISSIndex dans l'interface
+
+    Expose les mêmes méthodes que l'interface utilise (ntotal, search, retrieve,
+    get_document_stats, remove_document, save...) ; l'index, les modèles et l'ingestion
+    vivent dans retrieval_service.py, partagés par toutes les sessions et répliques.
+    """
+    def __init__(self, base_url=None, collection=None, timeout=SERVICE_TIMEOUT):
+        self.base_url = (base_url or SERVICE_URL).rstrip("/")
+        self.collection = collection or SERVICE_COLLECTION
+        self.timeout = timeout
+        self.session = requests.Session()
+        self._info = None
+        self._info_at = 0.0
+
+    def _request(self, method, path, payload=None):
+        try:
+            response = self.session.request(method, f"{self.base_url}{path}", json=payload, timeout=self.timeout)
+        except requests.RequestException as e:
+            # Service injoignable ou trop lent : même erreur qu'une réponse en échec
+            raise RetrievalServiceError(503, f"service de recherche injoignable ({e})") from e
+        if response.status_code >= 400:
+            try:
+                message = response.json().get('error', "")
+            except ValueError:
+                message = response.text[:200]
+            raise RetrievalServiceError(response.status_code, message)
+        return response.json()
+
+    def _collection_path(self, suffix=""):
+        return f"/collections/{self.collection}{suffix}"
+
+    def info(self, refresh=False):
+        """Description de la collection (vide si elle n'existe pas encore)"""
+        if refresh or self._info is None or time.monotonic() - self._info_at > INFO_TTL:
+            try:
+                self._info = self._request("GET", self._collection_path())
+            except RetrievalServiceError as e:
+                if e.status_code != 404:
+                    raise
+                self._info = {'ntotal': 0, 'documents': {}, 'stats': {}}
+            self._info_at = time.monotonic()
+        return self._info
+
+    @property
+    def ntotal(self):
+        return self.info()['ntotal']
+
+    def get_document_stats(self):
+        return self.info()['stats']
+
+    def get_document_hashes(self):
+        return self.info()['documents']
+
+    def remove_document(self, file_hash):
+        removed = self._request("DELETE", self._collection_path(f"/documents/{file_hash}"))['removed']
+        self._info = None
+        return removed
+
+    def save(self, base_dir=None):
+        """Le service sauvegarde lui-même après chaque modification"""
+        return None
+
+    def search(self, query, k=8, hybrid=None, min_similarity=None, sources=None, file_hashes=None):
+        result = self._request("POST", self._collection_path("/search"),
+                               {'query': query, 'k': k, 'hybrid': hybrid, 'min_similarity': min_similarity,
+                                'sources': sources, 'file_hashes': file_hashes})
+        return result['scores'], list(range(len(result['chunks']))), result['chunks']
+
+    def retrieve(self, query, k=None, use_rerank=None, max_chunks=None, sources=None, file_hashes=None,
+                 history=None):
+        # Seuls le type, le texte et l'origine des derniers messages servent à la recherche
+        history = [{'type': msg['type'], 'text': msg['text'], 'grounded': msg.get('grounded', True)}
+                   for msg in (history or [])[-2 * MULTI_QUERY_TURNS:]]
+        result = self._request("POST", self._collection_path("/retrieve"),
+                               {'query': query, 'k': k, 'rerank': use_rerank, 'max_chunks': max_chunks,
+                                'sources': sources, 'file_hashes': file_hashes, 'history': history})
+        return result['chunks'], np.asarray(result['question_embedding'], dtype=np.float32), result['timings']
+
+    def ingest(self, files, on_progress=None, poll_interval=0.5):
+        """Soumet des (nom, contenu binaire) à la file d'ingestion et attend la fin de la tâche"""
+        payload = {'files': [{'name': name, 'content': base64.b64encode(data).decode("ascii")}
+                             for name, data in files]}
+        job = self._request("POST", self._collection_path("/documents"), payload)
+        last_progress = None
+        while job['status'] in ("queued", "running"):
+            time.sleep(poll_interval)
+            job = self._request("GET", f"/jobs/{job['id']}")
+            if on_progress is not None and job['progress'] and job['progress'] != last_progress:
+                last_progress = job['progress']
+                on_progress(last_progress['stage'], last_progress['name'], last_progress['done'], last_progress['total'])
+        self._info = None
+        if job['status'] == "error":
+            raise RetrievalServiceError(500, job['error'])
+        return job['result']
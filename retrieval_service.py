@@ -0,0 +1,312 @@
+import argparse
+import base64
+import collections
+import itertools
+import json
+import os
+import queue
+import re
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from embeddings import models_ready, start_background_warmup
+from ingestion import IngestionPipeline
+from metrics import PROMETHEUS_CONTENT_TYPE, inc, register_collector, registry
+from rag_system import INDEX_DIR, FAISSIndex
+from reranker import RERANK_ENABLED, warmup_reranker
+
+# -----------------------
+# CONFIGURATION SERVICE DE RECHERCHE
+# -----------------------
+
+SERVICE_HOST = os.environ.get("RAG_SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.environ.get("RAG_SERVICE_PORT", 8502))
+# Collections nommées (la collection "default" reste dans RAG_INDEX_DIR)
+COLLECTIONS_DIR = os.environ.get("RAG_COLLECTIONS_DIR", os.path.join("data", "collections"))
+DEFAULT_COLLECTION = "default"
+# Nombre de tâches d'ingestion terminées conservées pour consultation
+MAX_FINISHED_JOBS = 100
+
+_COLLECTION_NAME = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+class ServiceError(Exception):
+    """Erreur renvoyée au client avec un code HTTP"""
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+class CollectionRegistry:
+    """Collections nommées : un FAISSIndex par collection, partagé par toutes les requêtes"""
+    def __init__(self, root=COLLECTIONS_DIR, default_dir=INDEX_DIR):
+        self.root = root
+        self.default_dir = default_dir
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def directory(self, name):
+        if not _COLLECTION_NAME.match(name):
+            raise ServiceError(400, f"Nom de collection invalide : {name}")
+        return self.default_dir if name == DEFAULT_COLLECTION else os.path.join(self.root, name)
+
+    def get(self, name, create=False):
+        directory = self.directory(name)
+        with self._lock:
+            index = self._indexes.get(name)
+            if index is None:
+                index = FAISSIndex.load(directory)
+                if index is None and create:
+                    index = FAISSIndex()
+                if index is not None:
+                    self._indexes[name] = index
+        if index is None:
+            raise ServiceError(404, f"Collection inconnue : {name}")
+        return index
+
+    def save(self, name):
+        self.get(name).save(self.directory(name))
+
+    def names(self):
+        names = {DEFAULT_COLLECTION} | set(self._indexes)
+        if os.path.isdir(self.root):
+            names |= {name for name in os.listdir(self.root) if _COLLECTION_NAME.match(name)}
+        return sorted(names)
+
+    def describe(self, name):
+        index = self.get(name)
+        return {
+            'name': name,
+            'ntotal': index.ntotal,
+            'version': index.version,
+            'index_type': index.index_type,
+            'storage': index.index_params.get('storage'),
+            'documents': index.get_document_hashes(),
+            'stats': index.get_document_stats()
+        }
+
+class IngestionQueue:
+    """File d'ingestion en arrière-plan : un thread traite les tâches une par une
+
+    Les recherches restent servies pendant l'indexation (FAISSIndex est protégé par verrou).
+    """
+    def __init__(self, registry):
+        self.registry = registry
+        self.jobs = {}
+        self._queue = queue.Queue()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def submit(self, collection, files):
+        self.registry.directory(collection)
+        job = {
+            'id': str(next(self._ids)),
+            'collection': collection,
+            'files': [name for name, _ in files],
+            'status': "queued",
+            'progress': None,
+            'result': None,
+            'error': None,
+            'submitted_at': datetime.now().isoformat(timespec="seconds")
+        }
+        with self._lock:
+            self.jobs[job['id']] = job
+            self._prune()
+        self._queue.put((job, files))
+        return job
+
+    def get(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None:
+            raise ServiceError(404, f"Tâche inconnue : {job_id}")
+        return job
+
+    def all_jobs(self):
+        with self._lock:
+            return list(self.jobs.values())
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job['status'] in ("done", "error")]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+
+    def _run(self):
+        while True:
+            job, files = self._queue.get()
+            job['status'] = "running"
+            started = time.perf_counter()
+
+            def on_progress(stage, name, done, total):
+                job['progress'] = {'stage': stage, 'name': name, 'done': done, 'total': total}
+
+            try:
+                index = self.registry.get(job['collection'], create=True)
+                result = IngestionPipeline().run(files, index=index, on_progress=on_progress)
+                if result['indexed']:
+                    self.registry.save(job['collection'])
+                # Les chunks restent dans l'index du service : le client reçoit les métadonnées des documents
+                job['result'] = {
+                    'documents': result['documents'],
+                    'errors': result['errors'],
+                    'empty': result['empty'],
+                    'duplicates': result['duplicates'],
+                    'unchanged': result['unchanged']
+                }
+                job['status'] = "done"
+            except Exception as e:
+                job['error'] = str(e)
+                job['status'] = "error"
+            job['elapsed'] = time.perf_counter() - started
+
+class RetrievalService:
+    """Couche de recherche partagée : collections, requêtes concurrentes et ingestion en file"""
+    def __init__(self, collections_dir=COLLECTIONS_DIR, default_dir=INDEX_DIR):
+        self.registry = CollectionRegistry(collections_dir, default_dir)
+        self.ingestion = IngestionQueue(self.registry)
+        register_collector(self._collection_metrics)
+
+    def _collection_metrics(self):
+        metrics = [("rag_ingestion_jobs", {'status': status}, count) for status, count in
+                   collections.Counter(job['status'] for job in self.ingestion.all_jobs()).items()]
+        for name, index in list(self.registry._indexes.items()):
+            metrics.append(("rag_collection_chunks", {'collection': name}, index.ntotal))
+        return metrics
+
+    def handle(self, method, path, body):
+        """Aiguillage des routes ; retourne (code HTTP, objet JSON ou texte)"""
+        parts = [part for part in path.split("?")[0].split("/") if part]
+
+        if method == "GET" and parts == ["health"]:
+            return 200, {'status': "ok", 'models_ready': models_ready()}
+        if method == "GET" and parts == ["metrics"]:
+            # Format d'exposition Prometheus (RAG_METRICS=1 pour les compteurs et latences)
+            return 200, registry.render()
+        if method == "GET" and parts == ["collections"]:
+            collections = []
+            for name in self.registry.names():
+                try:
+                    index = self.registry.get(name)
+                except ServiceError:
+                    continue
+                collections.append({'name': name, 'ntotal': index.ntotal})
+            return 200, {'collections': collections}
+        if method == "GET" and parts == ["jobs"]:
+            return 200, {'jobs': self.ingestion.all_jobs()}
+        if method == "GET" and len(parts) == 2 and parts[0] == "jobs":
+            return 200, self.ingestion.get(parts[1])
+
+        if len(parts) < 2 or parts[0] != "collections":
+            raise ServiceError(404, f"Route inconnue : {method} {path}")
+        name = parts[1]
+        action = parts[2:]
+
+        if method == "GET" and not action:
+            return 200, self.registry.describe(name)
+        if method == "POST" and action == ["search"]:
+            query = self._require(body, 'query')
+            scores, _, chunks = self.registry.get(name).search(query, k=int(body.get('k', 8)),
+                                                              hybrid=body.get('hybrid'),
+                                                              min_similarity=body.get('min_similarity'),
+                                                              sources=body.get('sources'),
+                                                              file_hashes=body.get('file_hashes'))
+            return 200, {'scores': [float(score) for score in scores], 'chunks': chunks}
+        if method == "POST" and action == ["retrieve"]:
+            query = self._require(body, 'query')
+            chunks, embedding, timings = self.registry.get(name).retrieve(
+                query, k=body.get('k'), use_rerank=body.get('rerank'), max_chunks=body.get('max_chunks'),
+                sources=body.get('sources'), file_hashes=body.get('file_hashes'), history=body.get('history')
+            )
+            return 200, {'chunks': chunks, 'question_embedding': [float(x) for x in embedding],
+                         'timings': timings}
+        if method == "POST" and action == ["documents"]:
+            files = [(item['name'], base64.b64decode(item['content'])) for item in self._require(body, 'files')]
+            return 202, self.ingestion.submit(name, files)
+        if method == "DELETE" and len(action) == 2 and action[0] == "documents":
+            index = self.registry.get(name)
+            removed = index.remove_document(action[1])
+            self.registry.save(name)
+            return 200, {'removed': removed}
+
+        raise ServiceError(404, f"Route inconnue : {method} {path}")
+
+    @staticmethod
+    def _require(body, key):
+        if key not in body:
+            raise ServiceError(400, f"Champ manquant : {key}")
+        return body[key]
+
+def _route_label(path):
+    """Route sans le nom de collection ni l'identifiant, ex. /collections/*/search"""
+    parts = [part for part in path.split("?")[0].split("/") if part]
+    if len(parts) >= 2 and parts[0] in ("collections", "jobs"):
+        parts[1] = "*"
+    if len(parts) >= 4 and parts[2] == "documents":
+        parts[3] = "*"
+    return "/" + "/".join(parts)
+
+def make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _dispatch(self, method):
+            started = time.perf_counter()
+            try:
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length) or b"{}") if length else {}
+                status, payload = service.handle(method, self.path, body)
+            except ServiceError as e:
+                status, payload = e.status, {'error': str(e)}
+            except (ValueError, KeyError) as e:
+                status, payload = 400, {'error': str(e)}
+            except Exception as e:
+                status, payload = 500, {'error': str(e)}
+            if isinstance(payload, str):
+                data, content_type = payload.encode("utf-8"), PROMETHEUS_CONTENT_TYPE
+            else:
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                content_type = "application/json; charset=utf-8"
+            route = _route_label(self.path)
+            inc("rag_service_requests_total", method=method, route=route, status=status)
+            registry.observe("rag_service_request_seconds", time.perf_counter() - started, route=route)
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            self._dispatch("GET")
+
+        def do_POST(self):
+            self._dispatch("POST")
+
+        def do_DELETE(self):
+            self._dispatch("DELETE")
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+def serve(host=SERVICE_HOST, port=SERVICE_PORT, service=None):
+    """Démarre le service (bloquant) ; chaque requête est traitée dans son propre thread"""
+    service = service or RetrievalService()
+    # Les modèles se chargent en arrière-plan : /health répond dès le démarrage et les
+    # premières recherches attendent simplement la fin du chargement
+    start_background_warmup(*([warmup_reranker] if RERANK_ENABLED else []))
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    server.daemon_threads = True
+    print(f"Service de recherche sur http://{host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Service HTTP de recherche documentaire (FAISS + BM25)")
+    parser.add_argument("--host", default=SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    args = parser.parse_args()
+    serve(args.host, args.port)
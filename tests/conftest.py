@@ -0,0 +1,65 @@
+import hashlib
+import os
+import re
+import sys
+
+import numpy as np
+import pytest
+
+# Les modules de l'application sont à la racine du dépôt (pas de paquet installable)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class FakeEmbeddings:
+    """Embeddings déterministes sans modèle à charger : somme de vecteurs aléatoires positifs par mot
+
+    Deux textes qui partagent des mots ont des vecteurs proches ; calls compte les textes
+    réellement vectorisés.
+    """
+    def __init__(self, dim=32):
+        self.dim = dim
+        self.calls = 0
+        self._words = {}
+
+    def _word_vector(self, word):
+        vector = self._words.get(word)
+        if vector is None:
+            seed = int(hashlib.md5(word.encode()).hexdigest()[:8], 16)
+            vector = self._words[word] = np.abs(np.random.default_rng(seed).standard_normal(self.dim)).astype(np.float32)
+        return vector
+
+    def _embed(self, text):
+        vector = np.full(self.dim, 0.01, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            vector += self._word_vector(word)
+        return vector.tolist()
+
+    def embed_documents(self, texts):
+        self.calls += len(texts)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+@pytest.fixture
+def fake_embeddings():
+    return FakeEmbeddings()
+
+@pytest.fixture
+def make_index(tmp_path, fake_embeddings):
+    """Fabrique de FAISSIndex branchés sur FakeEmbeddings (avec cache d'embeddings par défaut)"""
+    from embeddings import CachedEmbeddings, EmbeddingCache
+    from query_cache import query_embedding_cache, search_results_cache
+    from rag_system import FAISSIndex
+
+    # Caches de requêtes partagés par le processus : chaque test repart de zéro
+    query_embedding_cache.clear()
+    search_results_cache.clear()
+    cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite"))
+
+    def make(cached=True, **kwargs):
+        index = FAISSIndex(**kwargs)
+        index.embeddings = CachedEmbeddings(fake_embeddings, cache, "fake") if cached else fake_embeddings
+        return index
+
+    make.cache = cache
+    return make
@@ -0,0 +1,65 @@
+import itertools
+
+import answer_cache
+import mistral_client
+from answer_cache import SemanticAnswerCache, context_key
+from mistral_stub import MistralStubServer
+
+CHUNKS = [{'chunk_id': "bail1-0", 'text': "Le préavis du locataire est de trois mois."}]
+HISTORY = [{'type': "question", 'text': "Et pour le bailleur ?"}]
+
+def test_context_key_covers_chunks_settings_and_history():
+    key = context_key(CHUNKS, "mistral-small|0.3")
+    assert key == context_key(list(reversed(CHUNKS)), "mistral-small|0.3")
+    assert key != context_key(CHUNKS, "mistral-large|0.3")
+    assert key != context_key(CHUNKS, "mistral-small|0.3", HISTORY)
+    assert key != context_key([dict(CHUNKS[0], text="Le préavis est d'un mois.")], "mistral-small|0.3")
+
+def test_close_questions_reuse_the_answer_of_the_same_context(tmp_path):
+    cache = SemanticAnswerCache(str(tmp_path / "answers.sqlite"), threshold=0.95)
+    key = context_key(CHUNKS, "s")
+    cache.store(key, [1.0, 0.0, 0.0], "Quel préavis ?", "Trois mois.", ["bail1"])
+
+    assert cache.lookup(key, [0.99, 0.05, 0.0]) == "Trois mois."
+    assert cache.lookup(key, [0.0, 1.0, 0.0]) is None
+    assert cache.lookup(context_key(CHUNKS, "autre"), [1.0, 0.0, 0.0]) is None
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 2
+
+def test_answers_of_a_removed_document_are_invalidated(tmp_path):
+    cache = SemanticAnswerCache(str(tmp_path / "answers.sqlite"))
+    cache.store("k", [1.0, 0.0], "Quel préavis ?", "Trois mois.", ["bail1", "annexe1"])
+    cache.store("k", [0.0, 1.0], "Quel dépôt ?", "Un mois.", ["annexe2"])
+    assert cache.invalidate_documents(["bail1"]) == 1
+    assert cache.lookup("k", [1.0, 0.0]) is None
+    assert cache.lookup("k", [0.0, 1.0]) == "Un mois."
+
+def test_least_recently_used_answers_are_evicted(tmp_path, monkeypatch):
+    # Horloge strictement croissante : l'ordre d'utilisation est sans ex aequo
+    clock = itertools.count(1000)
+    monkeypatch.setattr(answer_cache.time, "time", lambda: float(next(clock)))
+    cache = SemanticAnswerCache(str(tmp_path / "answers.sqlite"), max_entries=2)
+    for i, vector in enumerate(([1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [0.0, 0.0, 1.0])):
+        cache.store("k", vector, f"question {i}", f"réponse {i}", [])
+    assert cache.stats()['size'] == 2
+    assert cache.lookup("k", [1.0, 0.0, 0.0]) is None
+    assert cache.lookup("k", [0.0, 0.0, 1.0]) == "réponse 2"
+
+def test_paraphrased_question_is_answered_from_the_cache(tmp_path, monkeypatch):
+    cache = SemanticAnswerCache(str(tmp_path / "answers.sqlite"), threshold=0.95)
+    monkeypatch.setattr(mistral_client, "get_answer_cache", lambda: cache)
+    context = [dict(CHUNKS[0], source="bail.pdf", file_hash="bail1")]
+    welcome = {'type': "answer", 'text': "Bienvenue !"}
+
+    with MistralStubServer(first_token_delay=0, token_delay=0) as server:
+        monkeypatch.setattr(mistral_client, "MISTRAL_API_URL", server.url)
+        answers = []
+        # Comme dans l'interface, la conversation se termine par la question posée
+        for question, embedding in (("Quel est le préavis du locataire ?", [1.0, 0.0, 0.0]),
+                                    ("Quel préavis pour le locataire ?", [0.99, 0.05, 0.0])):
+            outcome = {}
+            answers.append(mistral_client.smart_text_analysis_with_mistral(
+                context, question, [welcome, {'type': "question", 'text': question}],
+                question_embedding=embedding, outcome=outcome))
+        assert len(server.requests) == 1
+    assert outcome['source'] == "cache"
+    assert answers[0] == answers[1] == server.answer
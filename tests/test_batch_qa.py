@@ -0,0 +1,58 @@
+import asyncio
+import json
+
+import pytest
+
+from batch_qa import answer_question, prepare_output
+from llm_client import AsyncLLMClient
+from mistral_stub import MistralStubServer
+
+def test_resume_drops_truncated_line_and_failed_entries(tmp_path):
+    path = tmp_path / "answers.jsonl"
+    path.write_text(
+        json.dumps({'id': "1", 'answer': "a", 'error': None}) + "\n"
+        + json.dumps({'id': "2", 'answer': None, 'error': "HTTP 500"}) + "\n"
+        + json.dumps({'id': "1", 'answer': "b", 'error': None}) + "\n"
+        + '{"id": "3", "answ',
+        encoding="utf-8"
+    )
+    assert prepare_output(str(path)) == {"1"}
+
+    content = path.read_text(encoding="utf-8")
+    assert content.endswith("\n")
+    records = [json.loads(line) for line in content.splitlines()]
+    assert records == [{'id': "1", 'answer': "b", 'error': None}]
+
+def test_missing_output_file(tmp_path):
+    assert prepare_output(str(tmp_path / "absent.jsonl")) == set()
+
+def test_retrieval_only_records_are_answered_by_a_later_llm_run(tmp_path):
+    path = tmp_path / "answers.jsonl"
+    path.write_text(json.dumps({'id': "1", 'answer': None, 'error': None}) + "\n", encoding="utf-8")
+    assert prepare_output(str(path), require_answer=False) == {"1"}
+    assert prepare_output(str(path)) == set()
+    assert path.read_text(encoding="utf-8") == ""
+
+CONTEXT = [{'chunk_id': "h-0", 'text': "Le préavis est de trois mois.", 'source': "bail.pdf", 'file_hash': "h"}]
+
+def _answer(server, item):
+    async def scenario():
+        async with AsyncLLMClient(server.url, "clé", rate_limit=0) as client:
+            return await answer_question(client, item, CONTEXT, {})
+
+    return asyncio.run(scenario())
+
+def test_null_history_is_sent_as_no_history():
+    pytest.importorskip("aiohttp")
+    item = {'id': "1", 'question': "Quelle est la durée du préavis ?", 'history': None}
+    with MistralStubServer(first_token_delay=0) as server:
+        record = _answer(server, item)
+    assert record['error'] is None and record['answer'] == server.answer
+
+def test_failed_request_records_the_client_error_once():
+    pytest.importorskip("aiohttp")
+    item = {'id': "1", 'question': "Quelle est la durée du préavis ?"}
+    with MistralStubServer(first_token_delay=0, fail_status=401) as server:
+        record = _answer(server, item)
+    assert record['answer'] is None
+    assert record['error'] == "HTTP 401: " + json.dumps({"message": "erreur simulée"})
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from chunk_store import ChunkStore
+
+TEXT = "".join(f"Phrase numéro {i} du contrat de bail. " for i in range(40))
+
+def _chunks(size=120, overlap=30):
+    step = size - overlap
+    return [{'text': TEXT[start:start + size], 'source': "bail.pdf", 'file_hash': "h", 'position': i}
+            for i, start in enumerate(range(0, len(TEXT) - overlap, step))]
+
+@pytest.mark.parametrize("reload", [False, True])
+def test_overlap_is_stored_once_across_add_calls(tmp_path, reload):
+    chunks = _chunks()
+    single = ChunkStore()
+    single.add(chunks, np.arange(len(chunks)))
+
+    batched = ChunkStore()
+    half = len(chunks) // 2
+    batched.add(chunks[:half], np.arange(half))
+    if reload:
+        # Lot suivant après relecture depuis le disque : le recouvrement est retrouvé dans le stockage
+        batched.save(tmp_path / "chunks.npz")
+        batched = ChunkStore.load(tmp_path / "chunks.npz")
+    batched.add(chunks[half:], np.arange(half, len(chunks)))
+
+    assert batched._buffers == single._buffers == [TEXT]
+    assert batched.texts() == [chunk['text'] for chunk in chunks]
+
+def test_removed_document_does_not_share_overlap_with_its_new_version():
+    chunks = _chunks()
+    store = ChunkStore()
+    store.add(chunks[:3], np.arange(3))
+    store.remove_file_hashes({"h"})
+    store.add(chunks[3:], np.arange(3, len(chunks)))
+    assert store.texts() == [chunk['text'] for chunk in chunks[3:]]
+
+def test_sources_without_documents_are_pruned():
+    store = ChunkStore()
+    store.add([{'text': "alpha", 'source': "a.pdf", 'file_hash': "a", 'position': 0},
+               {'text': "beta", 'source': "b.pdf", 'file_hash': "b", 'position': 0},
+               {'text': "gamma", 'source': "b.pdf", 'file_hash': "b2", 'position': 0}], np.arange(3))
+    store.remove_file_hashes({"a", "b"})
+    assert store._sources == ["b.pdf"]
+    assert store.file_hashes_for({"a.pdf", "b.pdf"}) == {"b2"}
+    assert store.get(2)['source'] == "b.pdf"
+
+    store.add([{'text': "delta", 'source': "a.pdf", 'file_hash': "a", 'position': 0}], [3])
+    assert store.document_stats() == {"b.pdf": 1, "a.pdf": 1}
@@ -0,0 +1,18 @@
+from context_builder import build_context, chunk_position
+from mistral_client import select_context
+
+def _chunk(position, text):
+    return {'chunk_id': f"h-{position}", 'position': position, 'text': text, 'file_hash': "h", 'source': "a.pdf"}
+
+def test_merged_chunk_is_not_merged_again():
+    context = build_context([_chunk(0, "alpha beta"), _chunk(1, "beta gamma")])
+    assert [chunk['chunk_id'] for chunk in context] == ["h-0+h-1"]
+    assert chunk_position(context[0]) is None
+
+    context = build_context(context + [_chunk(2, "gamma delta")])
+    assert [chunk['chunk_id'] for chunk in context] == ["h-0+h-1", "h-2"]
+
+def test_packed_context_is_sent_as_is():
+    context = build_context([_chunk(0, "alpha beta"), _chunk(1, "beta gamma"), _chunk(5, "omega")])
+    assert select_context(context) == context
+    assert select_context([_chunk(0, "alpha beta"), _chunk(1, "beta gamma")])[0]['chunk_id'] == "h-0+h-1"
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from document_index import DocumentIndex
+
+def _index():
+    index = DocumentIndex()
+    index.add(["a", "a", "b", "c"], np.array([[1, 0, 0], [0.8, 0.6, 0], [0, 1, 0], [0, 0, 1]], dtype=np.float32))
+    return index
+
+def test_questions_are_routed_to_the_closest_centroids():
+    index = _index()
+    assert len(index) == 3
+    routed = index.search(np.array([[1, 0.1, 0], [0, 0, 1]], dtype=np.float32), 1)
+    assert routed == [["a"], ["c"]]
+    # Le filtre l'emporte sur la proximité : "a" est le plus proche mais exclu
+    assert index.search(np.array([[1, 0, 0.2]], dtype=np.float32), 1, allowed={"b", "c", "inconnu"}) == [["c"]]
+    assert index.search(np.array([[1, 0, 0]], dtype=np.float32), 1, allowed=set()) == [[]]
+
+@pytest.mark.parametrize("reload", [False, True])
+def test_removed_documents_are_no_longer_routed(tmp_path, reload):
+    index = _index()
+    index.remove(["a"])
+    if reload:
+        index.save(tmp_path / "documents.npz")
+        index = DocumentIndex.load(tmp_path / "documents.npz")
+    assert len(index) == 2
+    assert sorted(index.search(np.array([[1, 0.1, 0]], dtype=np.float32), 2)[0]) == ["b", "c"]
+
+def test_search_is_routed_past_the_document_threshold(make_index, monkeypatch):
+    pytest.importorskip("faiss")
+    import rag_system
+
+    monkeypatch.setattr(rag_system, "ROUTING_DOCUMENTS", 2)
+    index = make_index(hybrid=False)
+    for i, text in enumerate(["Le préavis du locataire est de trois mois.",
+                              "Le dépôt de garantie vaut un mois de loyer.",
+                              "Délibération relative au stationnement des véhicules.",
+                              "Les clés sont remises lors de l'état des lieux."]):
+        index.add([{'text': text, 'source': f"doc{i}.pdf", 'file_hash': f"h{i}", 'position': 0}])
+    # Seuls les chunks des deux documents les plus proches sont candidats
+    _, _, chunks = index.search("stationnement des véhicules", k=4, min_similarity=0)
+    assert len(chunks) == 2 and chunks[0]['source'] == "doc2.pdf"
@@ -0,0 +1,53 @@
+import itertools
+import sqlite3
+
+import numpy as np
+import pytest
+
+import embeddings
+from embeddings import CachedEmbeddings, EmbeddingCache
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Horloge strictement croissante : l'ordre LRU ne dépend pas de la résolution de time.time()
+    ticks = itertools.count(1)
+    monkeypatch.setattr(embeddings.time, "time", lambda: float(next(ticks)))
+
+def test_cached_texts_are_not_embedded_again(tmp_path, fake_embeddings):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"))
+    model = CachedEmbeddings(fake_embeddings, cache, "fake")
+    first = model.embed_documents(["alpha", "beta", "alpha"])
+    assert fake_embeddings.calls == 2
+
+    second = model.embed_documents(["beta", "gamma"])
+    assert fake_embeddings.calls == 3
+    assert second[0] == first[1]
+    assert (cache.hits, cache.misses) == (1, 3)
+
+def test_least_recently_used_vectors_are_evicted(tmp_path, clock):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"), max_entries=10)
+    for i in range(10):
+        cache.put_many([(f"k{i}", np.full(4, i, dtype=np.float32))])
+    # k0 et k1 relus : k2 et k3 deviennent les plus anciens
+    cache.get_many(["k0", "k1"])
+    cache.put_many([("k10", np.zeros(4, dtype=np.float32))])
+
+    assert len(cache) == 9
+    found = cache.get_many([f"k{i}" for i in range(11)])
+    assert sorted(found) == sorted(["k0", "k1"] + [f"k{i}" for i in range(4, 11)])
+
+def test_cache_created_without_last_used_is_migrated(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+    conn.executemany("INSERT INTO embeddings VALUES (?, ?)",
+                     [(f"ancienne{i}", np.ones(4, dtype=np.float32).tobytes()) for i in range(10)])
+    conn.commit()
+    conn.close()
+
+    cache = EmbeddingCache(path, max_entries=10)
+    assert len(cache) == 10
+    # Les entrées antérieures à la migration sont les plus anciennes : elles partent en premier
+    cache.put_many([("nouvelle", np.zeros(4, dtype=np.float32))])
+    assert len(cache) == 9
+    assert "nouvelle" in cache.get_many(["nouvelle"])
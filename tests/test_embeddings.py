@@ -0,0 +1,56 @@
+import string
+
+import numpy as np
+import pytest
+
+from embeddings import EMBEDDING_MODEL_NAME, PARITY_SAMPLE_TEXTS, OnnxEmbeddings, get_embedding_model
+
+def _require_backends():
+    pytest.importorskip("onnxruntime")
+    pytest.importorskip("sentence_transformers")
+    return pytest.importorskip("transformers")
+
+def _require_local_model(model_name):
+    """Saute le test si le modèle n'est pas disponible localement (pas de téléchargement en test)"""
+    transformers = _require_backends()
+    try:
+        transformers.AutoTokenizer.from_pretrained(model_name, local_files_only=True)
+    except OSError:
+        pytest.skip(f"Modèle {model_name} absent du cache local")
+    return model_name
+
+@pytest.fixture(scope="module")
+def tiny_model(tmp_path_factory):
+    """Petit BERT aléatoire enregistré localement : même export ONNX et même pooling que le vrai modèle"""
+    transformers = _require_backends()
+    directory = tmp_path_factory.mktemp("tiny-bert")
+    letters = string.ascii_lowercase + string.digits
+    vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + list(letters) + [f"##{c}" for c in letters]
+    (directory / "vocab.txt").write_text("\n".join(vocab), encoding="utf-8")
+    transformers.BertTokenizerFast(str(directory / "vocab.txt")).save_pretrained(directory)
+    transformers.set_seed(0)
+    config = transformers.BertConfig(vocab_size=len(vocab), hidden_size=32, num_hidden_layers=2,
+                                     num_attention_heads=2, intermediate_size=64)
+    transformers.BertModel(config).save_pretrained(directory)
+    return str(directory)
+
+@pytest.fixture(params=["tiny", "reference"])
+def model_name(request):
+    if request.param == "tiny":
+        return request.getfixturevalue("tiny_model")
+    return _require_local_model(EMBEDDING_MODEL_NAME)
+
+@pytest.mark.parametrize("quantize, min_cosine", [(False, 0.999), (True, 0.95)])
+def test_onnx_matches_sentence_transformers(tmp_path, model_name, quantize, min_cosine):
+    reference = np.asarray(get_embedding_model(model_name, "cpu", "torch").embed_documents(
+        PARITY_SAMPLE_TEXTS), dtype=np.float32)
+    onnx = OnnxEmbeddings(model_name, quantize=quantize, models_dir=str(tmp_path))
+    candidate = np.asarray(onnx.embed_documents(PARITY_SAMPLE_TEXTS), dtype=np.float32)
+
+    assert candidate.shape == reference.shape
+    cosines = (reference * candidate).sum(axis=1) / (
+        np.linalg.norm(reference, axis=1) * np.linalg.norm(candidate, axis=1)
+    )
+    assert cosines.min() >= min_cosine
+    # Les vecteurs ONNX sont normalisés comme ceux de sentence-transformers
+    np.testing.assert_allclose(np.linalg.norm(candidate, axis=1), 1.0, atol=1e-4)
@@ -0,0 +1,95 @@
+import pytest
+
+pytest.importorskip("faiss")
+
+def _chunks(file_hash, source, texts):
+    return [{'text': text, 'source': source, 'file_hash': file_hash, 'position': i} for i, text in enumerate(texts)]
+
+BAIL = _chunks("bail1", "bail.pdf", ["Le préavis du locataire est de trois mois.",
+                                     "Le loyer mensuel est payable le premier du mois."])
+ANNEXE = _chunks("annexe1", "annexe.pdf", ["Le dépôt de garantie vaut un mois de loyer.",
+                                           "Les clés sont remises lors de l'état des lieux."])
+
+def _sources(index, query):
+    _, _, chunks = index.search(query, k=2, min_similarity=0)
+    return [chunk['source'] for chunk in chunks]
+
+def test_documents_are_added_without_reembedding_the_corpus(make_index, fake_embeddings):
+    index = make_index()
+    index.add(BAIL)
+    index.add(ANNEXE)
+    assert index.ntotal == 4
+    assert fake_embeddings.calls == 4
+    assert _sources(index, "préavis du locataire")[0] == "bail.pdf"
+    assert _sources(index, "dépôt de garantie")[0] == "annexe.pdf"
+
+def test_new_content_under_the_same_name_replaces_the_old_version(make_index):
+    index = make_index()
+    index.add(BAIL)
+    index.add(_chunks("bail2", "bail.pdf", ["Le préavis du locataire est d'un mois."]))
+    assert index.get_document_hashes() == {"bail2": "bail.pdf"}
+    assert index.ntotal == 1
+
+    # Même contenu sous un autre nom : le document est renommé, pas dupliqué
+    index.add(_chunks("bail2", "bail-signé.pdf", ["Le préavis du locataire est d'un mois."]))
+    assert index.get_document_hashes() == {"bail2": "bail-signé.pdf"}
+
+def test_removed_document_is_no_longer_found(make_index):
+    index = make_index()
+    index.add(BAIL + ANNEXE)
+    version = index.version
+    assert index.remove_document("bail1") == 2
+    assert index.version > version
+    assert index.ntotal == 2
+    assert _sources(index, "préavis du locataire") == ["annexe.pdf", "annexe.pdf"]
+
+    assert index.remove_document("annexe1") == 2
+    assert index.ntotal == 0 and index.faiss_index is None
+    assert index.search("préavis") == ([], [], [])
+
+def test_saved_index_is_reloaded_lazily(make_index, fake_embeddings, tmp_path):
+    from rag_system import FAISSIndex
+
+    index = make_index()
+    index.add(BAIL + ANNEXE)
+    index.save(str(tmp_path / "index"))
+
+    loaded = FAISSIndex.load(str(tmp_path / "index"))
+    loaded.embeddings = index.embeddings
+    # Rien n'est lu avant le premier usage : seules les métadonnées sont connues
+    assert loaded.faiss_index is None and loaded.ntotal == 4
+    assert (loaded.uid, loaded.version) == (index.uid, index.version)
+
+    calls = fake_embeddings.calls
+    assert _sources(loaded, "dépôt de garantie")[0] == "annexe.pdf"
+    assert loaded.faiss_index is not None
+    assert loaded.get_document_hashes() == index.get_document_hashes()
+    # Seule la question a été vectorisée : les chunks viennent du disque
+    assert fake_embeddings.calls == calls + 1
+
+    # Index ouvert en mmap : il redevient modifiable au premier ajout
+    loaded.add(_chunks("avenant1", "avenant.pdf", ["Avenant relatif au stationnement."]))
+    assert loaded.ntotal == 5
+
+def test_persisted_index_is_shared_and_reloaded_when_saved_again(make_index, tmp_path):
+    import os
+
+    from rag_system import get_shared_index, load_persisted_index
+
+    base_dir = str(tmp_path / "index")
+    assert load_persisted_index(base_dir) is None
+    shared = get_shared_index(base_dir)
+    # Avant toute sauvegarde, toutes les sessions partagent le même index vide
+    assert get_shared_index(base_dir) is shared
+
+    shared.embeddings = make_index().embeddings
+    shared.add(BAIL)
+    directory = shared.save(base_dir)
+    assert load_persisted_index(base_dir) is shared
+
+    # Sauvegarde par un autre processus : l'index est relu depuis le disque
+    meta_path = os.path.join(directory, "meta.json")
+    os.utime(meta_path, (os.path.getatime(meta_path), os.path.getmtime(meta_path) + 10))
+    reloaded = load_persisted_index(base_dir)
+    assert reloaded is not shared and reloaded.ntotal == 2
+    assert get_shared_index(base_dir) is reloaded
@@ -0,0 +1,150 @@
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+import ingestion
+from ingestion import IngestionPipeline
+
+docx = pytest.importorskip("docx")
+
+def _docx(text):
+    document = docx.Document()
+    for paragraph in text.split("\n"):
+        document.add_paragraph(paragraph)
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+@pytest.fixture(autouse=True)
+def pools(monkeypatch):
+    pools = {}
+    monkeypatch.setattr(ingestion, "_pools", pools)
+    yield pools
+    for pool in pools.values():
+        pool.shutdown(wait=False, cancel_futures=True)
+
+class _BrokenPool:
+    _broken = False
+
+    def submit(self, *args):
+        raise BrokenProcessPool("processus mort")
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+def test_pool_with_a_dead_worker_is_replaced(pools):
+    pool = ProcessPoolExecutor(max_workers=1)
+    with pytest.raises(BrokenProcessPool):
+        pool.submit(os._exit, 1).result()
+    pools[1] = pool
+
+    result = IngestionPipeline(extract_workers=1).run([("bail.docx", _docx("Le préavis est de trois mois."))])
+    assert result['errors'] == []
+    assert [doc['name'] for doc in result['documents']] == ["bail.docx"]
+    assert pools[1] is not pool
+
+def test_broken_pool_is_reported_per_document(pools):
+    pools[1] = _BrokenPool()
+    result = IngestionPipeline(extract_workers=1).run([
+        ("bail.docx", _docx("Le préavis est de trois mois.")),
+        ("annexe.docx", _docx("Le dépôt de garantie est d'un mois."))
+    ])
+    assert [name for name, _ in result['errors']] == ["bail.docx"]
+    assert [doc['name'] for doc in result['documents']] == ["annexe.docx"]
+
+def _long_docx(paragraphs=30):
+    return _docx("\n".join(f"Article {i} : le locataire verse un loyer mensuel de {i} cents euros." for i in range(paragraphs)))
+
+def test_indexed_chunks_are_not_kept_and_batches_are_bounded(make_index, monkeypatch):
+    sizes = []
+
+    class RecordingQueue(ingestion.queue.Queue):
+        def put(self, item, block=True, timeout=None):
+            super().put(item, block, timeout)
+            if self.maxsize:
+                sizes.append(self.qsize())
+
+    monkeypatch.setattr(ingestion.queue, "Queue", RecordingQueue)
+    index = make_index()
+    pipeline = IngestionPipeline(extract_workers=1, embed_batch_size=2, chunk_size=120, chunk_overlap=20,
+                                 max_pending_batches=1)
+    result = pipeline.run([("bail.docx", _long_docx())], index=index)
+
+    assert result['errors'] == [] and result['indexed'] == ["bail.docx"]
+    assert result['chunks'] == []
+    assert result['documents'][0]['chunk_count'] == index.ntotal > 2
+    assert sizes and max(sizes) <= 1
+
+def test_duplicates_unchanged_files_and_renames(make_index):
+    index = make_index()
+    pipeline = IngestionPipeline(extract_workers=1)
+    bail = _docx("Le préavis du locataire est de trois mois.")
+
+    result = pipeline.run([("bail.docx", bail), ("copie.docx", bail)], index=index)
+    assert result['indexed'] == ["bail.docx"] and result['duplicates'] == ["copie.docx"]
+
+    result = pipeline.run([("bail.docx", bail)], index=index)
+    assert result['unchanged'] == ["bail.docx"] and result['indexed'] == []
+
+    # Même contenu sous un autre nom : le document est renommé, sans doublon dans l'index
+    result = pipeline.run([("bail-signé.docx", bail)], index=index)
+    assert result['indexed'] == ["bail-signé.docx"]
+    assert list(index.get_document_hashes().values()) == ["bail-signé.docx"]
+
+    # Nouveau contenu sous le même nom : l'ancienne version est remplacée
+    result = pipeline.run([("bail-signé.docx", _docx("Le préavis du locataire est d'un mois."))], index=index)
+    assert result['indexed'] == ["bail-signé.docx"]
+    hashes = index.get_document_hashes()
+    assert list(hashes.values()) == ["bail-signé.docx"] and result['documents'][0]['file_hash'] in hashes
+
+class _FailingEmbeddings:
+    """Embeddings qui échouent à partir du lot numéro fail_at"""
+    def __init__(self, embeddings, fail_at=2):
+        self.embeddings = embeddings
+        self.fail_at = fail_at
+        self.batches = 0
+
+    def embed_documents(self, texts):
+        self.batches += 1
+        if self.batches >= self.fail_at:
+            raise RuntimeError("embeddings indisponibles")
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
+
+def _indexed_sources(index, query):
+    _, _, chunks = index.search(query, k=50, min_similarity=0)
+    return {chunk['source'] for chunk in chunks}
+
+def test_failed_renamed_reupload_keeps_the_indexed_copy(make_index):
+    index = make_index()
+    pipeline = IngestionPipeline(extract_workers=1, embed_batch_size=2, chunk_size=120, chunk_overlap=20)
+    bail = _long_docx()
+    pipeline.run([("bail.docx", bail)], index=index)
+    ntotal = index.ntotal
+
+    # Le second lot échouerait : le contenu connu est renommé sans repasser par les embeddings
+    embeddings = index.embeddings = _FailingEmbeddings(index.embeddings)
+    result = pipeline.run([("bail-signé.docx", bail)], index=index)
+    index.embeddings = embeddings.embeddings
+    assert result['errors'] == [] and result['indexed'] == ["bail-signé.docx"]
+    assert result['documents'][0]['chunk_count'] == ntotal and embeddings.batches == 0
+    assert index.ntotal == ntotal
+    assert _indexed_sources(index, "loyer mensuel du locataire") == {"bail-signé.docx"}
+
+def test_failed_new_version_keeps_the_previous_one(make_index):
+    index = make_index()
+    pipeline = IngestionPipeline(extract_workers=1, embed_batch_size=2, chunk_size=120, chunk_overlap=20)
+    pipeline.run([("bail.docx", _long_docx())], index=index)
+    hashes, ntotal = index.get_document_hashes(), index.ntotal
+
+    embeddings = index.embeddings = _FailingEmbeddings(index.embeddings)
+    result = pipeline.run([("bail.docx", _long_docx(40))], index=index)
+    index.embeddings = embeddings.embeddings
+    assert [name for name, _ in result['errors']] == ["bail.docx"] and result['indexed'] == []
+    assert index.get_document_hashes() == hashes and index.ntotal == ntotal
+    assert _indexed_sources(index, "loyer mensuel du locataire") == {"bail.docx"}
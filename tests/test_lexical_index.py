@@ -0,0 +1,50 @@
+import pytest
+
+import lexical_index
+from lexical_index import BM25Index, reciprocal_rank_fusion, tokenize
+
+TEXTS = ["Article L.1234-5 du Code du travail sur le préavis.",
+         "Le préavis du locataire est de trois mois.",
+         "Délibération 2023/45 relative au stationnement."]
+
+def test_compound_identifiers_are_kept_and_split():
+    tokens = tokenize("Selon l'article L.1234-5, le préavis")
+    assert "l.1234-5" in tokens and "1234" in tokens
+    assert "preavis" in tokens and "le" not in tokens
+
+def test_search_ranks_exact_identifiers_and_skips_removed_documents():
+    index = BM25Index()
+    index.add([10, 11, 12], TEXTS)
+    ids, scores = index.search("délibération 2023/45")
+    assert ids.tolist() == [12] and scores[0] > 0
+    assert index.search("préavis", allowed=[11])[0].tolist() == [11]
+
+    index.remove([10])
+    assert index.search("L.1234-5")[0].tolist() == []
+    assert index.search("préavis")[0].tolist() == [11]
+
+@pytest.mark.parametrize("reload", [False, True])
+def test_compaction_and_reload_keep_the_scores(tmp_path, monkeypatch, reload):
+    pending = BM25Index()
+    pending.add([0, 1, 2], TEXTS)
+
+    # Seuil minimal : chaque add() compacte l'index
+    monkeypatch.setattr(lexical_index, "BM25_PENDING_MAX", 1)
+    compacted = BM25Index()
+    compacted.add([0, 1], TEXTS[:2])
+    compacted.add([2], TEXTS[2:])
+    assert compacted._pending == {}
+    if reload:
+        compacted.save(tmp_path / "bm25.npz")
+        compacted = BM25Index.load(tmp_path / "bm25.npz")
+
+    for query in ("préavis", "code du travail", "stationnement 2023"):
+        expected_ids, expected_scores = pending.search(query)
+        ids, scores = compacted.search(query)
+        assert ids.tolist() == expected_ids.tolist()
+        assert scores.tolist() == pytest.approx(expected_scores.tolist())
+
+def test_reciprocal_rank_fusion_rewards_agreement():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["b", "c", "d"]])
+    assert [item for item, _ in fused] == ["b", "c", "a", "d"]
+    assert fused[0][1] == pytest.approx(1 / 62 + 1 / 61)
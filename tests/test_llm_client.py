@@ -0,0 +1,116 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import llm_client
+from llm_client import AsyncLLMClient, LLMAPIError, LLMClient
+from mistral_stub import MistralStubServer
+
+def _payload(question="Quelle est la durée du préavis ?"):
+    return {"model": "mistral-tiny", "messages": [{"role": "user", "content": question}], "stream": False}
+
+def _content(result):
+    return result["choices"][0]["message"]["content"]
+
+@pytest.fixture(autouse=True)
+def no_jitter(monkeypatch):
+    # Gigue nulle : le backoff se réduit au Retry-After du serveur (tests rapides et déterministes)
+    monkeypatch.setattr(llm_client.random, "uniform", lambda low, high: 0.0)
+
+def test_retries_server_errors_then_succeeds():
+    with MistralStubServer(first_token_delay=0, fail_status=503, fail_count=2) as server:
+        client = LLMClient(server.url, "clé", rate_limit=0)
+        assert _content(client.complete(_payload())) == server.answer
+    assert len(server.requests) == 3
+    assert client.stats['retries'] == 2
+
+def test_429_waits_for_retry_after():
+    with MistralStubServer(first_token_delay=0, fail_status=429, fail_count=1, retry_after=0.3) as server:
+        client = LLMClient(server.url, "clé", rate_limit=0)
+        started = time.perf_counter()
+        assert _content(client.complete(_payload())) == server.answer
+        elapsed = time.perf_counter() - started
+    assert elapsed >= 0.3
+    assert len(server.requests) == 2
+
+def test_gives_up_after_max_retries_and_on_client_errors():
+    with MistralStubServer(first_token_delay=0, fail_status=503) as server:
+        client = LLMClient(server.url, "clé", rate_limit=0, max_retries=1)
+        with pytest.raises(LLMAPIError) as error:
+            client.complete(_payload())
+        assert error.value.status_code == 503
+        assert len(server.requests) == 2
+
+        server.requests.clear()
+        server.fail_status = 401
+        with pytest.raises(LLMAPIError) as error:
+            client.complete(_payload("autre question"))
+        assert error.value.status_code == 401
+        assert len(server.requests) == 1
+
+def test_identical_requests_in_flight_are_coalesced():
+    with MistralStubServer(first_token_delay=0.3) as server:
+        client = LLMClient(server.url, "clé", rate_limit=0)
+        with ThreadPoolExecutor(8) as executor:
+            results = list(executor.map(lambda _: client.complete(_payload()), range(8)))
+    assert len(server.requests) == 1
+    assert client.stats['coalesced'] == 7
+    assert all(_content(result) == server.answer for result in results)
+
+def test_concurrency_is_capped():
+    with MistralStubServer(first_token_delay=0.1) as server:
+        client = LLMClient(server.url, "clé", rate_limit=0, max_concurrency=2)
+        with ThreadPoolExecutor(6) as executor:
+            list(executor.map(lambda i: client.complete(_payload(f"question {i}")), range(6)))
+    assert len(server.requests) == 6
+    assert server.max_active_requests <= 2
+
+def test_backoff_does_not_hold_a_concurrency_slot():
+    with MistralStubServer(first_token_delay=0, fail_status=429, fail_count=1, retry_after=0.5) as server:
+        client = LLMClient(server.url, "clé", rate_limit=0, max_concurrency=1)
+        finished = {}
+
+        def call(question):
+            client.complete(_payload(question))
+            finished[question] = time.perf_counter()
+
+        with ThreadPoolExecutor(2) as executor:
+            executor.submit(call, "limitée")
+            time.sleep(0.1)
+            executor.submit(call, "pendant le backoff")
+    # La seconde requête passe pendant l'attente imposée à la première
+    assert finished["pendant le backoff"] < finished["limitée"]
+
+def test_async_cancellation_cancels_coalesced_callers():
+    pytest.importorskip("aiohttp")
+
+    async def scenario(url):
+        async with AsyncLLMClient(url, "clé", rate_limit=0) as client:
+            owner = asyncio.ensure_future(client.complete(_payload()))
+            await asyncio.sleep(0.05)
+            follower = asyncio.ensure_future(client.complete(_payload()))
+            await asyncio.sleep(0.05)
+            owner.cancel()
+            results = await asyncio.gather(owner, follower, return_exceptions=True)
+            assert all(isinstance(result, asyncio.CancelledError) for result in results)
+            assert client.stats['coalesced'] == 1
+            # Plus rien en vol : un nouvel appel part vers le serveur
+            return await client.complete(_payload())
+
+    with MistralStubServer(first_token_delay=0.3) as server:
+        assert _content(asyncio.run(scenario(server.url))) == server.answer
+    assert len(server.requests) == 2
+
+def test_shared_client_is_rebuilt_when_the_api_key_changes(monkeypatch):
+    import mistral_client
+
+    monkeypatch.setattr(mistral_client, "_llm_client", None)
+    monkeypatch.setattr(mistral_client, "MISTRAL_API_KEY", "ancienne")
+    client = mistral_client.get_llm_client()
+    assert mistral_client.get_llm_client() is client
+
+    monkeypatch.setattr(mistral_client, "MISTRAL_API_KEY", "nouvelle")
+    rebuilt = mistral_client.get_llm_client()
+    assert rebuilt is not client and rebuilt.headers()["Authorization"] == "Bearer nouvelle"
@@ -0,0 +1,46 @@
+import pytest
+
+import metrics
+from metrics import MetricsRegistry, span, trace
+
+def test_disabled_registry_records_nothing(monkeypatch):
+    monkeypatch.setattr(metrics, "registry", MetricsRegistry(enabled=False))
+    with trace() as stages:
+        with span("faiss"):
+            pass
+    metrics.inc("rag_questions_total")
+    assert stages == {}
+    assert metrics.registry.counters() == {}
+
+def test_spans_feed_the_histogram_and_the_current_trace(monkeypatch):
+    monkeypatch.setattr(metrics, "registry", MetricsRegistry(enabled=True))
+    with trace() as stages:
+        for _ in range(2):
+            with span("bm25"):
+                pass
+    # Les appels répétés d'une étape sont cumulés dans la trace
+    assert list(stages) == ["bm25"] and stages["bm25"] >= 0
+    assert metrics.registry.stage_stats()["bm25"]['count'] == 2
+
+def test_quantiles_are_interpolated_within_buckets():
+    registry = MetricsRegistry(enabled=True, buckets=(0.1, 0.2, 0.4))
+    for seconds in (0.05, 0.15, 0.15, 0.3):
+        registry.observe("rag_stage_seconds", seconds, stage="llm")
+    stats = registry.stage_stats()["llm"]
+    assert stats['mean_ms'] == pytest.approx(162.5)
+    # p95 : 3,8 observations sur 4, dans la dernière borne (0,2 ; 0,4]
+    assert stats['p95_ms'] == pytest.approx(360.0)
+
+def test_prometheus_export():
+    registry = MetricsRegistry(enabled=True, buckets=(0.1, 1.0))
+    registry.inc("rag_questions_total", mode="llm")
+    registry.observe("rag_stage_seconds", 0.5, stage="embedding")
+    registry.register_collector(lambda: [("rag_query_cache_size", {'cache': 'results'}, 3)])
+    registry.register_collector(lambda: 1 / 0)
+    lines = registry.render().splitlines()
+    assert 'rag_questions_total{mode="llm"} 1' in lines
+    assert 'rag_stage_seconds_bucket{stage="embedding",le="0.1"} 0' in lines
+    assert 'rag_stage_seconds_bucket{stage="embedding",le="+Inf"} 1' in lines
+    assert 'rag_stage_seconds_count{stage="embedding"} 1' in lines
+    assert "# TYPE rag_query_cache_size gauge" in lines
+    assert 'rag_query_cache_size{cache="results"} 3' in lines
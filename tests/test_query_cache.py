@@ -0,0 +1,45 @@
+import pytest
+
+import query_cache
+from query_cache import LRUCache, normalize_query
+
+def test_trivial_variants_share_an_entry():
+    assert normalize_query("  Quel est le  PRÉAVIS ? ") == normalize_query("quel est le préavis")
+
+def test_least_recently_used_entry_is_evicted():
+    cache = LRUCache(maxsize=2, ttl=0)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert cache.stats()['hits'] == 3 and cache.stats()['misses'] == 1
+
+def test_expired_entries_are_dropped(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(query_cache.time, "monotonic", lambda: now[0])
+    cache = LRUCache(maxsize=4, ttl=10)
+    cache.put("a", 1)
+    now[0] += 9
+    assert cache.get("a") == 1
+    now[0] += 2
+    assert cache.get("a") is None and cache.stats()['size'] == 0
+
+def test_repeated_searches_are_served_from_the_cache_until_the_index_changes(make_index, fake_embeddings):
+    pytest.importorskip("faiss")
+    index = make_index()
+    index.add([{'text': "Le préavis du locataire est de trois mois.", 'source': "bail.pdf",
+                'file_hash': "bail1", 'position': 0}])
+    first = index.search("Préavis du locataire ?", min_similarity=0)
+    calls = fake_embeddings.calls
+    assert index.search("préavis du locataire", min_similarity=0) == first
+    assert fake_embeddings.calls == calls
+
+    # Un ajout change la version de l'index : les résultats sont recalculés, l'embedding
+    # de la question reste en cache
+    index.add([{'text': "Le préavis du bailleur est de six mois.", 'source': "avenant.pdf",
+                'file_hash': "avenant1", 'position': 0}])
+    calls = fake_embeddings.calls
+    assert len(index.search("préavis du locataire", min_similarity=0)[2]) == 2
+    assert fake_embeddings.calls == calls
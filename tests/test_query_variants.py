@@ -0,0 +1,46 @@
+from mistral_client import canned_answer
+from query_variants import build_query_variants, fuse_results, previous_answer
+
+WELCOME = {"type": "answer", "text": "👋 Bienvenue dans l'Assistant Document Intelligent RAG !", "grounded": False}
+
+def test_first_turn_searches_the_raw_question_only():
+    assert build_query_variants("Quelle est la durée du préavis ?", [WELCOME]) == ["Quelle est la durée du préavis ?"]
+    assert build_query_variants("Quelle est la durée du préavis ?", []) == ["Quelle est la durée du préavis ?"]
+
+def test_follow_up_uses_previous_question_and_grounded_answer():
+    history = [
+        WELCOME,
+        {"type": "question", "text": "Quels sont les deux types de bail ?"},
+        {"type": "answer", "text": "Le bail commercial et le bail d'habitation.", "grounded": True},
+    ]
+    variants = build_query_variants("Et pour le deuxième ?", history)
+    assert variants[0] == "Et pour le deuxième ?"
+    assert variants[1] == "Quels sont les deux types de bail ? Et pour le deuxième ?"
+    assert "habitation" in variants[2]
+    assert "bienvenue" not in variants[2]
+
+def test_turn_after_canned_answer_ignores_its_text():
+    canned = canned_answer([], "Quelle est la durée du préavis ?")
+    history = [
+        WELCOME,
+        {"type": "question", "text": "Quelle est la durée du préavis ?"},
+        {"type": "answer", "text": canned, "grounded": False},
+    ]
+    assert previous_answer(history) is None
+    variants = build_query_variants("Et celle du bail ?", history)
+    assert len(variants) == 3
+    assert not any("information" in variant or "pertinente" in variant for variant in variants)
+
+def test_answer_must_directly_follow_a_question():
+    history = [{"type": "question", "text": "Durée du bail ?"}, {"type": "question", "text": "Loyer ?"}]
+    assert previous_answer(history) is None
+    assert previous_answer([WELCOME]) is None
+
+def test_fusion_favours_the_raw_question():
+    def result(ids):
+        return ([], [], [{'vector_id': vector_id, 'similarity': 0.5} for vector_id in ids])
+
+    _, _, chunks = fuse_results([result([1, 2]), result([2, 3]), result([2, 3])], k=3)
+    assert [chunk['vector_id'] for chunk in chunks][0] == 2
+    _, _, chunks = fuse_results([result([1]), result([3])], k=2)
+    assert [chunk['vector_id'] for chunk in chunks] == [1, 3]
@@ -0,0 +1,35 @@
+import time
+
+from reranker import rerank
+
+CHUNKS = [{'chunk_id': f"h-{i}", 'text': f"chunk {i}"} for i in range(6)]
+
+class SlowCrossEncoder:
+    """Cross-encoder factice : score = numéro du chunk, delay secondes par lot"""
+    def __init__(self, delay):
+        self.delay = delay
+        self.batches = 0
+
+    def predict(self, pairs, batch_size=None):
+        self.batches += 1
+        time.sleep(self.delay)
+        return [float(text.split()[-1]) for _, text in pairs]
+
+def test_rerank_orders_by_cross_encoder_score():
+    chunks, info = rerank("question", CHUNKS, top_n=3, time_budget=5, batch_size=2, model=SlowCrossEncoder(0))
+    assert info['reranked'] and info['scored'] == 6
+    assert [chunk['chunk_id'] for chunk in chunks] == ["h-5", "h-4", "h-3"]
+    assert chunks[0]['rerank_score'] == 5.0
+
+def test_budget_exhausted_keeps_vector_order():
+    model = SlowCrossEncoder(0.1)
+    chunks, info = rerank("question", CHUNKS, time_budget=0.15, batch_size=2, model=model)
+    assert not info['reranked'] and info['scored'] < len(CHUNKS)
+    assert model.batches < 3
+    assert chunks == CHUNKS
+
+def test_batch_finishing_past_the_budget_is_ignored():
+    # Le seul lot démarre dans le budget mais finit après : ses scores ne sont pas utilisés
+    chunks, info = rerank("question", CHUNKS, time_budget=0.05, batch_size=6, model=SlowCrossEncoder(0.1))
+    assert not info['reranked'] and info['scored'] == 0
+    assert chunks == CHUNKS
@@ -0,0 +1,31 @@
+import socket
+
+import pytest
+
+from rag_system import process_multiple_files
+from retrieval_client import RemoteIndex, RetrievalServiceError
+
+class _Upload:
+    def __init__(self, name, data):
+        self.name = name
+        self._data = data
+
+    def getvalue(self):
+        return self._data
+
+def _unused_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def test_unreachable_service_raises_service_error():
+    index = RemoteIndex(f"http://127.0.0.1:{_unused_port()}", timeout=2)
+    with pytest.raises(RetrievalServiceError) as error:
+        index.ingest([("bail.docx", b"...")])
+    assert error.value.status_code == 503
+
+def test_failed_remote_ingestion_is_reported_not_raised():
+    index = RemoteIndex(f"http://127.0.0.1:{_unused_port()}", timeout=2)
+    document_texts = {}
+    assert process_multiple_files([_Upload("bail.docx", b"...")], document_texts, index=index) == (0, [])
+    assert document_texts == {}
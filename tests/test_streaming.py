@@ -0,0 +1,29 @@
+import pytest
+
+import mistral_client
+from mistral_stub import MistralStubServer
+
+CONTEXT = [{'chunk_id': "h-0", 'text': "Le préavis est de trois mois.", 'source': "bail.pdf", 'file_hash': "h"}]
+
+@pytest.fixture
+def server(monkeypatch):
+    with MistralStubServer(first_token_delay=0, token_delay=0) as server:
+        monkeypatch.setattr(mistral_client, "MISTRAL_API_URL", server.url)
+        yield server
+
+def test_stream_yields_the_answer_token_by_token(server):
+    parts = list(mistral_client.stream_mistral_api(CONTEXT, "Quelle est la durée du préavis ?"))
+    assert len(parts) == len(server.tokens())
+    assert "".join(parts) == server.answer
+    assert server.requests[0]["stream"] is True
+
+def test_interrupted_stream_ends_with_a_warning(server):
+    server.drop_after = 3
+    events = list(mistral_client._stream_mistral_events(CONTEXT, "Quelle est la durée du préavis ?", []))
+    assert [kind for kind, _ in events] == ["token"] * 3 + ["error"]
+    assert "interrompue" in events[-1][1]
+
+def test_error_status_is_reported_without_tokens(server):
+    server.fail_status = 401
+    events = list(mistral_client._stream_mistral_events(CONTEXT, "Quelle est la durée du préavis ?", []))
+    assert [kind for kind, _ in events] == ["error"]
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("faiss")
+
+from vector_index import choose_index_type, exact_search, recall_at_k
+
+# Vocabulaire assez large pour que deux chunks aient rarement le même vecteur (pas d'ex aequo)
+WORDS = [f"terme{i}" for i in range(300)]
+
+def _corpus(size, seed=0):
+    rng = np.random.default_rng(seed)
+    return [{'text': " ".join(rng.choice(WORDS, 8)), 'source': f"doc{i // 20}.pdf", 'file_hash': f"h{i // 20}",
+             'position': i % 20} for i in range(size)]
+
+def test_index_type_follows_corpus_size():
+    assert [choose_index_type(n) for n in (100, 50_000, 500_000, 5_000_000)] == ["flat", "hnsw", "ivf", "ivfpq"]
+
+@pytest.mark.parametrize("index_type, min_recall", [("flat", 1.0), ("hnsw", 0.9), ("ivf", 0.9), ("ivfpq", 0.8)])
+def test_recall_per_index_type(make_index, index_type, min_recall):
+    index = make_index(index_type=index_type)
+    index.add(_corpus(600))
+    assert index.index_type == index_type
+    recall = index.evaluate_recall(k=5, sample_size=50)
+    assert recall['index_type'] == index_type
+    assert recall['recall'] >= min_recall
+
+def test_ivfpq_falls_back_to_flat_below_its_training_size(make_index):
+    index = make_index(index_type="ivfpq")
+    index.add(_corpus(100))
+    assert index.index_type == "flat"
+
+def test_rebuild_rereads_stored_vectors(make_index, fake_embeddings):
+    index = make_index(index_type="flat")
+    index.add(_corpus(600))
+    calls = fake_embeddings.calls
+    # Flat/HNSW : vecteurs relus dans FAISS ; IVF : relus dans le cache d'embeddings
+    for index_type in ("hnsw", "ivf", "flat"):
+        index.rebuild(index_type)
+        assert index.index_type == index_type
+    assert fake_embeddings.calls == calls
+
+def test_ivf_requires_the_embedding_cache(make_index):
+    index = make_index(cached=False, index_type="ivf")
+    with pytest.raises(ValueError):
+        index.add(_corpus(100))
+    # En automatique, le palier IVF retombe sur HNSW sans cache
+    assert make_index(cached=False)._target_index_type(500_000) == "hnsw"
+
+def test_recall_at_k():
+    vectors = np.eye(4, dtype=np.float32)
+    _, exact_ids = exact_search(vectors, [10, 11, 12, 13], vectors[:2], 1)
+    assert exact_ids.tolist() == [[10], [11]]
+    assert recall_at_k([[10], [12]], exact_ids, 1) == 0.5
@@ -1,40 +1,141 @@
-from PyPDF2 import PdfReader
-import docx
-import streamlit as st
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-
-def extract_text(file):
-    """Extraction du texte PDF ou DOCX avec meilleure gestion des erreurs"""
-    try:
-        if file.name.endswith(".pdf"):
-            reader = PdfReader(file)
-            text = ""
-            for page_num, page in enumerate(reader.pages, 1):
-                page_text = page.extract_text() or ""
-                # Ajout du numéro de page pour référence
-                text += f"\n[Page {page_num}]\n{page_text}\n"
-            return text.strip()
-        elif file.name.endswith(".docx"):
-            doc = docx.Document(file)
-            full_text = []
-            for para in doc.paragraphs:
-                if para.text.strip():
-                    full_text.append(para.text)
-            return "\n".join(full_text)
+import hashlib
+import threading
+from contextlib import contextmanager
+
+# Le découpeur LangChain est importé au premier usage : ni le premier affichage de
+# l'interface ni les processus d'extraction n'en paient le coût
+
+class ReadWriteLock:
+    """Verrou lecteurs/rédacteur : lectures concurrentes, écriture exclusive
+
+    L'écriture est réentrante, et le thread qui écrit peut aussi lire. Un rédacteur en attente
+    bloque les nouveaux lecteurs (pas de famine des modifications).
+    """
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writer = None
+        self._depth = 0
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        owner = self._writer == threading.get_ident()
+        if not owner:
+            with self._condition:
+                while self._writer is not None or self._waiting_writers:
+                    self._condition.wait()
+                self._readers += 1
+        try:
+            yield
+        finally:
+            if not owner:
+                with self._condition:
+                    self._readers -= 1
+                    if not self._readers:
+                        self._condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        me = threading.get_ident()
+        with self._condition:
+            if self._writer == me:
+                self._depth += 1
+            else:
+                self._waiting_writers += 1
+                while self._writer is not None or self._readers:
+                    self._condition.wait()
+                self._waiting_writers -= 1
+                self._writer, self._depth = me, 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._depth -= 1
+                if not self._depth:
+                    self._writer = None
+                    self._condition.notify_all()
+
+def content_hash(data):
+    """Hash SHA-256 (tronqué) d'un contenu : octets d'un fichier ou texte d'un chunk"""
+    if isinstance(data, str):
+        data = data.encode()
+    return hashlib.sha256(data).hexdigest()[:16]
+
+# Recouvrement maximal recherché entre deux chunks consécutifs (cf. PageSplitter)
+MAX_OVERLAP_CHARS = 200
+
+def overlap_length(left, right, max_chars=MAX_OVERLAP_CHARS):
+    """Longueur du plus long suffixe de left qui est aussi un préfixe de right"""
+    for size in range(min(max_chars, len(left), len(right)), 0, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+class PageSplitter:
+    """Découpage incrémental page par page, avec la plage de pages de chaque chunk
+
+    Seul un tampon de quelques chunks est conservé entre deux appels : la mémoire reste
+    bornée quelle que soit la taille du document. feed() et finish() retournent des tuples
+    (texte, première page, dernière page).
+    """
+    def __init__(self, chunk_size=800, overlap=100):
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        self.splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=overlap,
+            length_function=len,
+        )
+        # Au-delà de cette taille, le tampon est découpé et seul le dernier chunk est reporté
+        self.flush_size = 4 * chunk_size
+        self.buffer = ""
+        # Début de chaque page dans le tampon : (offset, numéro de page)
+        self.spans = []
+
+    def feed(self, pages):
+        for page_num, page_text in pages:
+            if not page_text.strip():
+                continue
+            if self.buffer:
+                self.buffer += "\n"
+            self.spans.append((len(self.buffer), page_num))
+            self.buffer += page_text
+        if len(self.buffer) < self.flush_size:
+            return []
+        return self._split(final=False)
+
+    def finish(self):
+        return self._split(final=True) if self.buffer.strip() else []
+
+    def _page_at(self, offset):
+        page = self.spans[0][1]
+        for start, page_num in self.spans:
+            if start > offset:
+                break
+            page = page_num
+        return page
+
+    def _split(self, final):
+        located = []
+        cursor = 0
+        for chunk in self.splitter.split_text(self.buffer):
+            start = self.buffer.find(chunk, cursor)
+            if start < 0:
+                start = cursor
+            located.append((chunk, start))
+            cursor = start + 1
+
+        carry = None
+        if not final and len(located) > 1:
+            # Le dernier chunk peut se prolonger sur la page suivante : il est reporté
+            carry = located.pop()[1]
+
+        result = [(chunk, self._page_at(start), self._page_at(start + len(chunk) - 1)) for chunk, start in located]
+        if carry is None:
+            self.buffer = ""
+            self.spans = []
         else:
-            return ""
-    except Exception as e:
-        st.error(f"❌ Erreur lors de l'extraction du document: {str(e)}")
-        return ""
-
-def split_text(text, chunk_size=800, overlap=100):
-    """Découpe le texte en segments plus intelligents avec meilleure préservation du contexte"""
-    # ✅ UTILISATION DE LANGCHAIN POUR LE DECOUPAGE
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size,
-        chunk_overlap=overlap,
-        length_function=len,
-    )
-    
-    chunks = text_splitter.split_text(text)
-    return chunks
\ No newline at end of file
+            self.spans = [(max(0, start - carry), page_num) for i, (start, page_num) in enumerate(self.spans)
+                          if i + 1 == len(self.spans) or self.spans[i + 1][0] > carry]
+            self.buffer = self.buffer[carry:]
+        return result
\ No newline at end of file
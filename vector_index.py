@@ -0,0 +1,162 @@
+import os
+
+import numpy as np
+
+# faiss est importé au premier usage : ouvrir l'application ne charge pas la bibliothèque
+
+# -----------------------
+# CONFIGURATION INDEX VECTORIEL
+# -----------------------
+
+# "auto" choisit le type d'index selon le nombre de chunks
+INDEX_TYPE = os.environ.get("RAG_INDEX_TYPE", "auto")
+INDEX_TYPES = ("flat", "hnsw", "ivf", "ivfpq")
+
+# Seuils (nombre de vecteurs) du choix automatique
+FLAT_MAX = 20_000
+HNSW_MAX = 300_000
+IVF_MAX = 2_000_000
+
+# Stockage des vecteurs dans l'index : float32 exact, ou quantification scalaire float16 / int8
+# (mémoire divisée par 2 / 4, similarités recalculées exactement sur les meilleurs candidats)
+VECTOR_STORAGE = os.environ.get("RAG_VECTOR_STORAGE", "float32")
+VECTOR_STORAGES = ("float32", "float16", "int8")
+# Quantificateurs scalaires FAISS (attributs de faiss.ScalarQuantizer)
+_SQ_TYPES = {
+    'float16': "QT_fp16",
+    'int8': "QT_8bit",
+}
+
+DEFAULT_PARAMS = {
+    'M': 32,                # voisins par nœud HNSW
+    'ef_construction': 80,
+    'ef_search': 64,
+    'nlist': None,          # None : calculé à partir de la taille du corpus
+    'nprobe': 16,
+    'pq_m': 16,             # sous-quantificateurs PQ (doit diviser la dimension)
+    'pq_nbits': 8,
+    'storage': VECTOR_STORAGE,
+    'rescore_factor': 4,    # candidats relus par résultat quand le stockage est avec pertes
+}
+
+def choose_index_type(ntotal):
+    """Type d'index adapté à la taille du corpus"""
+    if ntotal < FLAT_MAX:
+        return "flat"
+    if ntotal < HNSW_MAX:
+        return "hnsw"
+    if ntotal < IVF_MAX:
+        return "ivf"
+    return "ivfpq"
+
+def resolve_params(ntotal, overrides=None):
+    params = dict(DEFAULT_PARAMS)
+    params.update({key: value for key, value in (overrides or {}).items() if value is not None})
+    if not params['nlist']:
+        # Règle usuelle : ~4·sqrt(n) listes, au moins 39 vecteurs d'entraînement par liste
+        params['nlist'] = int(max(1, min(4 * np.sqrt(max(ntotal, 1)), ntotal // 39 or 1)))
+    return params
+
+def build_index(index_type, dimension, vectors, params):
+    """Construit (et entraîne si nécessaire) un index FAISS adressé par identifiants int64
+
+    Les vecteurs sont normalisés (voir normalize_vectors) et comparés par produit scalaire :
+    les scores renvoyés par FAISS sont des similarités cosinus.
+    """
+    import faiss
+
+    storage = params['storage']
+    if storage not in VECTOR_STORAGES:
+        raise ValueError(f"Stockage de vecteurs inconnu : {storage} (attendu : {', '.join(VECTOR_STORAGES)})")
+    sq_type = getattr(faiss.ScalarQuantizer, _SQ_TYPES[storage]) if storage in _SQ_TYPES else None
+    metric = faiss.METRIC_INNER_PRODUCT
+
+    if index_type == "flat":
+        if sq_type is None:
+            return faiss.IndexIDMap2(faiss.IndexFlatIP(dimension))
+        index = faiss.IndexScalarQuantizer(dimension, sq_type, metric)
+        index.train(np.ascontiguousarray(vectors, dtype=np.float32))
+        return faiss.IndexIDMap2(index)
+
+    if index_type == "hnsw":
+        if sq_type is None:
+            hnsw = faiss.IndexHNSWFlat(dimension, params['M'], metric)
+        else:
+            hnsw = faiss.IndexHNSWSQ(dimension, sq_type, params['M'], metric)
+            hnsw.train(np.ascontiguousarray(vectors, dtype=np.float32))
+        hnsw.hnsw.efConstruction = params['ef_construction']
+        hnsw.hnsw.efSearch = params['ef_search']
+        return faiss.IndexIDMap2(hnsw)
+
+    quantizer = faiss.IndexFlatIP(dimension)
+    if index_type == "ivf":
+        if sq_type is None:
+            index = faiss.IndexIVFFlat(quantizer, dimension, params['nlist'], metric)
+        else:
+            index = faiss.IndexIVFScalarQuantizer(quantizer, dimension, params['nlist'], sq_type, metric)
+    elif index_type == "ivfpq":
+        # Les codes PQ sont déjà compacts : le choix de stockage ne s'applique pas
+        index = faiss.IndexIVFPQ(quantizer, dimension, params['nlist'], params['pq_m'], params['pq_nbits'], metric)
+    else:
+        raise ValueError(f"Type d'index inconnu : {index_type} (attendu : {', '.join(INDEX_TYPES)})")
+
+    train_index(index, vectors, params)
+    index.nprobe = params['nprobe']
+    return index
+
+def normalize_vectors(vectors):
+    """Copie float32 contiguë des vecteurs, normalisés (norme L2 = 1) ligne par ligne"""
+    import faiss
+
+    vectors = np.array(vectors, dtype=np.float32, order="C", ndmin=2)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+def is_lossy(index_type, params):
+    """Vrai si l'index ne conserve qu'une approximation des vecteurs (quantification)"""
+    return index_type == "ivfpq" or params['storage'] != "float32"
+
+def index_memory_bytes(index):
+    """Taille de l'index FAISS sérialisé (≈ mémoire occupée par les vecteurs et la structure)"""
+    import faiss
+
+    return int(faiss.serialize_index(index).nbytes)
+
+def train_index(index, vectors, params):
+    """Entraîne les centroïdes IVF sur un échantillon du corpus"""
+    sample_size = min(len(vectors), params['nlist'] * 256)
+    if sample_size < len(vectors):
+        rng = np.random.default_rng(0)
+        vectors = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    index.train(np.ascontiguousarray(vectors, dtype=np.float32))
+
+def supports_removal(index_type):
+    # HNSW ne sait pas retirer de vecteurs : on utilise des pierres tombales
+    return index_type != "hnsw"
+
+def apply_search_params(index, index_type, params):
+    """Applique les paramètres de recherche (nprobe, efSearch) à un index existant"""
+    import faiss
+
+    if index_type in ("ivf", "ivfpq"):
+        faiss.extract_index_ivf(index).nprobe = params['nprobe']
+    elif index_type == "hnsw":
+        faiss.downcast_index(index.index).hnsw.efSearch = params['ef_search']
+
+def exact_search(vectors, ids, queries, k):
+    """Recherche exacte (force brute, produit scalaire) servant de référence pour le rappel"""
+    import faiss
+
+    flat = faiss.IndexIDMap2(faiss.IndexFlatIP(vectors.shape[1]))
+    flat.add_with_ids(normalize_vectors(vectors), np.asarray(ids, dtype=np.int64))
+    return flat.search(normalize_vectors(queries), k)
+
+def recall_at_k(approx_ids, exact_ids, k):
+    """Proportion des k voisins exacts retrouvés par l'index approché"""
+    hits = 0
+    total = 0
+    for approx_row, exact_row in zip(approx_ids, exact_ids):
+        expected = {i for i in exact_row[:k] if i >= 0}
+        hits += len(expected & {i for i in approx_row[:k] if i >= 0})
+        total += len(expected)
+    return hits / total if total else 1.0